@@ -0,0 +1,185 @@
+""" The benchmarked hot paths of UString. Each case is registered with the size parameters it depends on, and its
+setup function returns the function to time (without arguments) for one combination of the sizes.
+"""
+import io
+import os
+import sys
+import contextlib
+import subprocess
+from collections import OrderedDict
+import numpy as np
+import torch
+
+CASES = OrderedDict()
+
+
+def case(name, params):
+    """ Register the setup function of a benchmark case.
+    :param: params, the names of the size parameters of the case, e.g., ['batch_size', 'n_obj']
+    """
+    def register(setup):
+        CASES[name] = (params, setup)
+        return setup
+    return register
+
+
+def import_case(module):
+    """ :return: the import of the module in a new interpreter, run from the root of the repo
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, '-c', 'import %s' % (module)]
+    return lambda: subprocess.run(command, cwd=root, check=True)
+
+
+def make_graph(batch_size, n_frames, n_obj):
+    """ :return: graph_edges (B x T x 2 x E), edge_weights (B x T x E) of random detections, as in the DataLoader
+    """
+    from src.DataLoader import generate_st_graph
+    detections = np.random.rand(n_frames, n_obj, 6).astype(np.float32)
+    graph_edges, edge_weights = generate_st_graph(detections)
+    graph_edges = torch.Tensor(np.stack(graph_edges)).long().unsqueeze(0).repeat(batch_size, 1, 1, 1)
+    edge_weights = torch.Tensor(edge_weights).unsqueeze(0).repeat(batch_size, 1, 1)
+    return graph_edges, edge_weights
+
+
+def make_batch(batch_size, n_frames, n_obj, dim_feature):
+    """ :return: a training batch of random features with half positive videos
+    """
+    graph_edges, edge_weights = make_graph(batch_size, n_frames, n_obj)
+    batch_xs = torch.randn(batch_size, n_frames, n_obj + 1, dim_feature)
+    batch_ys = torch.zeros(batch_size, 2)
+    batch_ys[:batch_size // 2, 1] = 1
+    batch_ys[batch_size // 2:, 0] = 1
+    batch_toas = torch.full((batch_size, 1), float(n_frames + 1))
+    batch_toas[:batch_size // 2] = int(0.9 * n_frames)
+    return batch_xs, batch_ys, graph_edges, edge_weights, batch_toas
+
+
+def make_model(n_frames, n_obj, dim_feature, hidden_dim):
+    from src.Models import UString
+    return UString(dim_feature, hidden_dim, hidden_dim, n_layers=1, n_obj=n_obj, n_frames=n_frames,
+                   fps=20.0, with_saa=True, uncertain_ranking=True)
+
+
+@case('generate_st_graph', ['n_frames', 'n_obj'])
+def bench_generate_st_graph(n_frames, n_obj, **unused):
+    from src.DataLoader import generate_st_graph
+    detections = np.random.rand(n_frames, n_obj, 6).astype(np.float32)
+    return lambda: generate_st_graph(detections)
+
+
+def gcn_conv_case(batch_size, n_obj, hidden_dim, dense_max_nodes=None):
+    from src.Models import GCNConv
+    layer = GCNConv(hidden_dim + hidden_dim, hidden_dim)
+    if dense_max_nodes is not None:
+        layer.dense_max_nodes = dense_max_nodes
+    graph_edges, edge_weights = make_graph(batch_size, 1, n_obj)
+    x = torch.randn(batch_size, n_obj, hidden_dim + hidden_dim)
+
+    def run():
+        with torch.no_grad():
+            layer(x, graph_edges[:, 0], edge_weight=edge_weights[:, 0])
+    return run
+
+
+@case('gcn_conv_forward', ['batch_size', 'n_obj', 'hidden_dim'])
+def bench_gcn_conv(batch_size, n_obj, hidden_dim, **unused):
+    """ the operator selected by the number of objects """
+    return gcn_conv_case(batch_size, n_obj, hidden_dim)
+
+
+@case('gcn_conv_dense', ['batch_size', 'n_obj', 'hidden_dim'])
+def bench_gcn_conv_dense(batch_size, n_obj, hidden_dim, **unused):
+    """ dense adjacency matmul for any number of objects """
+    return gcn_conv_case(batch_size, n_obj, hidden_dim, dense_max_nodes=n_obj)
+
+
+@case('gcn_conv_sparse', ['batch_size', 'n_obj', 'hidden_dim'])
+def bench_gcn_conv_sparse(batch_size, n_obj, hidden_dim, **unused):
+    """ sparse edge propagation for any number of objects """
+    return gcn_conv_case(batch_size, n_obj, hidden_dim, dense_max_nodes=0)
+
+
+@case('graph_gru_step', ['batch_size', 'n_obj', 'hidden_dim'])
+def bench_graph_gru(batch_size, n_obj, hidden_dim, **unused):
+    from src.Models import Graph_GRU_GCN
+    rnn = Graph_GRU_GCN(hidden_dim * 3, hidden_dim, 1, bias=True)
+    graph_edges, edge_weights = make_graph(batch_size, 1, n_obj)
+    x = torch.randn(batch_size, n_obj, hidden_dim * 3)
+    h = torch.zeros(1, batch_size, n_obj, hidden_dim)
+
+    def run():
+        with torch.no_grad():
+            rnn(x, graph_edges[:, 0], h, edge_weight=edge_weights[:, 0])
+    return run
+
+
+@case('sample_elbo', ['batch_size', 'n_obj', 'hidden_dim', 'npass'])
+def bench_sample_elbo(batch_size, n_obj, hidden_dim, npass, **unused):
+    from src.Models import BayesianPredictor
+    predictor = BayesianPredictor(n_obj * hidden_dim, 2)
+    embed = torch.randn(batch_size, n_obj * hidden_dim)
+
+    def run():
+        with torch.no_grad():
+            predictor.sample_elbo(embed, npass=npass, eval_uncertain=True)
+    return run
+
+
+@case('ustring_train_step', ['batch_size', 'n_frames', 'n_obj', 'dim_feature', 'hidden_dim'])
+def bench_ustring_train_step(batch_size, n_frames, n_obj, dim_feature, hidden_dim, **unused):
+    """ forward (npass=2) and backward of a training iteration """
+    model = make_model(n_frames, n_obj, dim_feature, hidden_dim)
+    model.train()
+    batch_xs, batch_ys, graph_edges, edge_weights, batch_toas = make_batch(batch_size, n_frames, n_obj, dim_feature)
+
+    def run():
+        model.zero_grad()
+        losses, _, _ = model(batch_xs, batch_ys, batch_toas, graph_edges, edge_weights=edge_weights, npass=2, nbatch=80, eval_uncertain=True)
+        total_loss = 0.001 * (losses['log_posterior'] - losses['log_prior']) + losses['cross_entropy']
+        total_loss += 10 * losses['auxloss'] + 10 * losses['ranking']
+        total_loss.mean().backward()
+    return run
+
+
+@case('ustring_inference', ['batch_size', 'n_frames', 'n_obj', 'dim_feature', 'hidden_dim'])
+def bench_ustring_inference(batch_size, n_frames, n_obj, dim_feature, hidden_dim, **unused):
+    """ forward of the test phase (npass=10 with uncertainties) """
+    model = make_model(n_frames, n_obj, dim_feature, hidden_dim)
+    model.eval()
+    batch_xs, batch_ys, graph_edges, edge_weights, batch_toas = make_batch(batch_size, n_frames, n_obj, dim_feature)
+
+    def run():
+        with torch.no_grad():
+            model(batch_xs, batch_ys, batch_toas, graph_edges, edge_weights=edge_weights, npass=10, eval_uncertain=True)
+    return run
+
+
+@case('evaluation', ['n_videos', 'n_frames'])
+def bench_evaluation(n_videos, n_frames, **unused):
+    from src.eval_tools import evaluation
+    all_labels = (np.arange(n_videos) % 2).astype(np.float32)
+    all_toas = np.where(all_labels > 0, np.random.randint(n_frames // 2, n_frames, n_videos), n_frames + 1)
+    all_pred = np.clip(np.random.rand(n_videos, n_frames) * 0.6 + all_labels[:, None] * np.linspace(0, 0.4, n_frames), 0, 1)
+
+    def run():
+        # the metrics are printed by evaluation()
+        with contextlib.redirect_stdout(io.StringIO()):
+            evaluation(all_pred, all_labels, all_toas, fps=20.0)
+    return run
+
+
+@case('import_inference', [])
+def bench_import_inference(**unused):
+    """ cold start of an inference worker (including torch) """
+    return import_case('src.inference')
+
+
+@case('import_main', [])
+def bench_import_main(**unused):
+    return import_case('main')
+
+
+@case('import_demo', [])
+def bench_import_demo(**unused):
+    return import_case('demo')
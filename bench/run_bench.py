@@ -0,0 +1,159 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os, sys
+import time
+import json
+import argparse
+import platform
+import itertools
+import subprocess
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench.cases import CASES
+
+# the sizes of the presets, a size given on the command line overrides the preset
+PRESETS = {'small': {'batch_size': [2], 'n_frames': [20], 'n_obj': [19], 'dim_feature': [512], 'hidden_dim': [64],
+                     'npass': [2, 10], 'n_videos': [500]},
+           'dad': {'batch_size': [10], 'n_frames': [100], 'n_obj': [19], 'dim_feature': [4096], 'hidden_dim': [256],
+                   'npass': [2, 10], 'n_videos': [2000]},
+           'objects': {'batch_size': [10], 'n_frames': [20], 'n_obj': [19, 50, 100, 200], 'dim_feature': [4096], 'hidden_dim': [256],
+                       'npass': [10], 'n_videos': [2000]}}
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Microbenchmarks of the UString hot paths with a regression baseline')
+    parser.add_argument('--preset', type=str, default='small', choices=list(PRESETS.keys()),
+                        help='The default sizes, small for quick checks, dad for the sizes of DAD training, or objects for the scaling with the number of objects. Default: small')
+    parser.add_argument('--cases', type=str, nargs='+', default=list(CASES.keys()), choices=list(CASES.keys()),
+                        help='The cases to run. Default: all')
+    for name in PRESETS['small'].keys():
+        parser.add_argument('--%s' % (name), type=int, nargs='+', default=None,
+                            help='The values of %s to sweep. Default: the preset' % (name))
+    parser.add_argument('--warmup', type=int, default=2,
+                        help='The number of untimed warmup calls of each case. Default: 2')
+    parser.add_argument('--repeats', type=int, default=7,
+                        help='The number of timed samples of each case. Default: 7')
+    parser.add_argument('--min_time', type=float, default=0.05,
+                        help='The minimal time (seconds) of a sample, fast cases are called several times per sample. Default: 0.05')
+    parser.add_argument('--num_threads', type=int, default=1,
+                        help='The number of torch CPU threads (0 for the torch default). Default: 1')
+    parser.add_argument('--output', type=str, default='',
+                        help='The json file of the results, e.g., bench/baseline.json to store a baseline. Default: bench/results/<time>.json')
+    parser.add_argument('--baseline', type=str, default='',
+                        help='The json file of the baseline results to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='The relative slowdown of the median time over the baseline reported as a regression. Default: 0.10')
+    return parser.parse_args()
+
+
+def case_key(name, params):
+    return '%s[%s]' % (name, ','.join('%s=%s' % (k, v) for k, v in sorted(params.items())))
+
+
+def time_case(run, warmup=2, repeats=7, min_time=0.05):
+    """ :return: the per-call times (seconds) of repeats samples, each of them averaged over enough calls to last min_time
+    """
+    for _ in range(warmup):
+        run()
+    # calibrate the number of calls of a sample
+    number, elapsed = 1, 0.0
+    while True:
+        t_start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - t_start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number = number * 2 if elapsed <= 0 else max(number * 2, int(min_time / elapsed * number) + 1)
+    times = []
+    for _ in range(repeats):
+        t_start = time.perf_counter()
+        for _ in range(number):
+            run()
+        times.append((time.perf_counter() - t_start) / number)
+    return np.array(times), number
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ''
+    return {'python': platform.python_version(), 'torch': torch.__version__, 'numpy': np.__version__,
+            'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'num_threads': torch.get_num_threads(), 'commit': commit, 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def compare(results, baseline, tolerance):
+    """ Print the ratio of the median times to the baseline.
+    :return: the keys of the regressed cases
+    """
+    base = {result['key']: result for result in baseline['results']}
+    for name in ['torch', 'num_threads', 'processor']:
+        if baseline['env'].get(name) != results['env'].get(name):
+            print("Warning: %s differs from the baseline (%s vs. %s)" % (name, results['env'].get(name), baseline['env'].get(name)))
+    regressions = []
+    print('\n%-80s %12s %12s %8s' % ('case', 'base (ms)', 'now (ms)', 'ratio'))
+    for result in results['results']:
+        if result['key'] not in base:
+            print('%-80s %12s %12.3f %8s' % (result['key'], '-', result['median_ms'], 'new'))
+            continue
+        ratio = result['median_ms'] / base[result['key']]['median_ms']
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = ' REGRESSION'
+            regressions.append(result['key'])
+        elif ratio < 1 - tolerance:
+            flag = ' faster'
+        print('%-80s %12.3f %12.3f %8.3f%s' % (result['key'], base[result['key']]['median_ms'], result['median_ms'], ratio, flag))
+    return regressions
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    sizes = {name: getattr(args, name) if getattr(args, name) is not None else values for name, values in PRESETS[args.preset].items()}
+
+    results = {'env': environment(), 'settings': {'preset': args.preset, 'warmup': args.warmup, 'repeats': args.repeats,
+                                                  'min_time': args.min_time}, 'results': []}
+    print('%-80s %12s %12s %12s %8s' % ('case', 'median (ms)', 'min (ms)', 'iqr (ms)', 'calls'))
+    for name in args.cases:
+        params, setup = CASES[name]
+        for values in itertools.product(*[sizes[param] for param in params]):
+            config = dict(zip(params, values))
+            # the same inputs and weights for every run
+            torch.manual_seed(123)
+            np.random.seed(123)
+            times, number = time_case(setup(**config), warmup=args.warmup, repeats=args.repeats, min_time=args.min_time)
+            times = times * 1000
+            result = {'key': case_key(name, config), 'case': name, 'params': config, 'median_ms': float(np.median(times)),
+                      'mean_ms': float(np.mean(times)), 'min_ms': float(np.min(times)), 'std_ms': float(np.std(times)),
+                      'iqr_ms': float(np.percentile(times, 75) - np.percentile(times, 25)), 'calls_per_sample': number,
+                      'samples_ms': times.tolist()}
+            results['results'].append(result)
+            print('%-80s %12.3f %12.3f %12.3f %8d' % (result['key'], result['median_ms'], result['min_ms'], result['iqr_ms'], number))
+
+    output = args.output if args.output else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', time.strftime('%Y%m%d_%H%M%S.json'))
+    if not os.path.exists(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Results saved in: %s" % (output))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if len(regressions) > 0:
+            print("%d regressions beyond the tolerance of %.0f%%" % (len(regressions), args.tolerance * 100))
+            sys.exit(1)
+        print("No regression beyond the tolerance of %.0f%%" % (args.tolerance * 100))
@@ -3,19 +3,18 @@ from __future__ import division
 from __future__ import print_function
 
 import numpy as np
-import cv2
-import os, sys
 import os.path as osp
 import argparse
 import torch
 import torch.nn as nn
-from torchvision import models, transforms
-from PIL import Image
-import matplotlib.pyplot as plt
+from src.DataLoader import generate_st_graph, pad_objects
+from src.inference import load_model
+# the detection (mmdet), feature extraction (torchvision) and video (cv2) packages are imported by the tasks using them
 
 class VGG16(nn.Module):
     def __init__(self):
         super(VGG16, self).__init__()
+        from torchvision import models
         VGG = models.vgg16(pretrained=True)
         self.feature = VGG.features
         self.classifier = nn.Sequential(*list(VGG.classifier.children())[:-3])
@@ -32,6 +31,12 @@ class VGG16(nn.Module):
         output = self.classifier(output)
         return output
 
+    def roi_align_features(self):
+        """ :return: the features of the boxes pooled from conv5_3 (without pool5) to the 7 x 7 input of the classifier
+        """
+        from src.roi_features import RoIAlignFeatures
+        return RoIAlignFeatures(self.feature[:-1], nn.Sequential(nn.Flatten(), self.classifier), self.dim_feat, spatial_scale=1.0 / 16)
+
 def init_feature_extractor(backbone='vgg16', device=torch.device('cuda')):
     feat_extractor = None
     if backbone == 'vgg16':
@@ -43,10 +48,11 @@ def init_feature_extractor(backbone='vgg16', device=torch.device('cuda')):
     return feat_extractor
 
 
-def bbox_sampling(bbox_result, nbox=19, imsize=None, topN=5):
+def bbox_sampling(bbox_result, nbox=19, imsize=None, topN=5, zero_pad=False):
     """
     imsize[0]: height
     imsize[1]: width
+    zero_pad: return at most nbox boxes, instead of resampling the top boxes up to nbox
     """
     assert not isinstance(bbox_result, tuple)
     bboxes = np.vstack(bbox_result)  # n x 5
@@ -66,6 +72,8 @@ def bbox_sampling(bbox_result, nbox=19, imsize=None, topN=5):
     if len(new_boxes) == 0:  # no bboxes
         new_boxes.append([0, 0, imsize[1]-1, imsize[0]-1, 1.0, 0])
     new_boxes = np.array(new_boxes, dtype=int)
+    if zero_pad:
+        return new_boxes[:nbox]
     # sampling
     n_candidate = min(topN, len(new_boxes))
     if len(new_boxes) <= nbox - n_candidate:
@@ -81,6 +89,7 @@ def bbox_sampling(bbox_result, nbox=19, imsize=None, topN=5):
 
 
 def bbox_to_imroi(transform, bboxes, image):
+    from PIL import Image
     imroi_data = []
     for bbox in bboxes:
         imroi = image[bbox[1]:bbox[3], bbox[0]:bbox[2], :]
@@ -89,118 +98,104 @@ def bbox_to_imroi(transform, bboxes, image):
     imroi_data = torch.stack(imroi_data)
     return imroi_data
 
-def extract_features(detector, feat_extractor, video_file, n_frames=100, n_boxes=19):
-    assert os.path.join(video_file), video_file
-    # prepare video reader and data transformer
-    videoReader = mmcv.VideoReader(video_file)
+def extract_features(detector, feat_extractor, video_file, n_frames=100, n_boxes=19, zero_pad=False, batch_frames=4, queue_size=16,
+                     detect=None, device=torch.device('cuda'), feature_mode='crop', sample_fps=None):
+    """ Object detection and feature extraction of a video. A thread decodes the frames into a bounded queue, while the
+    detector runs on batches of frames, and the box crops and the frames of a batch go through the backbone at once.
+    :param: batch_frames: the number of frames in a batch, i.e., batch_frames x (n_boxes + 1) images per backbone pass
+            of the 'crop' mode, or batch_frames frames of the 'roi_align' mode
+    :param: queue_size: the maximum number of decoded frames waiting for the detector
+    :param: detect: the detection of a list of BGR frames, detect(detector, frames) -> the list of their bbox results
+            (per class arrays of x1, y1, x2, y2, score), mmdet.apis.inference_detector by default
+    :param: feature_mode: 'crop', the backbone runs on the crop of each box, or 'roi_align', the box features are pooled
+            from the feature map of the frame (see src/roi_features.py)
+    :param: sample_fps: the fps the video is resampled to, None for all frames
+    :return: detections (n_frames x n_boxes x 6) and features (n_frames x (1 + n_boxes) x dim_feat)
+    """
+    import itertools
+    import cv2
+    from torchvision import transforms
+    from PIL import Image
+    from src.roi_features import ROI_IMAGE_SIZE
+    from src.video_io import FrameSource
+    if detect is None:
+        from mmdet.apis import inference_detector
+        # mmdet 1.x returns a generator for a list of images
+        detect = lambda model, frames: list(inference_detector(model, frames))
     transform = transforms.Compose([
         transforms.Resize(256),
         transforms.CenterCrop(224),
         transforms.ToTensor()]
     )
+    frame_transform = transform
+    if feature_mode == 'roi_align':
+        # the whole frame goes through the backbone
+        frame_transform = transforms.Compose([transforms.Resize(ROI_IMAGE_SIZE), transforms.ToTensor()])
+        roi_extractor = feat_extractor.roi_align_features()
+
+    def prepare(frame):
+        # in the decoding thread, the BGR frame, the RGB frame and the transformed RGB frame
+        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return frame, frame_rgb, frame_transform(Image.fromarray(frame_rgb))
+
     features = np.zeros((n_frames, n_boxes + 1, feat_extractor.dim_feat), dtype=np.float32)
     detections = np.zeros((n_frames, n_boxes, 6))  # (50 x 19 x 6)
-    frame_prev = None
-    for idx in range(n_frames):
-        if idx >= len(videoReader):
-            print("Copy frame from previous time step.")
-            frame = frame_prev.copy()
-        else:
-            frame = videoReader.get_frame(idx)
-        # run object detection inference
-        bbox_result = inference_detector(detector, frame)
-        # sampling a fixed number of bboxes
-        bboxes = bbox_sampling(bbox_result, nbox=n_boxes, imsize=frame.shape[:2])
-        detections[idx, :, :] = bboxes
-        # prepare frame data
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        with torch.no_grad():
-            # bboxes to roi feature
-            ims_roi = bbox_to_imroi(transform, bboxes, frame)
-            ims_roi = ims_roi.float().to(device=device)
-            feature_roi = feat_extractor(ims_roi)
-            # extract image feature
-            ims_frame = transform(Image.fromarray(frame))
-            ims_frame = torch.unsqueeze(ims_frame, dim=0).float().to(device=device)
-            feature_frame = feat_extractor(ims_frame)
-        # obtain feature matrix
-        features[idx, 0, :] = np.squeeze(feature_frame.cpu().numpy()) if feature_frame.is_cuda else np.squeeze(feature_frame.detach().numpy())
-        features[idx, 1:, :] = np.squeeze(feature_roi.cpu().numpy()) if feature_roi.is_cuda else np.squeeze(feature_roi.detach().numpy())
-        frame_prev = frame
+    # the last frame of a short video is repeated
+    frames = iter(FrameSource(video_file, n_frames=n_frames, fps=sample_fps, prefetch=queue_size, pad=True, transform=prepare))
+    try:
+        idx = 0
+        while True:
+            batch = list(itertools.islice(frames, batch_frames))
+            if len(batch) == 0:
+                break
+            # run object detection inference on the batch
+            bbox_results = detect(detector, [frame for frame, _, _ in batch])
+            ims, all_bboxes, n_rois = [], [], []
+            for (frame, frame_rgb, im_frame), bbox_result in zip(batch, bbox_results):
+                # sampling a fixed number of bboxes
+                bboxes = bbox_sampling(bbox_result, nbox=n_boxes, imsize=frame.shape[:2], zero_pad=zero_pad)
+                detections[idx + len(n_rois), :len(bboxes), :] = bboxes
+                ims.append(im_frame.unsqueeze(0))
+                if feature_mode == 'roi_align':
+                    all_bboxes.append(bboxes)
+                else:
+                    # the frame followed by its box crops
+                    ims.append(bbox_to_imroi(transform, bboxes, frame_rgb))
+                n_rois.append(len(bboxes))
+            with torch.no_grad():
+                ims = torch.cat(ims).float().to(device=device)
+                if feature_mode == 'roi_align':
+                    feature_batch = roi_extractor(ims, all_bboxes, batch[0][0].shape[:2]).cpu().numpy()
+                else:
+                    feature_batch = feat_extractor(ims).cpu().numpy()
+            # obtain feature matrix
+            start = 0
+            for n_roi in n_rois:
+                features[idx, :n_roi + 1, :] = feature_batch[start:start + n_roi + 1]
+                start += n_roi + 1
+                idx += 1
+    finally:
+        frames.close()
     return detections, features
 
 
-def init_accident_model(model_file, dim_feature=4096, hidden_dim=256, latent_dim=256, n_obj=19, n_frames=50, fps=10.0):
-    # building model
-    model = UString(dim_feature, hidden_dim, latent_dim, 
-        n_layers=1, n_obj=n_obj, n_frames=n_frames, fps=fps, with_saa=False, uncertain_ranking=True)
-    model = model.to(device=device)
-    model.eval()
-    # load check point
-    model, _, _ = load_checkpoint(model, filename=model_file, isTraining=False)
-    return model
+def init_accident_model(model_file, dim_feature=4096, hidden_dim=256, latent_dim=256, n_obj=19, n_frames=50, fps=10.0, readout='flatten'):
+    # building model, a distilled student (script/distill.py) is built from its own config
+    return load_model(model_file, dim_feature=dim_feature, hidden_dim=hidden_dim, latent_dim=latent_dim, n_obj=n_obj,
+                      n_frames=n_frames, fps=fps, readout=readout, device=device)
 
 
-def load_input_data(feature_file, device=torch.device('cuda')):
+def load_input_data(feature_file, device=torch.device('cuda'), n_obj=None, top_k=None):
     # load feature file and return the transformed data
     data = np.load(feature_file)
     features = data['data']  # 50 x 20 x 4096
     labels = [0, 1]
     detections = data['det']  # 50 x 19 x 6
     toa = [45]  # [useless]
+    if n_obj is not None:
+        features, detections = pad_objects(features, detections, n_obj)
 
-    def generate_st_graph(detections):
-        # create graph edges
-        num_frames, num_boxes = detections.shape[:2]
-        num_edges = int(num_boxes * (num_boxes - 1) / 2)
-        graph_edges = []
-        edge_weights = np.zeros((num_frames, num_edges), dtype=np.float32)
-        for i in range(num_frames):
-            # generate graph edges (fully-connected)
-            edge = generate_graph_from_list(range(num_boxes))
-            graph_edges.append(np.transpose(np.stack(edge).astype(np.int32)))  # 2 x 171
-            # compute the edge weights by distance
-            edge_weights[i] = compute_graph_edge_weights(detections[i, :, :4], edge)  # 171,
-        return graph_edges, edge_weights
-
-    def generate_graph_from_list(L, create_using=None):
-        import networkx, itertools
-        G = networkx.empty_graph(len(L),create_using)
-        if len(L)>1:
-            if G.is_directed():
-                    edges = itertools.permutations(L,2)
-            else:
-                    edges = itertools.combinations(L,2)
-            G.add_edges_from(edges)
-        graph_edges = list(G.edges())
-
-        return graph_edges
-
-    def compute_graph_edge_weights(boxes, edges):
-        """
-        :param: boxes: (19, 4)
-        :param: edges: (171, 2)
-        :return: weights: (171,)
-        """
-        N = boxes.shape[0]
-        assert len(edges) == N * (N-1) / 2
-        weights = np.ones((len(edges),), dtype=np.float32)
-        for i, edge in enumerate(edges):
-            c1 = [0.5 * (boxes[edge[0], 0] + boxes[edge[0], 2]),
-                0.5 * (boxes[edge[0], 1] + boxes[edge[0], 3])]
-            c2 = [0.5 * (boxes[edge[1], 0] + boxes[edge[1], 2]),
-                0.5 * (boxes[edge[1], 1] + boxes[edge[1], 3])]
-            d = (c1[0] - c2[0])**2 + (c1[1] - c2[1])**2
-            weights[i] = np.exp(-d)
-        # normalize weights
-        if np.sum(weights) > 0:
-            weights = weights / np.sum(weights)  # N*(N-1)/2,
-        else:
-            weights = np.ones((len(edges),), dtype=np.float32)
-
-        return weights
-
-    graph_edges, edge_weights = generate_st_graph(detections)
+    graph_edges, edge_weights = generate_st_graph(detections, top_k=top_k)
     # transform to torch.Tensor
     features = torch.Tensor(np.expand_dims(features, axis=0)).to(device)         #  50 x 20 x 4096
     labels = torch.Tensor(np.expand_dims(labels, axis=0)).to(device)
@@ -213,25 +208,6 @@ def load_input_data(feature_file, device=torch.device('cuda')):
     return features, labels, graph_edges, edge_weights, toa, detections, vid
 
 
-def load_checkpoint(model, optimizer=None, filename='checkpoint.pth.tar', isTraining=True):
-    # Note: Input model & optimizer should be pre-defined.  This routine only updates their states.
-    start_epoch = 0
-    if os.path.isfile(filename):
-        checkpoint = torch.load(filename)
-        start_epoch = checkpoint['epoch']
-        # filter out modules only used in training
-        pretrained_dict = {k: v for k, v in checkpoint['model'].items() if not any(filtered in k for filtered in ['self_aggregation', 'predictor_aux'])}
-        model.load_state_dict(pretrained_dict)
-        # model.load_state_dict(checkpoint['model'])
-        if isTraining:
-            optimizer.load_state_dict(checkpoint['optimizer'])
-        # print("=> loaded checkpoint '{}' (epoch {})".format(filename, checkpoint['epoch']))
-    else:
-        print("=> no checkpoint found at '{}'".format(filename))
-
-    return model, optimizer, start_epoch
-
-
 def parse_results(all_outputs, batch_size=1, n_frames=50):
     # parse inference results
     pred_score = np.zeros((batch_size, n_frames), dtype=np.float32)
@@ -253,30 +229,15 @@ def parse_results(all_outputs, batch_size=1, n_frames=50):
     return pred_score, pred_au, pred_eu
 
 
-def get_video_frames(video_file, n_frames=50):
-    # get the video data
-    cap = cv2.VideoCapture(video_file)
-    ret, frame = cap.read()
-    video_data = []
-    counter = 0
-    while (ret):
-        video_data.append(frame)
-        ret, frame = cap.read()
-        counter += 1
-    assert len(video_data) >= n_frames, video_file
-    video_data = video_data[:n_frames]
-    return video_data
-
-
 def preprocess_results(pred_score, aleatoric, epistemic, cumsum=False):
     from scipy.interpolate import make_interp_spline
     std_alea = 1.0 * np.sqrt(aleatoric)
     std_epis = 1.0 * np.sqrt(epistemic)
     # sampling
     xvals = np.linspace(0,len(pred_score)-1,10)
-    pred_mean_reduce = pred_score[xvals.astype(np.int)]
-    pred_std_alea_reduce = std_alea[xvals.astype(np.int)]
-    pred_std_epis_reduce = std_epis[xvals.astype(np.int)]
+    pred_mean_reduce = pred_score[xvals.astype(int)]
+    pred_std_alea_reduce = std_alea[xvals.astype(int)]
+    pred_std_epis_reduce = std_epis[xvals.astype(int)]
     # smoothing
     xvals_new = np.linspace(1,len(pred_score)+1, p.n_frames)
     pred_score = make_interp_spline(xvals, pred_mean_reduce)(xvals_new)
@@ -296,13 +257,25 @@ def preprocess_results(pred_score, aleatoric, epistemic, cumsum=False):
     return xvals, pred_score, std_alea, std_epis
 
 
-def draw_curve(xvals, pred_score, std_alea, std_epis):
-    ax.fill_between(xvals, pred_score - std_alea, pred_score + std_alea, facecolor='wheat', alpha=0.5)
-    ax.fill_between(xvals, pred_score - std_epis, pred_score + std_epis, facecolor='yellow', alpha=0.5)
-    plt.plot(xvals, pred_score, linewidth=3.0)
-    plt.axhline(y=0.5, xmin=0, xmax=max(xvals)/(p.n_frames + 2), linewidth=3.0, color='g', linestyle='--')
-    # plt.grid(True)
-    plt.tight_layout()
+def profile_inference(feature_file, model_file, n_frames=50, fps=10.0, warmup=3, n_iters=10, trace_iters=1, profile_dir='demo/profile',
+                      n_obj=19, top_k=None, readout='flatten'):
+    """ Profile the stages of repeated inference on the same feature file.
+    """
+    from src.profiler import StageProfiler, stage
+    features = load_input_data(feature_file, device=device, n_obj=n_obj, top_k=top_k)[0]
+    model = init_accident_model(model_file, dim_feature=features.shape[-1], n_obj=n_obj, n_frames=n_frames, fps=fps, readout=readout)
+    profiler = StageProfiler(warmup=warmup, n_iters=n_iters, trace_iters=trace_iters, profile_dir=profile_dir, device=device).start()
+    while True:
+        with stage('load_input'):
+            features, labels, graph_edges, edge_weights, toa, detections, vid = load_input_data(feature_file, device=device, n_obj=n_obj, top_k=top_k)
+        with stage('forward'), torch.no_grad():
+            _, all_outputs, _ = model(features, labels, toa, graph_edges, hidden_in=None, edge_weights=edge_weights, npass=10, eval_uncertain=True)
+        with stage('parse_results'):
+            parse_results(all_outputs, n_frames=n_frames)
+        if not profiler.step():
+            break
+    profiler.stop()
+    profiler.summary()
 
 
 def set_random_seed(seed):
@@ -323,23 +296,40 @@ if __name__ == '__main__':
     parser.add_argument('--seed', type=int, help='The random seed.', default=123)
     parser.add_argument('--fps', type=float, help='The fps of input video.', default=10.0)
     parser.add_argument('--fps_display', type=float, help='The fps of output video.', default=2.0)
+    parser.add_argument('--n_obj', type=int, help='The number of objects of each frame.', default=19)
     # feature extraction
     parser.add_argument('--video_file', type=str, default='demo/000821.mp4')
     parser.add_argument('--mmdetection', type=str, help="the path to the mmdetection.", default="lib/mmdetection")
+    parser.add_argument('--zero_pad', action='store_true', help="zero pad the frames with fewer detections instead of resampling their boxes.")
+    parser.add_argument('--batch_frames', type=int, help="the number of frames in a batch of the detector and the feature extractor.", default=4)
+    parser.add_argument('--queue_size', type=int, help="the maximum number of frames decoded ahead of the detector (or the visualization).", default=16)
+    parser.add_argument('--sample_fps', type=float, help="resample the video to this fps in the feature extraction and the visualization (default: all frames).", default=None)
+    parser.add_argument('--feature_mode', type=str, help="the backbone pass on each box crop (crop) or on each frame with RoIAlign pooling of the boxes (roi_align).",
+                        default='crop', choices=['crop', 'roi_align'])
     # inference
     parser.add_argument('--feature_file', type=str, help="the path to the feature file.", default="demo/000821_feature.npz")
     parser.add_argument('--ckpt_file', type=str, help="the path to the model file.", default="demo/final_model_ccd.pth")
+    parser.add_argument('--pred_cache', type=str, help="the directory of the prediction cache.", default="demo/pred_cache")
+    parser.add_argument('--no_cache', action='store_true', help="always run inference without the prediction cache.")
+    parser.add_argument('--top_k', type=int, help="the number of nearest neighbours of each object (0 for complete graphs, default by --n_obj).", default=None)
+    parser.add_argument('--readout', type=str, help="the readout of the model (flatten or mean).", default='flatten', choices=['flatten', 'mean'])
     # visualize
     parser.add_argument('--result_file', type=str, help="the path to the result file.", default="demo/000821_result.npz")
     parser.add_argument('--vis_file', type=str, help="the path to the visualization file.", default="demo/000821_vis.avi")
+    parser.add_argument('--show', action='store_true', help="show the composed frames in a window while writing them.")
+    # profiling
+    parser.add_argument('--profile', action='store_true', help="profile the stages of repeated inference instead of saving results.")
+    parser.add_argument('--profile_warmup', type=int, help="the number of warmup runs before profiling.", default=3)
+    parser.add_argument('--profile_iters', type=int, help="the number of profiled runs in the summary table.", default=10)
+    parser.add_argument('--profile_trace_iters', type=int, help="the number of runs in the Chrome trace (0 for no trace).", default=1)
+    parser.add_argument('--profile_dir', type=str, help="the directory of the profiling results.", default="demo/profile")
     p = parser.parse_args()
 
     set_random_seed(p.seed)
 
     device = torch.device('cuda:'+str(p.gpu_id)) if torch.cuda.is_available() else torch.device('cpu')
     if p.task == 'extract_feature':
-        from mmdet.apis import init_detector, inference_detector, show_result
-        import mmcv
+        from mmdet.apis import init_detector
         # init object detector
         cfg_file = osp.join(p.mmdetection, "configs/cascade_rcnn_x101_64x4d_fpn_1x_kitti2d.py")
         model_file = osp.join(p.mmdetection, "work_dirs/cascade_rcnn_x101_64x4d_fpn_1x_kitti2d/latest.pth")
@@ -347,58 +337,61 @@ if __name__ == '__main__':
         # init feature extractor
         feat_extractor = init_feature_extractor(backbone='vgg16', device=device)
         # object detection & feature extraction
-        detections, features = extract_features(detector, feat_extractor, p.video_file, n_frames=p.n_frames)
+        detections, features = extract_features(detector, feat_extractor, p.video_file, n_frames=p.n_frames, n_boxes=p.n_obj, zero_pad=p.zero_pad,
+                                                batch_frames=p.batch_frames, queue_size=p.queue_size, device=device, feature_mode=p.feature_mode,
+                                                sample_fps=p.sample_fps)
         feat_file = p.video_file[:-4] + '_feature.npz'
-        np.savez_compressed(feat_file, data=features, det=detections)
+        np.savez_compressed(feat_file, data=features, det=detections, feature_mode=p.feature_mode)
+    elif p.task == 'inference' and p.profile:
+        profile_inference(p.feature_file, p.ckpt_file, n_frames=p.n_frames, fps=p.fps, warmup=p.profile_warmup,
+                          n_iters=p.profile_iters, trace_iters=p.profile_trace_iters, profile_dir=p.profile_dir,
+                          n_obj=p.n_obj, top_k=p.top_k, readout=p.readout)
     elif p.task == 'inference':
-        from src.Models import UString
+        from src.pred_cache import PredictionCache, prediction_key
         # load feature file
-        features, labels, graph_edges, edge_weights, toa, detections, vid = load_input_data(p.feature_file, device=device)
-        # prepare model
-        model = init_accident_model(p.ckpt_file, dim_feature=features.shape[-1], n_frames=p.n_frames, fps=p.fps)
-        with torch.no_grad():
-            # run inference
-            _, all_outputs, _ = model(features, labels, toa, graph_edges, hidden_in=None, edge_weights=edge_weights, npass=10, eval_uncertain=True)
-        # parse and save results
-        pred_score, pred_au, pred_eu = parse_results(all_outputs, n_frames=p.n_frames)
+        features, labels, graph_edges, edge_weights, toa, detections, vid = load_input_data(p.feature_file, device=device, n_obj=p.n_obj, top_k=p.top_k)
+        # the predictions are determined by the checkpoint, the features and the settings below
+        cache = None if p.no_cache else PredictionCache(p.pred_cache)
+        config = {'runner': 'demo', 'dim_feature': features.shape[-1], 'n_frames': p.n_frames, 'fps': p.fps,
+                  'npass': 10, 'seed': p.seed, 'device': device.type, 'n_obj': p.n_obj, 'top_k': p.top_k, 'readout': p.readout}
+        key = prediction_key([p.ckpt_file, p.feature_file], config)
+        cached = cache.get(key) if cache is not None else None
+        if cached is None:
+            # prepare model
+            model = init_accident_model(p.ckpt_file, dim_feature=features.shape[-1], n_obj=p.n_obj, n_frames=p.n_frames, fps=p.fps, readout=p.readout)
+            with torch.no_grad():
+                # run inference
+                _, all_outputs, _ = model(features, labels, toa, graph_edges, hidden_in=None, edge_weights=edge_weights, npass=10, eval_uncertain=True)
+            # parse and save results
+            pred_score, pred_au, pred_eu = parse_results(all_outputs, n_frames=p.n_frames)
+            if cache is not None:
+                cache.put(key, {'score': pred_score, 'aleatoric': pred_au, 'epistemic': pred_eu},
+                          meta={'checkpoint': osp.abspath(p.ckpt_file), 'feature_file': osp.abspath(p.feature_file), 'runner': 'demo', 'seed': p.seed})
+        else:
+            print("Predictions loaded from cache: %s"%(cache.entry_dir(key)))
+            pred_score, pred_au, pred_eu = cached['score'], cached['aleatoric'], cached['epistemic']
         result_file = osp.join(osp.dirname(p.feature_file), p.feature_file.split('/')[-1].split('_')[0] + '_result.npz')
         np.savez_compressed(result_file, score=pred_score[0], aleatoric=pred_au[0], epistemic=pred_eu[0], det=detections[0])
     elif p.task == 'visualize':
-        video_data = get_video_frames(p.video_file, n_frames=p.n_frames)
+        import cv2
+        from src.overlay import CurveOverlay
+        from src.video_io import FrameSource
         all_results = np.load(p.result_file, allow_pickle=True)
         pred_score, aleatoric, epistemic, detections = all_results['score'], all_results['aleatoric'], all_results['epistemic'], all_results['det']
         xvals, pred_score, std_alea, std_epis = preprocess_results(pred_score, aleatoric, epistemic, cumsum=False)
 
-        fig, ax = plt.subplots(1, figsize=(24, 3.5))
-        fontsize = 25
-        plt.ylim(0, 1.1)
-        plt.xlim(0, len(xvals)+1)
-        plt.ylabel('Probability', fontsize=fontsize)
-        plt.xlabel('Frame (FPS=%d)'%(p.fps), fontsize=fontsize)
-        plt.xticks(range(0, len(xvals)+1, int(p.n_frames / p.fps_display)), fontsize=fontsize)
-        plt.yticks(fontsize=fontsize)
-
-        from matplotlib.animation import FFMpegWriter
-        curve_writer = FFMpegWriter(fps=p.fps_display, metadata=dict(title='Movie Test', artist='Matplotlib',comment='Movie support!'))
-        with curve_writer.saving(fig, "demo/curve_video.mp4", 100):
-            for t in range(len(xvals)):
-                draw_curve(xvals[:(t+1)], pred_score[:(t+1)], std_alea[:(t+1)], std_epis[:(t+1)])
-                curve_writer.grab_frame()
-        curve_frames = get_video_frames("demo/curve_video.mp4", n_frames=p.n_frames)
-
-        # create video writer
-        video_writer = cv2.VideoWriter(p.vis_file, cv2.VideoWriter_fourcc(*'DIVX'), p.fps_display, (video_data[0].shape[1], video_data[0].shape[0]))
-        for t, frame in enumerate(video_data):
-            det_boxes = detections[t]  # 19 x 6
-            for box in det_boxes:
-                if box[4] > 0:
-                    print(box[4])
-                cv2.rectangle(frame, (int(box[0]), int(box[1])), (int(box[2]), int(box[3])), (0, 255, 0), 3)
-            img = curve_frames[t]
-            width = frame.shape[1]
-            height = int(img.shape[0] * (width / img.shape[1]))
-            img = cv2.resize(img, (width, height), interpolation = cv2.INTER_AREA)
-            frame[frame.shape[0]-height:frame.shape[0]] = cv2.addWeighted(frame[frame.shape[0]-height:frame.shape[0]], 0.3, img, 0.7, 0)
+        # frames are read, composed and written one by one without any intermediate video
+        overlay, video_writer, t = None, None, -1
+        for t, frame in enumerate(FrameSource(p.video_file, n_frames=p.n_frames, fps=p.sample_fps, prefetch=p.queue_size)):
+            if overlay is None:
+                overlay = CurveOverlay(frame.shape[1], p.n_frames, fps=p.fps, fps_display=p.fps_display)
+                video_writer = cv2.VideoWriter(p.vis_file, cv2.VideoWriter_fourcc(*'DIVX'), p.fps_display, (frame.shape[1], frame.shape[0]))
+            overlay.compose(frame, xvals[:(t+1)], pred_score[:(t+1)], std_alea[:(t+1)], std_epis[:(t+1)], detections=detections[t])
             video_writer.write(frame)
+            if p.show:
+                cv2.imshow('UString', frame)
+                cv2.waitKey(1)
+        assert t + 1 == p.n_frames, p.video_file
+        video_writer.release()
     else:
         print("invalid task.")
@@ -9,15 +9,21 @@ import torch
 import os, time
 import argparse
 import shutil
+import copy
 
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
+from torch.utils.data.distributed import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel
+import torch.distributed as dist
 from src.Models import UString
-from src.eval_tools import evaluation, print_results, vis_results
-import ipdb
-import matplotlib.pyplot as plt
-from tensorboardX import SummaryWriter
-from tqdm import tqdm
-from sklearn.metrics import average_precision_score
+from src.eval_tools import EvalAccumulator, print_results, vis_results
+from src.pred_cache import PredictionCache, prediction_key
+from src.pred_store import PredictionWriter, PredictionReader
+from src.metrics_logger import MetricsLogger
+from src.eval_worker import EvalWorker, model_state, snapshot_state, load_snapshot
+from src.checkpoint import CheckpointManager, rng_state, set_rng_state
+from src.profiler import StageProfiler, stage, timed_iter
+from src.feature_cache import open_feature_cache
 
 seed = 123
 np.random.seed(seed)
@@ -44,11 +50,25 @@ def average_losses(losses_all):
     return losses_mean
 
 
+def parse_outputs(all_outputs, eval_uncertain=True):
+    """ Convert the per-frame outputs of UString into arrays with a single device transfer.
+    :return: pred_frames (B x T) accident scores, pred_uncertains (B x T x 2) aleatoric and epistemic uncertainties
+    """
+    pred = torch.stack([output['pred_mean'] for output in all_outputs], dim=1).detach().cpu().numpy()  # B x T x 2
+    pred_frames = np.exp(pred[:, :, 1]) / np.sum(np.exp(pred), axis=-1)
+    pred_uncertains = None
+    if eval_uncertain:
+        aleatoric = torch.stack([output['aleatoric'] for output in all_outputs], dim=1)  # B x T x 2 x 2
+        epistemic = torch.stack([output['epistemic'] for output in all_outputs], dim=1)  # B x T x 2 x 2
+        pred_uncertains = torch.stack([aleatoric[..., 0, 0] + aleatoric[..., 1, 1],
+                                       epistemic[..., 0, 0] + epistemic[..., 1, 1]], dim=-1)
+        pred_uncertains = pred_uncertains.detach().cpu().numpy()
+    return pred_frames, pred_uncertains
+
+
 def test_all(testdata_loader, model):
     
-    all_pred = []
-    all_labels = []
-    all_toas = []
+    accumulator = EvalAccumulator()
     losses_all = []
     with torch.no_grad():
         for i, (batch_xs, batch_ys, graph_edges, edge_weights, batch_toas) in enumerate(testdata_loader):
@@ -61,150 +81,133 @@ def test_all(testdata_loader, model):
             losses['total_loss'] += p.loss_yita * losses['ranking']
             losses_all.append(losses)
 
-            num_frames = batch_xs.size()[1]
-            batch_size = batch_xs.size()[0]
-            pred_frames = np.zeros((batch_size, num_frames), dtype=np.float32)
-            # run inference
-            for t in range(num_frames):
-                pred = all_outputs[t]['pred_mean']
-                pred = pred.cpu().numpy() if pred.is_cuda else pred.detach().numpy()
-                pred_frames[:, t] = np.exp(pred[:, 1]) / np.sum(np.exp(pred), axis=1)
             # gather results and ground truth
-            all_pred.append(pred_frames)
-            label_onehot = batch_ys.cpu().numpy()
-            label = np.reshape(label_onehot[:, 1], [batch_size,])
-            all_labels.append(label)
-            toas = np.squeeze(batch_toas.cpu().numpy()).astype(np.int)
-            all_toas.append(toas)
-
-    all_pred = np.vstack((np.vstack(all_pred[:-1]), all_pred[-1]))
-    all_labels = np.hstack((np.hstack(all_labels[:-1]), all_labels[-1]))
-    all_toas = np.hstack((np.hstack(all_toas[:-1]), all_toas[-1]))
+            pred_frames, _ = parse_outputs(all_outputs, eval_uncertain=False)
+            label = batch_ys.cpu().numpy()[:, 1]
+            toas = np.reshape(batch_toas.cpu().numpy(), (-1,)).astype(int)
+            accumulator.update(pred_frames, label, toas)
     
-    return all_pred, all_labels, all_toas, losses_all
+    return accumulator, losses_all
 
 
-def test_all_vis(testdata_loader, model, vis=True, multiGPU=False, device=torch.device('cuda')):
-    
+def test_all_vis(testdata_loader, model, vis=True, multiGPU=False, device=torch.device('cuda'), store=None):
+    """ :param: store, a PredictionWriter. If given, the results of each batch are written into it instead of
+               being kept in vis_data, and the batches already in the store are skipped.
+    """
+    from tqdm import tqdm
     if multiGPU:
         model = torch.nn.DataParallel(model)
     model = model.to(device=device)
     model.eval()
 
-    all_pred = []
-    all_labels = []
-    all_toas = []
+    accumulator = EvalAccumulator()
     vis_data = []
-    all_uncertains = []
+    if store is not None and store.n_shards > 0:
+        # resume after the written batches
+        print("Resume from %d written batches."%(store.n_shards))
+        accumulator = PredictionReader(store.store_dir).accumulator()
+        testdata_loader = DataLoader(dataset=Subset(testdata_loader.dataset, range(store.n_videos, len(testdata_loader.dataset))),
+                                     batch_size=testdata_loader.batch_size, shuffle=False, drop_last=testdata_loader.drop_last)
+    # the batch iterator draws a random seed when it is created, so it is created before restoring the random states
+    batches = iter(testdata_loader)
+    if store is not None and store.rng_states() is not None:
+        set_rng_states(store.rng_states())
     with torch.no_grad():
-        for i, (batch_xs, batch_ys, graph_edges, edge_weights, batch_toas, detections, video_ids) in tqdm(enumerate(testdata_loader), desc="batch progress", total=len(testdata_loader)):
+        for i, (batch_xs, batch_ys, graph_edges, edge_weights, batch_toas, detections, video_ids) in tqdm(enumerate(batches), desc="batch progress", total=len(testdata_loader)):
             # run forward inference
             losses, all_outputs, hiddens = model(batch_xs, batch_ys, batch_toas, graph_edges, 
                     hidden_in=None, edge_weights=edge_weights, npass=10, nbatch=len(testdata_loader), testing=False, eval_uncertain=True)
 
-            num_frames = batch_xs.size()[1]
-            batch_size = batch_xs.size()[0]
-            pred_frames = np.zeros((batch_size, num_frames), dtype=np.float32)
-            pred_uncertains = np.zeros((batch_size, num_frames, 2), dtype=np.float32)
-            # run inference
-            for t in range(num_frames):
-                # prediction
-                pred = all_outputs[t]['pred_mean']  # B x 2
-                pred = pred.cpu().numpy() if pred.is_cuda else pred.detach().numpy()
-                pred_frames[:, t] = np.exp(pred[:, 1]) / np.sum(np.exp(pred), axis=1)
-                # uncertainties
-                aleatoric = all_outputs[t]['aleatoric']  # B x 2 x 2
-                aleatoric = aleatoric.cpu().numpy() if aleatoric.is_cuda else aleatoric.detach().numpy()
-                epistemic = all_outputs[t]['epistemic']  # B x 2 x 2
-                epistemic = epistemic.cpu().numpy() if epistemic.is_cuda else epistemic.detach().numpy()
-                pred_uncertains[:, t, 0] = aleatoric[:, 0, 0] + aleatoric[:, 1, 1]
-                pred_uncertains[:, t, 1] = epistemic[:, 0, 0] + epistemic[:, 1, 1]
-
             # gather results and ground truth
-            all_pred.append(pred_frames)
-            label_onehot = batch_ys.cpu().numpy()
-            label = np.reshape(label_onehot[:, 1], [batch_size,])
-            all_labels.append(label)
-            toas = np.squeeze(batch_toas.cpu().numpy()).astype(np.int)
-            all_toas.append(toas)
-            all_uncertains.append(pred_uncertains)
-
-            if vis:
+            pred_frames, pred_uncertains = parse_outputs(all_outputs)
+            label = batch_ys.cpu().numpy()[:, 1]
+            toas = np.reshape(batch_toas.cpu().numpy(), (-1,)).astype(int)
+            accumulator.update(pred_frames, label, toas, uncertainties=pred_uncertains)
+
+            if store is not None:
+                store.append({'pred_frames': pred_frames, 'label': label, 'pred_uncertain': pred_uncertains,
+                              'toa': toas, 'detections': detections, 'video_ids': video_ids}, rng_states=get_rng_states())
+            elif vis:
                 # gather data for visualization
                 vis_data.append({'pred_frames': pred_frames, 'label': label, 'pred_uncertain': pred_uncertains,
                                 'toa': toas, 'detections': detections, 'video_ids': video_ids})
 
-    all_pred = np.vstack((np.vstack(all_pred[:-1]), all_pred[-1]))
-    all_labels = np.hstack((np.hstack(all_labels[:-1]), all_labels[-1]))
-    all_toas = np.hstack((np.hstack(all_toas[:-1]), all_toas[-1]))
-    all_uncertains = np.vstack((np.vstack(all_uncertains[:-1]), all_uncertains[-1]))
-
-    return all_pred, all_labels, all_toas, all_uncertains, vis_data
-
-
-def write_scalars(logger, cur_epoch, cur_iter, losses, lr):
-    # fetch results
-    total_loss = losses['total_loss'].mean().item()
-    cross_entropy = losses['cross_entropy'].mean()
-    log_prior = losses['log_prior'].mean().item()
-    log_posterior = losses['log_posterior'].mean().item()
-    aux_loss = losses['auxloss'].mean().item()
-    rank_loss = losses['ranking'].mean().item()
-    # print info
-    print('----------------------------------')
-    print('epoch: %d, iter: %d' % (cur_epoch, cur_iter))
-    print('total loss = %.6f' % (total_loss))
-    print('cross_entropy = %.6f' % (cross_entropy))
-    print('log_posterior = %.6f' % (log_posterior))
-    print('log_prior = %.6f' % (log_prior))
-    print('aux_loss = %.6f' % (aux_loss))
-    print('rank_loss = %.6f' % (rank_loss))
-    # write to tensorboard
-    logger.add_scalars("train/losses/total_loss", {'total_loss': total_loss}, cur_iter)
-    logger.add_scalars("train/losses/cross_entropy", {'cross_entropy': cross_entropy}, cur_iter)
-    logger.add_scalars("train/losses/log_posterior", {'log_posterior': log_posterior}, cur_iter)
-    logger.add_scalars("train/losses/log_prior", {'log_prior': log_prior}, cur_iter)
-    logger.add_scalars("train/losses/complexity_cost", {'complexity_cost': log_posterior-log_prior}, cur_iter)
-    logger.add_scalars("train/losses/aux_loss", {'aux_loss': aux_loss}, cur_iter)
-    logger.add_scalars("train/losses/rank_loss", {'rank_loss': rank_loss}, cur_iter)
-    # write learning rate
-    logger.add_scalars("train/learning_rate/lr", {'lr': lr}, cur_iter)
-
-
-def write_test_scalars(logger, cur_epoch, cur_iter, losses, metrics):
-    # fetch results
-    total_loss = losses['total_loss'].mean().item()
-    cross_entropy = losses['cross_entropy'].mean()
-    # write to tensorboard
-    loss_info = {'total_loss': total_loss, 'cross_entropy': cross_entropy}
-    aux_loss = losses['auxloss'].mean().item()
-    loss_info.update({'aux_loss': aux_loss})
-    logger.add_scalars("test/losses/total_loss", loss_info, cur_iter)
-    logger.add_scalars("test/accuracy/AP", {'AP': metrics['AP']}, cur_iter)
-    logger.add_scalars("test/accuracy/time-to-accident", {'mTTA': metrics['mTTA'], 
-                                                          'TTA_R80': metrics['TTA_R80']}, cur_iter)
-
-
-def write_weight_histograms(writer, net, epoch):
-    writer.add_histogram('histogram/w1_mu', net.predictor.l1.weight_mu, epoch)
-    writer.add_histogram('histogram/w1_rho', net.predictor.l1.weight_rho, epoch)
-    writer.add_histogram('histogram/w2_mu', net.predictor.l2.weight_mu, epoch)
-    writer.add_histogram('histogram/w2_rho', net.predictor.l2.weight_rho, epoch)
-    writer.add_histogram('histogram/b1_mu', net.predictor.l1.bias_mu, epoch)
-    writer.add_histogram('histogram/b1_rho', net.predictor.l1.bias_rho, epoch)
-    writer.add_histogram('histogram/b2_mu', net.predictor.l2.bias_mu, epoch)
-    writer.add_histogram('histogram/b2_rho', net.predictor.l2.bias_rho, epoch)
-
-
-def load_checkpoint(model, optimizer=None, filename='checkpoint.pth.tar', isTraining=True):
+    return accumulator, vis_data
+
+
+def get_rng_states():
+    return torch.get_rng_state(), (torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None)
+
+
+def set_rng_states(states):
+    torch.set_rng_state(states[0])
+    if states[1] is not None:
+        torch.cuda.set_rng_state_all(states[1])
+
+
+def test_all_multi(testdata_loader, models, device=torch.device('cuda'), rng_states=None, collect=False):
+    """ Score each test batch with all models, so that the test set is read once for a group of checkpoints.
+    Each model draws its Bayesian samples from its own random stream, which starts from the same state for
+    all models (rng_states, the current state by default), hence the results do not depend on how the checkpoints
+    are grouped.
+    :return: a list of accumulators, one for each model, and if collect, a list of the frame-level predictions
+             (pred, label, toas, uncertainties) of each model
+    """
+    from tqdm import tqdm
+    for model in models:
+        model.to(device=device)
+        model.eval()
+
+    accumulators = [EvalAccumulator() for _ in models]
+    outputs = [{'pred': [], 'label': [], 'toas': [], 'uncertainties': []} for _ in models]
+    rng_states = [get_rng_states() if rng_states is None else rng_states] * len(models)
+    with torch.no_grad():
+        for i, (batch_xs, batch_ys, graph_edges, edge_weights, batch_toas, detections, video_ids) in tqdm(enumerate(testdata_loader), desc="batch progress", total=len(testdata_loader)):
+            label = batch_ys.cpu().numpy()[:, 1]
+            toas = np.reshape(batch_toas.cpu().numpy(), (-1,)).astype(int)
+            for k, model in enumerate(models):
+                set_rng_states(rng_states[k])
+                losses, all_outputs, hiddens = model(batch_xs, batch_ys, batch_toas, graph_edges, 
+                        hidden_in=None, edge_weights=edge_weights, npass=10, nbatch=len(testdata_loader), testing=False, eval_uncertain=True)
+                rng_states[k] = get_rng_states()
+                pred_frames, pred_uncertains = parse_outputs(all_outputs)
+                accumulators[k].update(pred_frames, label, toas, uncertainties=pred_uncertains)
+                if collect:
+                    for name, value in zip(['pred', 'label', 'toas', 'uncertainties'], [pred_frames, label, toas, pred_uncertains]):
+                        outputs[k][name].append(value)
+
+    if collect:
+        return accumulators, [{name: np.concatenate(values) for name, values in output.items()} for output in outputs]
+    return accumulators
+
+
+def write_weight_histograms(logger, net, epoch):
+    logger.log_histograms({'histogram/w1_mu': net.predictor.l1.weight_mu,
+                           'histogram/w1_rho': net.predictor.l1.weight_rho,
+                           'histogram/w2_mu': net.predictor.l2.weight_mu,
+                           'histogram/w2_rho': net.predictor.l2.weight_rho,
+                           'histogram/b1_mu': net.predictor.l1.bias_mu,
+                           'histogram/b1_rho': net.predictor.l1.bias_rho,
+                           'histogram/b2_mu': net.predictor.l2.bias_mu,
+                           'histogram/b2_rho': net.predictor.l2.bias_rho}, epoch)
+
+
+def load_checkpoint(model, optimizer=None, filename='checkpoint.pth.tar', isTraining=True, scheduler=None):
     # Note: Input model & optimizer should be pre-defined.  This routine only updates their states.
     start_epoch = 0
     if os.path.isfile(filename):
-        checkpoint = torch.load(filename)
+        # tensors are loaded on cpu first and copied into the (possibly cuda) model and optimizer states
+        checkpoint = torch.load(filename, map_location='cpu')
         start_epoch = checkpoint['epoch']
-        model.load_state_dict(checkpoint['model'])
+        # the GRU-GCN weights are only saved by the CheckpointManager
+        load_snapshot(model, {'model': checkpoint['model'], 'rnn': checkpoint.get('rnn', {})})
         if isTraining:
             optimizer.load_state_dict(checkpoint['optimizer'])
+            # the scheduler and random states make the resumed training identical to an uninterrupted one
+            if scheduler is not None and 'scheduler' in checkpoint:
+                scheduler.load_state_dict(checkpoint['scheduler'])
+            if 'rng' in checkpoint:
+                set_rng_state(checkpoint['rng'])
         print("=> loaded checkpoint '{}' (epoch {})".format(filename, checkpoint['epoch']))
     else:
         print("=> no checkpoint found at '{}'".format(filename))
@@ -212,128 +215,351 @@ def load_checkpoint(model, optimizer=None, filename='checkpoint.pth.tar', isTrai
     return model, optimizer, start_epoch
 
 
+def init_distributed():
+    """ Initialize the process group of a torchrun launch.
+    :return: rank, world_size, device
+    """
+    rank = int(os.environ['RANK'])
+    world_size = int(os.environ['WORLD_SIZE'])
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+    dist.init_process_group(backend=p.dist_backend)
+    if p.dist_backend == 'nccl':
+        torch.cuda.set_device(local_rank)
+        device = torch.device('cuda', local_rank)
+    else:
+        # gloo backend runs each rank on its own share of the CPU cores
+        device = torch.device('cpu')
+        num_threads = p.num_threads if p.num_threads > 0 else max(1, (os.cpu_count() or 1) // local_world_size)
+        torch.set_num_threads(num_threads)
+    return rank, world_size, device
+
+
+def gather_results(accumulator, losses_all, world_size):
+    """ Merge the evaluation accumulators of all ranks on rank 0 (other ranks get None).
+    """
+    # losses are sent as cpu tensors so that any backend can pickle them
+    losses_all = [{k: v.detach().cpu() if torch.is_tensor(v) else v for k, v in losses.items()} for losses in losses_all]
+    results = [None] * world_size if dist.get_rank() == 0 else None
+    dist.gather_object((accumulator, losses_all), results, dst=0)
+    if dist.get_rank() != 0:
+        return None
+    accumulator = EvalAccumulator()
+    for rank_accumulator, _ in results:
+        accumulator.merge(rank_accumulator)
+    losses_all = [losses for res in results for losses in res[1]]
+    return accumulator, losses_all
+
+
+def eval_process(jobs, results, args, data_path):
+    """ The loop of the background evaluation process of --async_eval (see src/eval_worker.py).
+    """
+    global p
+    p = args
+    if p.eval_threads > 0:
+        torch.set_num_threads(p.eval_threads)
+    device = torch.device(p.eval_device)
+    if p.dataset == 'dad':
+        from src.DataLoader import DADDataset
+        test_data = DADDataset(data_path, p.feature_name, 'testing', toTensor=True, device=device, n_obj=p.n_obj, top_k=p.top_k)
+    elif p.dataset == 'a3d':
+        from src.DataLoader import A3DDataset
+        test_data = A3DDataset(data_path, p.feature_name, 'test', toTensor=True, device=device, n_obj=p.n_obj, top_k=p.top_k)
+    elif p.dataset == 'crash':
+        from src.DataLoader import CrashDataset
+        test_data = CrashDataset(data_path, p.feature_name, 'test', toTensor=True, device=device, n_obj=p.n_obj, top_k=p.top_k)
+    else:
+        raise NotImplementedError
+    if p.feature_cache:
+        test_data = open_feature_cache(test_data, p.feature_cache)
+    testdata_loader = DataLoader(dataset=test_data, batch_size=p.batch_size, shuffle=False, drop_last=False)
+    model = UString(test_data.dim_feature, p.hidden_dim, p.latent_dim,
+                       n_layers=p.num_rnn, n_obj=test_data.n_obj, n_frames=test_data.n_frames, fps=test_data.fps,
+                       with_saa=True, uncertain_ranking=True, readout=p.readout)
+    model = model.to(device=device)
+    model.eval()
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        epoch, cur_iter, state = job
+        load_snapshot(model, state)
+        # each snapshot is evaluated with the same Bayesian samples
+        torch.manual_seed(p.seed)
+        accumulator, losses_all = test_all(testdata_loader, model)
+        loss_val = average_losses(losses_all)
+        print('----------------------------------')
+        print("Evaluation of epoch %d, iter %d:"%(epoch, cur_iter))
+        metrics = {}
+        metrics['AP'], metrics['mTTA'], metrics['TTA_R80'] = accumulator.evaluate(fps=test_data.fps, mode=p.eval_mode)
+        print('----------------------------------')
+        loss_val = {name: float(torch.as_tensor(value).mean()) for name, value in loss_val.items()}
+        results.put((epoch, cur_iter, {'losses': loss_val, 'metrics': metrics}))
+
+
+def select_final_model(evaluator, saved_epochs, checkpoints):
+    """ With --async_eval, the checkpoint of an epoch gets its AP once all the snapshots up to the epoch are
+    evaluated, i.e., the same metric as a synchronous evaluation, to select the final model.
+    :param: saved_epochs, the saved epochs waiting for the evaluation results, updated in place
+    """
+    while len(saved_epochs) > 0:
+        results = evaluator.latest_results(saved_epochs[0])
+        if results is None:
+            break
+        epoch = saved_epochs.pop(0)
+        checkpoints.set_metric(epoch, results['metrics']['AP'] if 'metrics' in results else None)
+
+
 def train_eval():
     ### --- CONFIG PATH ---
     data_path = os.path.join(ROOT_PATH, p.data_path, p.dataset)
+    # distributed training (one process per rank, launched by torchrun)
+    if p.distributed:
+        rank, world_size, device = init_distributed()
+    else:
+        rank, world_size = 0, 1
+    is_main = rank == 0
     # model snapshots
     model_dir = os.path.join(p.output_dir, p.dataset, 'snapshot')
-    if not os.path.exists(model_dir):
+    if is_main and not os.path.exists(model_dir):
         os.makedirs(model_dir)
     # tensorboard logging
     logs_dir = os.path.join(p.output_dir, p.dataset, 'logs')
-    if not os.path.exists(logs_dir):
+    if is_main and not os.path.exists(logs_dir):
         os.makedirs(logs_dir)
-    logger = SummaryWriter(logs_dir)
+    # the losses are copied to the host every log_every iterations, and written by a background thread
+    from tensorboardX import SummaryWriter
+    logger = MetricsLogger(SummaryWriter(logs_dir), os.path.join(logs_dir, 'metrics.jsonl'), sync_every=p.log_every) if is_main else None
 
     # gpu options
     gpu_ids = [int(id) for id in p.gpus.split(',')]
-    print("Using GPU devices: ", gpu_ids)
-    os.environ['CUDA_VISIBLE_DEVICES'] = p.gpus
-    device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+    if p.distributed:
+        print("Rank %d/%d running on device: %s"%(rank, world_size, device))
+    else:
+        print("Using GPU devices: ", gpu_ids)
+        os.environ['CUDA_VISIBLE_DEVICES'] = p.gpus
+        device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+        if p.num_threads > 0:
+            torch.set_num_threads(p.num_threads)
 
     # create data loader
     if p.dataset == 'dad':
         from src.DataLoader import DADDataset
-        train_data = DADDataset(data_path, p.feature_name, 'training', toTensor=True, device=device)
-        test_data = DADDataset(data_path, p.feature_name, 'testing', toTensor=True, device=device)
+        train_data = DADDataset(data_path, p.feature_name, 'training', toTensor=True, device=device, n_obj=p.n_obj, top_k=p.top_k)
+        test_data = DADDataset(data_path, p.feature_name, 'testing', toTensor=True, device=device, n_obj=p.n_obj, top_k=p.top_k)
     elif p.dataset == 'a3d':
         from src.DataLoader import A3DDataset
-        train_data = A3DDataset(data_path, p.feature_name, 'train', toTensor=True, device=device)
-        test_data = A3DDataset(data_path, p.feature_name, 'test', toTensor=True, device=device)
+        train_data = A3DDataset(data_path, p.feature_name, 'train', toTensor=True, device=device, n_obj=p.n_obj, top_k=p.top_k)
+        test_data = A3DDataset(data_path, p.feature_name, 'test', toTensor=True, device=device, n_obj=p.n_obj, top_k=p.top_k)
     elif p.dataset == 'crash':
         from src.DataLoader import CrashDataset
-        train_data = CrashDataset(data_path, p.feature_name, 'train', toTensor=True, device=device)
-        test_data = CrashDataset(data_path, p.feature_name, 'test', toTensor=True, device=device)
+        train_data = CrashDataset(data_path, p.feature_name, 'train', toTensor=True, device=device, n_obj=p.n_obj, top_k=p.top_k)
+        test_data = CrashDataset(data_path, p.feature_name, 'test', toTensor=True, device=device, n_obj=p.n_obj, top_k=p.top_k)
     else:
         raise NotImplementedError
-    traindata_loader = DataLoader(dataset=train_data, batch_size=p.batch_size, shuffle=True, drop_last=True)
-    testdata_loader = DataLoader(dataset=test_data, batch_size=p.batch_size, shuffle=False, drop_last=True)
+    if p.feature_cache:
+        # the decoded samples are read from memory maps shared with other runs (e.g., the trials of a sweep)
+        train_data = open_feature_cache(train_data, p.feature_cache)
+        test_data = open_feature_cache(test_data, p.feature_cache)
+    # all test videos are evaluated (the last partial batch is kept), in a single process or on all ranks
+    if p.distributed:
+        # equal-sized shards keep the number of iterations identical on all ranks
+        train_sampler = DistributedSampler(train_data, num_replicas=world_size, rank=rank, shuffle=True, seed=p.seed, drop_last=True)
+        traindata_loader = DataLoader(dataset=train_data, batch_size=p.batch_size, sampler=train_sampler, drop_last=True)
+        # each rank evaluates a disjoint strided shard of the test set, the results are gathered on rank 0
+        test_shard = Subset(test_data, list(range(rank, len(test_data), world_size)))
+        testdata_loader = DataLoader(dataset=test_shard, batch_size=p.batch_size, shuffle=False, drop_last=False)
+    else:
+        traindata_loader = DataLoader(dataset=train_data, batch_size=p.batch_size, shuffle=True, drop_last=True)
+        testdata_loader = DataLoader(dataset=test_data, batch_size=p.batch_size, shuffle=False, drop_last=False)
     
     # building model
     model = UString(train_data.dim_feature, p.hidden_dim, p.latent_dim, 
                        n_layers=p.num_rnn, n_obj=train_data.n_obj, n_frames=train_data.n_frames, fps=train_data.fps, 
-                       with_saa=True, uncertain_ranking=True)
+                       with_saa=True, uncertain_ranking=True, readout=p.readout)
 
     # optimizer
     optimizer = torch.optim.Adam(model.parameters(), lr=p.base_lr)
     scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', factor=0.5, patience=5)
 
-    if len(gpu_ids) > 1:
-        model = torch.nn.DataParallel(model)
     model = model.to(device=device)
     model.train() # set the model into training status
 
+    # checkpoints are written by a background thread
+    checkpoints = CheckpointManager(model_dir, keep_last=p.keep_last, keep_best=p.keep_best) if is_main else None
+
     # resume training 
     start_epoch = -1
     if p.resume:
-        model, optimizer, start_epoch = load_checkpoint(model, optimizer=optimizer, filename=p.model_file)
+        model, optimizer, start_epoch = load_checkpoint(model, optimizer=optimizer, filename=p.model_file, scheduler=scheduler)
+        if is_main:
+            checkpoints.truncate(start_epoch)
+
+    # the unwrapped model is used for evaluation, checkpointing and histograms
+    net = model
+    if p.distributed:
+        model = DistributedDataParallel(model, device_ids=[device.index] if device.type == 'cuda' else None)
+    elif len(gpu_ids) > 1:
+        model = torch.nn.DataParallel(model)
 
     # write histograms
-    write_weight_histograms(logger, model, 0)
+    if is_main:
+        write_weight_histograms(logger, net, 0)
+    # evaluation in a background process, the training continues while the snapshots are evaluated
+    evaluator = EvalWorker(eval_process, args=(p, data_path), max_pending=p.eval_pending) if p.async_eval and is_main else None
+    saved_epochs = []
     iter_cur = 0
-    best_metric = 0
+    metrics = {}
+    # profile the stages of a few training iterations and stop
+    profiler = None
+    if p.profile:
+        profiler = StageProfiler(warmup=p.profile_warmup, n_iters=p.profile_iters, trace_iters=p.profile_trace_iters, profile_dir=os.path.join(p.output_dir, p.dataset, 'profile'), device=device).start()
     for k in range(p.epoch):
         if k <= start_epoch:
             iter_cur += len(traindata_loader)
             continue
-        for i, (batch_xs, batch_ys, graph_edges, edge_weights, batch_toas) in enumerate(traindata_loader):
+        if p.distributed:
+            train_sampler.set_epoch(k)
+        for i, (batch_xs, batch_ys, graph_edges, edge_weights, batch_toas) in enumerate(timed_iter(traindata_loader)):
             # ipdb.set_trace()
             optimizer.zero_grad()
-            losses, all_outputs, hidden_st = model(batch_xs, batch_ys, batch_toas, graph_edges, edge_weights=edge_weights, npass=2, nbatch=len(traindata_loader), eval_uncertain=True)
-            complexity_loss = losses['log_posterior'] - losses['log_prior']
-            losses['total_loss'] = p.loss_alpha * complexity_loss + losses['cross_entropy']
-            losses['total_loss'] += p.loss_beta * losses['auxloss']
-            losses['total_loss'] += p.loss_yita * losses['ranking']
+            with stage('forward'):
+                losses, all_outputs, hidden_st = model(batch_xs, batch_ys, batch_toas, graph_edges, edge_weights=edge_weights, npass=p.npass, nbatch=len(traindata_loader), eval_uncertain=True,
+                                                       checkpoint_every=p.checkpoint_every, tbptt=p.tbptt)
+                complexity_loss = losses['log_posterior'] - losses['log_prior']
+                losses['total_loss'] = p.loss_alpha * complexity_loss + losses['cross_entropy']
+                losses['total_loss'] += p.loss_beta * losses['auxloss']
+                losses['total_loss'] += p.loss_yita * losses['ranking']
             # backward
-            losses['total_loss'].mean().backward()
+            with stage('backward'):
+                losses['total_loss'].mean().backward()
             # clip gradients
-            torch.nn.utils.clip_grad_norm_(model.parameters(), 10)
-            optimizer.step()
+            with stage('optimizer'):
+                torch.nn.utils.clip_grad_norm_(model.parameters(), 10)
+                optimizer.step()
             # write the losses info
             lr = optimizer.param_groups[0]['lr']
-            write_scalars(logger, k, iter_cur, losses, lr)
+            if is_main:
+                logger.log_train(k, iter_cur, losses, lr)
             
             iter_cur += 1
+            if profiler is not None:
+                # the profiled iterations are not interrupted by evaluations
+                if not profiler.step():
+                    break
+                continue
             # test and evaluate the model
-            if iter_cur % p.test_iter == 0:
-                model.eval()
-                all_pred, all_labels, all_toas, losses_all = test_all(testdata_loader, model)
-                model.train()
-                loss_val = average_losses(losses_all)
-                print('----------------------------------')
-                print("Starting evaluation...")
-                metrics = {}
-                metrics['AP'], metrics['mTTA'], metrics['TTA_R80'] = evaluation(all_pred, all_labels, all_toas, fps=test_data.fps)
-                print('----------------------------------')
-                # keep track of validation losses
-                write_test_scalars(logger, k, iter_cur, loss_val, metrics)
-
-        # save model
-        model_file = os.path.join(model_dir, 'bayesian_gcrnn_model_%02d.pth'%(k))
-        torch.save({'epoch': k,
-                    'model': model.module.state_dict() if len(gpu_ids)>1 else model.state_dict(),
-                    'optimizer': optimizer.state_dict()}, model_file)
-        if metrics['AP'] > best_metric:
-            best_metric = metrics['AP']
-            # update best model file
-            update_final_model(model_file, os.path.join(model_dir, 'final_model.pth'))
-        print('Model has been saved as: %s'%(model_file))
-
-        scheduler.step(losses['log_posterior'])
+            if evaluator is not None:
+                for epoch, it, results in evaluator.poll():
+                    logger.log_test(epoch, it, results['losses'], results['metrics'])
+                select_final_model(evaluator, saved_epochs, checkpoints)
+                if iter_cur % p.test_iter == 0 and not evaluator.submit(k, iter_cur, snapshot_state(net)):
+                    print("Evaluation of iter %d is skipped, %d snapshots are waiting for evaluation."%(iter_cur, evaluator.pending()))
+            elif iter_cur % p.test_iter == 0 and not p.async_eval:
+                net.eval()
+                # each evaluation draws the same Bayesian samples as in the process of --async_eval, and the
+                # random states of the training are restored afterwards
+                rng_states = get_rng_states()
+                torch.manual_seed(p.seed)
+                accumulator, losses_all = test_all(testdata_loader, net)
+                set_rng_states(rng_states)
+                net.train()
+                if p.distributed:
+                    results = gather_results(accumulator, losses_all, world_size)
+                    if results is not None:
+                        accumulator, losses_all = results
+                if is_main:
+                    loss_val = average_losses(losses_all)
+                    logger.flush()
+                    print('----------------------------------')
+                    print("Starting evaluation...")
+                    metrics = {}
+                    metrics['AP'], metrics['mTTA'], metrics['TTA_R80'] = accumulator.evaluate(fps=test_data.fps, mode=p.eval_mode)
+                    print('----------------------------------')
+                    # keep track of validation losses
+                    logger.log_test(k, iter_cur, loss_val, metrics)
+
+        if profiler is not None and profiler.done:
+            break
+        plateau_loss = losses['log_posterior']
+        if p.distributed:
+            # all ranks must follow the same learning rate schedule
+            plateau_loss = plateau_loss.detach().clone()
+            dist.all_reduce(plateau_loss)
+            plateau_loss /= world_size
+        scheduler.step(plateau_loss)
+
+        # save model (after the scheduler step, so that a resumed training continues from the same state)
+        if is_main:
+            # the state is copied to the cpu once, by checkpoints.save()
+            state = model_state(net)
+            state.update({'epoch': k, 'optimizer': optimizer.state_dict(), 'scheduler': scheduler.state_dict(), 'rng': rng_state()})
+            if evaluator is not None:
+                checkpoints.save(k, state, pending=True)
+                saved_epochs.append(k)
+                select_final_model(evaluator, saved_epochs, checkpoints)
+            else:
+                # the final model is the checkpoint with the best AP
+                checkpoints.save(k, state, metric=metrics.get('AP'))
+            print('Model is being saved as: %s'%(checkpoints.checkpoint_file(k)))
         # write histograms
-        write_weight_histograms(logger, model, k+1)
-    logger.close()
-
-
-def update_final_model(src_file, dest_file):
-    # source file must exist
-    assert os.path.exists(src_file), "src file does not exist!"
-    # destinate file should be removed first if exists
-    if os.path.exists(dest_file):
-        if not os.path.samefile(src_file, dest_file):
-            os.remove(dest_file)
-    # copy file
-    shutil.copyfile(src_file, dest_file)
+        if is_main:
+            write_weight_histograms(logger, net, k+1)
+    if profiler is not None:
+        profiler.stop()
+        if is_main:
+            logger.flush()
+            profiler.summary()
+    if evaluator is not None:
+        for epoch, it, results in evaluator.close():
+            logger.log_test(epoch, it, results['losses'], results['metrics'])
+        select_final_model(evaluator, saved_epochs, checkpoints)
+    if is_main:
+        checkpoints.close()
+        logger.close()
+    if p.distributed:
+        dist.destroy_process_group()
+
+
+def test_cache_config(test_data, model, runner, device):
+    """ Everything besides the checkpoint bytes that determines the test predictions. The test split is
+    identified by its file names and sizes, labels and the manifest of the feature store.
+    """
+    from src.DataLoader import load_feature_manifest
+    if p.dataset == 'dad':
+        feature_dir = test_data.data_path
+        split_dir = os.path.join(feature_dir, test_data.phase)
+    else:
+        feature_dir = split_dir = os.path.join(test_data.data_path, test_data.feature + '_features')
+    files = [[filename, os.path.getsize(os.path.join(split_dir, filename))] for filename in test_data.files_list]
+    # the toa of CrashDataset are numpy integers
+    toas = {vid: int(toa) for vid, toa in test_data.toa_dict.items()} if hasattr(test_data, 'toa_dict') else None
+    return {'runner': runner,
+            'model': {'dim_feature': test_data.dim_feature, 'hidden_dim': p.hidden_dim, 'latent_dim': p.latent_dim,
+                      'num_rnn': p.num_rnn, 'n_obj': test_data.n_obj, 'n_frames': test_data.n_frames, 'fps': test_data.fps,
+                      'with_saa': model.with_saa, 'uncertain_ranking': model.uncertain_ranking, 'readout': model.readout,
+                      'top_k': test_data.top_k},
+            'split': {'dataset': p.dataset, 'feature_name': p.feature_name, 'phase': test_data.phase, 'files': files,
+                      'labels': getattr(test_data, 'labels_list', None), 'toas': toas,
+                      'manifest': load_feature_manifest(feature_dir)},
+            'batch_size': p.batch_size, 'drop_last': False, 'npass': 10, 'seed': p.seed, 'device': device.type}
+
+
+def cache_lookup(cache, model_file, config):
+    """ :return: the key and the cached arrays (None if not cached) of the predictions of a checkpoint
+    """
+    if cache is None:
+        return None, None
+    key = prediction_key([model_file], config)
+    arrays = cache.get(key)
+    if arrays is not None:
+        print("Predictions of %s loaded from cache: %s"%(model_file, cache.entry_dir(key)))
+    return key, arrays
+
+
+def cache_meta(model_file, config):
+    return {'checkpoint': os.path.abspath(model_file), 'runner': config['runner'], 'dataset': p.dataset,
+            'feature_name': p.feature_name, 'phase': config['split']['phase'], 'seed': p.seed}
 
 
 def test_eval():
@@ -359,42 +585,65 @@ def test_eval():
     # create data loader
     if p.dataset == 'dad':
         from src.DataLoader import DADDataset
-        test_data = DADDataset(data_path, p.feature_name, 'testing', toTensor=True, device=device, vis=True)
+        test_data = DADDataset(data_path, p.feature_name, 'testing', toTensor=True, device=device, vis=True, n_obj=p.n_obj, top_k=p.top_k)
     elif p.dataset == 'a3d':
         from src.DataLoader import A3DDataset
-        test_data = A3DDataset(data_path, p.feature_name, 'test', toTensor=True, device=device, vis=True)
+        test_data = A3DDataset(data_path, p.feature_name, 'test', toTensor=True, device=device, vis=True, n_obj=p.n_obj, top_k=p.top_k)
     elif p.dataset == 'crash':
         from src.DataLoader import CrashDataset
-        test_data = CrashDataset(data_path, p.feature_name, 'test', toTensor=True, device=device, vis=True)
+        test_data = CrashDataset(data_path, p.feature_name, 'test', toTensor=True, device=device, vis=True, n_obj=p.n_obj, top_k=p.top_k)
     else:
         raise NotImplementedError
-    testdata_loader = DataLoader(dataset=test_data, batch_size=p.batch_size, shuffle=False, drop_last=True)
+    testdata_loader = DataLoader(dataset=test_data, batch_size=p.batch_size, shuffle=False, drop_last=False)
     num_samples = len(test_data)
     print("Number of testing samples: %d"%(num_samples))
     
     # building model
     model = UString(test_data.dim_feature, p.hidden_dim, p.latent_dim, 
                        n_layers=p.num_rnn, n_obj=test_data.n_obj, n_frames=test_data.n_frames, fps=test_data.fps, 
-                       with_saa=True, uncertain_ranking=True)
+                       with_saa=True, uncertain_ranking=True, readout=p.readout)
+
+    cache = None if p.no_cache else PredictionCache(p.pred_cache if p.pred_cache else os.path.join(p.output_dir, 'pred_cache'))
 
     # start to evaluate
     if p.evaluate_all:
         model_dir = os.path.join(p.output_dir, p.dataset, 'snapshot')
         assert os.path.exists(model_dir)
         Epochs, APvid_all, AP_all, mTTA_all, TTA_R80_all, Unc_all = [], [], [], [], [], []
-        modelfiles = sorted(os.listdir(model_dir))
+        modelfiles = sorted(filename for filename in os.listdir(model_dir) if filename.endswith('.pth') and not filename.startswith('.'))
+        config = test_cache_config(test_data, model, 'test_all_multi', device)
+        accumulators, keys = {}, {}
+        for filename in modelfiles:
+            keys[filename], arrays = cache_lookup(cache, os.path.join(model_dir, filename), config)
+            if arrays is not None:
+                accumulators[filename] = EvalAccumulator().update(arrays['pred'], arrays['label'], arrays['toas'], uncertainties=arrays['uncertainties'])
+        uncached = [filename for filename in modelfiles if filename not in accumulators]
+        group_size = p.eval_group if p.eval_group > 0 else max(len(uncached), 1)
+        rng_states = get_rng_states()
+        for start in range(0, len(uncached), group_size):
+            group_files = uncached[start:start + group_size]
+            models = []
+            for filename in group_files:
+                model_k, _, _ = load_checkpoint(copy.deepcopy(model), filename=os.path.join(model_dir, filename), isTraining=False)
+                models.append(model_k)
+            # run model inference of the group with a single pass over the test set
+            if cache is not None:
+                group_accumulators, outputs = test_all_multi(testdata_loader, models, device=device, rng_states=rng_states, collect=True)
+                for filename, output in zip(group_files, outputs):
+                    cache.put(keys[filename], output, meta=cache_meta(os.path.join(model_dir, filename), config))
+            else:
+                group_accumulators = test_all_multi(testdata_loader, models, device=device, rng_states=rng_states)
+            for filename, accumulator in zip(group_files, group_accumulators):
+                accumulators[filename] = accumulator
+            del models
         for filename in modelfiles:
             epoch_str = filename.split("_")[-1].split(".pth")[0]
             print("Evaluation for epoch: " + epoch_str)
-            model_file = os.path.join(model_dir, filename)
-            model, _, _ = load_checkpoint(model, filename=model_file, isTraining=False)
-            # run model inference
-            all_pred, all_labels, all_toas, all_uncertains, _ = test_all_vis(testdata_loader, model, vis=False, device=device)
             # evaluate results
-            AP, mTTA, TTA_R80 = evaluation(all_pred, all_labels, all_toas, fps=test_data.fps)
-            mUncertains = np.mean(all_uncertains, axis=(0, 1))
-            all_vid_scores = [max(pred[:int(toa)]) for toa, pred in zip(all_toas, all_pred)]
-            AP_video = average_precision_score(all_labels, all_vid_scores)
+            accumulator = accumulators[filename]
+            AP, mTTA, TTA_R80 = accumulator.evaluate(fps=test_data.fps, mode=p.eval_mode)
+            mUncertains = accumulator.mean_uncertainty()
+            AP_video = accumulator.video_ap()
             APvid_all.append(AP_video)
             # save
             Epochs.append(epoch_str)
@@ -405,29 +654,42 @@ def test_eval():
         # print results to file
         print_results(Epochs, APvid_all, AP_all, mTTA_all, TTA_R80_all, Unc_all, result_dir)
     else:
-        result_file = os.path.join(vis_dir, "..", "pred_res.npz")
-        if not os.path.exists(result_file):
+        # predictions are streamed batch by batch into a store of the cache (or result_dir with --no_cache)
+        config = test_cache_config(test_data, model, 'test_all_vis', device)
+        key = prediction_key([p.model_file], config)
+        store_dir = cache.get_store(key) if cache is not None else None
+        if store_dir is None:
+            if cache is not None:
+                store_dir = cache.partial_dir(key)
+            else:
+                store_dir = os.path.join(result_dir, 'pred_store')
+                shutil.rmtree(store_dir, ignore_errors=True)
+            store = PredictionWriter(store_dir)
             model, _, _ = load_checkpoint(model, filename=p.model_file, isTraining=False)
             # run model inference
-            all_pred, all_labels, all_toas, all_uncertains, vis_data = test_all_vis(testdata_loader, model, vis=True, device=device)
-            # save predictions
-            np.savez(result_file[:-4], pred=all_pred, label=all_labels, toas=all_toas, uncertainties=all_uncertains, vis_data=vis_data)
+            accumulator, _ = test_all_vis(testdata_loader, model, vis=True, device=device, store=store)
+            store.close()
+            if cache is not None:
+                store_dir = cache.commit(key, store_dir, meta=cache_meta(p.model_file, config))
         else:
-            print("Result file exists. Loaded from cache.")
-            all_results = np.load(result_file, allow_pickle=True)
-            all_pred, all_labels, all_toas, all_uncertains, vis_data = \
-                all_results['pred'], all_results['label'], all_results['toas'], all_results['uncertainties'], all_results['vis_data']
+            print("Predictions of %s loaded from cache: %s"%(p.model_file, store_dir))
+            accumulator = PredictionReader(store_dir).accumulator()
+        vis_data = PredictionReader(store_dir)
+        # pred_res.npz is an export of the frame-level predictions for other tools, e.g., script/bootstrap_eval.py
+        result_file = os.path.join(result_dir, "pred_res.npz")
+        all_results = vis_data.arrays()
+        np.savez(result_file[:-4], pred=all_results['pred'], label=all_results['label'], toas=all_results['toas'], uncertainties=all_results['uncertainties'])
         # evaluate results
-        all_vid_scores = [max(pred[:int(toa)]) for toa, pred in zip(all_toas, all_pred)]
-        AP_video = average_precision_score(all_labels, all_vid_scores)
+        AP_video = accumulator.video_ap()
         print("video-level AP=%.5f"%(AP_video))
-        AP, mTTA, TTA_R80 = evaluation(all_pred, all_labels, all_toas, fps=test_data.fps)
+        AP, mTTA, TTA_R80 = accumulator.evaluate(fps=test_data.fps, mode=p.eval_mode)
         # evaluate uncertainties
-        mUncertains = np.mean(all_uncertains, axis=(0, 1))
+        mUncertains = accumulator.mean_uncertainty()
         print("Mean aleatoric uncertainty: %.6f"%(mUncertains[0]))
         print("Mean epistemic uncertainty: %.6f"%(mUncertains[1]))
         # visualize
-        vis_results(vis_data, p.batch_size, vis_dir)
+        if p.visualize:
+            vis_results(vis_data, p.batch_size, vis_dir, max_videos=p.max_videos, num_workers=p.vis_workers, seed=p.seed)
 
 
 if __name__ == '__main__':
@@ -444,36 +706,94 @@ if __name__ == '__main__':
                         help='The batch size in training process. Default: 10')
     parser.add_argument('--num_rnn', type=int, default=1,
                         help='The number of RNN cells for each timestamp. Default: 1')
-    parser.add_argument('--feature_name', type=str, default='vgg16', choices=['vgg16', 'res101'],
-                        help='The name of feature embedding methods. Default: vgg16')
+    parser.add_argument('--feature_name', type=str, default='vgg16',
+                        help='The name of feature embedding methods, i.e., vgg16, res101, or a projected feature store such as vgg16_pca512. Default: vgg16')
     parser.add_argument('--test_iter', type=int, default=64,
                         help='The number of iteration to perform a evaluation process. Default: 64')
     parser.add_argument('--hidden_dim', type=int, default=256,
                         help='The dimension of hidden states in RNN. Default: 256')
     parser.add_argument('--latent_dim', type=int, default=256,
                         help='The dimension of latent space. Default: 256')
+    parser.add_argument('--n_obj', type=int, default=19,
+                        help='The number of objects of each frame, the detections are zero padded or truncated to it. Default: 19')
+    parser.add_argument('--top_k', type=int, default=None,
+                        help='The number of nearest neighbours of each object in the graphs, 0 for complete graphs. Default: complete graphs up to 32 objects, 8 beyond')
+    parser.add_argument('--readout', type=str, default='flatten', choices=['flatten', 'mean'],
+                        help='The readout of the object latents, flatten (n_obj fixed) or the mean of the detected objects. Default: flatten')
     parser.add_argument('--loss_alpha', type=float, default=0.001,
                         help='The weighting factor of posterior and prior losses. Default: 1e-3')
     parser.add_argument('--loss_beta', type=float, default=10,
                         help='The weighting factor of auxiliary loss. Default: 10')
     parser.add_argument('--loss_yita', type=float, default=10,
                         help='The weighting factor of uncertainty ranking loss. Default: 10')
+    parser.add_argument('--npass', type=int, default=2,
+                        help='The number of samples of the Bayesian predictor in training. Default: 2')
+    parser.add_argument('--checkpoint_every', type=int, default=0,
+                        help='Recompute the activations of every k frames in backward to save memory (0 to disable). Default: 0')
+    parser.add_argument('--tbptt', type=int, default=0,
+                        help='Truncate backpropagation through time by detaching hidden states every k frames (0 to disable). Default: 0')
+    parser.add_argument('--log_every', type=int, default=10,
+                        help='The number of training iterations whose losses are copied from the device and logged together. Default: 10')
+    parser.add_argument('--async_eval', action='store_true',
+                        help='Evaluate the snapshots of every test_iter iterations in a background process while the training continues. Default: False')
+    parser.add_argument('--eval_device', type=str, default='cpu',
+                        help='The device of the background evaluation process, e.g., cpu or cuda:1. Default: cpu')
+    parser.add_argument('--eval_threads', type=int, default=0,
+                        help='The number of CPU threads of the background evaluation process (0 for the torch default). Default: 0')
+    parser.add_argument('--eval_pending', type=int, default=2,
+                        help='The maximal number of snapshots waiting for the background evaluation, newer snapshots are skipped. Default: 2')
+    parser.add_argument('--feature_cache', type=str, default='',
+                        help='The directory of the decoded datasets (memory maps) shared by concurrent runs, e.g., /dev/shm/ustring. Default: read the npz files')
     parser.add_argument('--gpus', type=str, default="0", 
                         help="The delimited list of GPU IDs separated with comma. Default: '0'.")
+    parser.add_argument('--distributed', action='store_true',
+                        help='Use DistributedDataParallel training launched by torchrun (--batch_size is per process). Default: False')
+    parser.add_argument('--dist_backend', type=str, default='gloo', choices=['gloo', 'nccl'],
+                        help='The backend of distributed training, gloo for CPU-only machines, nccl for GPUs. Default: gloo')
+    parser.add_argument('--num_threads', type=int, default=0,
+                        help='The number of CPU threads (of each rank with the gloo backend, where 0 means cores / local ranks). Default: 0 (the torch default)')
     parser.add_argument('--phase', type=str, choices=['train', 'test'],
                         help='The state of running the model. Default: train')
+    parser.add_argument('--eval_mode', type=str, default='grid', choices=['exact', 'grid'],
+                        help='The threshold sweep of evaluation, the 0.001-step grid of published results or the exact P-R curve. Default: grid')
+    parser.add_argument('--pred_cache', type=str, default='',
+                        help='The directory of the prediction cache of the test phase. Default: <output_dir>/pred_cache')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='Always run inference in the test phase without reading or writing the prediction cache.')
     parser.add_argument('--evaluate_all', action='store_true',
                         help='Whether to evaluate models of all epoches. Default: False')
+    parser.add_argument('--eval_group', type=int, default=8,
+                        help='The number of checkpoints scored together in one pass over the test set with --evaluate_all (0 means all). Default: 8')
     parser.add_argument('--visualize', action='store_true',
                         help='The visualization flag. Default: False')
+    parser.add_argument('--max_videos', type=int, default=0,
+                        help='The number of randomly sampled test videos to visualize (0 for the first two batches, -1 for all). Default: 0')
+    parser.add_argument('--vis_workers', type=int, default=4,
+                        help='The number of processes to render the visualization (0 to render in the main process). Default: 4')
+    parser.add_argument('--profile', action='store_true',
+                        help='Profile the stages of training iterations, save a summary table and a Chrome trace in <output_dir>/<dataset>/profile and stop. Default: False')
+    parser.add_argument('--profile_warmup', type=int, default=3,
+                        help='The number of warmup iterations before profiling. Default: 3')
+    parser.add_argument('--profile_iters', type=int, default=10,
+                        help='The number of profiled iterations in the summary table. Default: 10')
+    parser.add_argument('--profile_trace_iters', type=int, default=1,
+                        help='The number of iterations in the Chrome trace, after the profiled ones (0 for no trace). Default: 1')
+    parser.add_argument('--keep_last', type=int, default=0,
+                        help='The number of the latest epoch checkpoints to keep besides the best ones (0 to keep all). Default: 0')
+    parser.add_argument('--keep_best', type=int, default=1,
+                        help='The number of checkpoints with the best test AP to keep when --keep_last is set. Default: 1')
     parser.add_argument('--resume', action='store_true',
                         help='If to resume the training. Default: False')
     parser.add_argument('--model_file', type=str, default='./output_debug/bayes_gcrnn/vgg16/dad/snapshot/gcrnn_model_90.pth',
                         help='The trained GCRNN model file for demo test only.')
     parser.add_argument('--output_dir', type=str, default='./output_debug/bayes_gcrnn/vgg16',
                         help='The directory of src need to save in the training.')
+    parser.add_argument('--seed', type=int, default=123,
+                        help='The random seed. Default: 123')
 
     p = parser.parse_args()
+    np.random.seed(p.seed)
+    torch.manual_seed(p.seed)
     if p.phase == 'test':
         test_eval()
     else:
@@ -0,0 +1,69 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os, sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.alert_policy import GATES, eval_lengths, sweep_policies, pareto_front
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Sweep alert policies and report false alarms per hour vs. TTA and recall')
+    parser.add_argument('--result_file', type=str, required=True,
+                        help='The pred_res.npz file saved by the test phase.')
+    parser.add_argument('--fps', type=float, default=20.0,
+                        help='The fps of the videos (DAD: 20, CCD: 10). Default: 20.0')
+    parser.add_argument('--thresholds', type=float, nargs=3, default=[0.05, 1.0, 0.01],
+                        help='The start, stop and step of the alert thresholds. Default: 0.05 1.0 0.01')
+    parser.add_argument('--kofn', type=str, nargs='+', default=['1,1', '2,3', '3,5', '5,10'],
+                        help='The k,n pairs of k-of-n smoothing. Default: 1,1 2,3 3,5 5,10')
+    parser.add_argument('--gate', type=str, default='epistemic', choices=list(GATES.keys()),
+                        help='The uncertainty used to gate alerts. Default: epistemic')
+    parser.add_argument('--gate_quantiles', type=float, nargs='+', default=[1.0, 0.95, 0.9, 0.75],
+                        help='The gates as quantiles of the uncertainty of all frames (1.0 means no gate). Default: 1.0 0.95 0.9 0.75')
+    parser.add_argument('--refractory', type=float, nargs='+', default=[0, 1, 2, 5],
+                        help='The refractory periods (seconds) after an alert. Default: 0 1 2 5')
+    parser.add_argument('--output', type=str, default='',
+                        help='The csv file of all policies. Default: alert_policies.csv next to the result file')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    data = np.load(args.result_file, allow_pickle=True)
+    all_pred, all_labels, all_toas, all_uncertains = data['pred'], data['label'], data['toas'], data['uncertainties']
+
+    # the gates are given as quantiles of the uncertainty of the evaluated frames
+    lengths = eval_lengths(np.reshape(all_labels, (-1,)), np.reshape(all_toas, (-1,)), all_pred.shape[1])
+    in_window = np.arange(all_pred.shape[1])[None, :] < lengths[:, None]
+    uncertainty = np.sum(all_uncertains[..., GATES[args.gate]], axis=-1)[in_window]
+    gate_values = [np.inf if q >= 1.0 else float(np.quantile(uncertainty, q)) for q in args.gate_quantiles]
+    thresholds = np.arange(*args.thresholds)
+    kofn = [tuple(int(v) for v in pair.split(',')) for pair in args.kofn]
+
+    t_start = time.time()
+    table = sweep_policies(all_pred, all_labels, all_toas, all_uncertains, fps=args.fps, thresholds=thresholds, kofn=kofn,
+                           gate_values=gate_values, refractory=args.refractory, gate=args.gate)
+    front = pareto_front(table['fa_per_hour'], table['recall'], table['mTTA'])
+    n_policies = len(table['threshold'])
+    print("%d policies evaluated in %.2f s, %d on the Pareto front"%(n_policies, time.time() - t_start, np.sum(front)))
+
+    names = ['threshold', 'k', 'n', 'gate', 'refractory', 'fa_per_hour', 'recall', 'mTTA']
+    output = args.output if args.output else os.path.join(os.path.dirname(args.result_file), 'alert_policies.csv')
+    with open(output, 'w') as f:
+        f.write(','.join(names + ['pareto']) + '\n')
+        for i in range(n_policies):
+            f.write(','.join(['%g' % (table[name][i]) for name in names] + ['%d' % (front[i])]) + '\n')
+    print("All policies saved in: %s"%(output))
+
+    print('\n%9s %3s %3s %10s %10s %12s %8s %8s' % ('threshold', 'k', 'n', args.gate, 'refractory', 'FA/hour', 'recall', 'mTTA'))
+    for i in np.where(front)[0][np.argsort(table['fa_per_hour'][front], kind='stable')]:
+        print('%9.3f %3d %3d %10.4g %10.1f %12.2f %8.3f %8.3f' % (table['threshold'][i], table['k'][i], table['n'][i], table['gate'][i],
+                                                             table['refractory'][i], table['fa_per_hour'][i], table['recall'][i], table['mTTA'][i]))
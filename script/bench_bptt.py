@@ -0,0 +1,104 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os, sys
+import time
+import argparse
+import resource
+import multiprocessing as mp
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Peak memory vs. step time of gradient checkpointing and truncated BPTT')
+    parser.add_argument('--batch_size', type=int, default=10,
+                        help='The batch size. Default: 10')
+    parser.add_argument('--n_frames', type=int, default=100,
+                        help='The number of frames of each clip. Default: 100 (DAD)')
+    parser.add_argument('--n_obj', type=int, default=19,
+                        help='The number of objects of each frame. Default: 19')
+    parser.add_argument('--dim_feature', type=int, default=4096,
+                        help='The dimension of input features. Default: 4096')
+    parser.add_argument('--settings', type=str, nargs='+', default=['0,0', '25,0', '10,0', '5,0', '0,25', '25,25', '10,10'],
+                        help='The (checkpoint_every,tbptt) pairs to compare. Default: 0,0 25,0 10,0 5,0 0,25 25,25 10,10')
+    parser.add_argument('--n_steps', type=int, default=3,
+                        help='The number of timed training steps after one warmup step. Default: 3')
+    parser.add_argument('--gpu', action='store_true',
+                        help='Run on the GPU (peak memory from the CUDA allocator). Default: CPU (peak RSS)')
+    return parser.parse_args()
+
+
+def make_batch(args, device):
+    from src.DataLoader import generate_st_graph
+    B, T, N = args.batch_size, args.n_frames, args.n_obj
+    detections = np.random.rand(T, N, 6).astype(np.float32)
+    graph_edges, edge_weights = generate_st_graph(detections)
+    batch_xs = torch.randn(B, T, N + 1, args.dim_feature, device=device)
+    batch_ys = torch.zeros(B, 2, device=device)
+    batch_ys[:B // 2, 1] = 1
+    batch_ys[B // 2:, 0] = 1
+    batch_toas = torch.full((B, 1), float(T + 1), device=device)
+    batch_toas[:B // 2] = int(0.9 * T)
+    graph_edges = torch.Tensor(np.stack(graph_edges)).long().unsqueeze(0).repeat(B, 1, 1, 1).to(device)
+    edge_weights = torch.Tensor(edge_weights).unsqueeze(0).repeat(B, 1, 1).to(device)
+    return batch_xs, batch_ys, graph_edges, edge_weights, batch_toas
+
+
+def run_setting(args, checkpoint_every, tbptt, queue):
+    from src.Models import UString
+    torch.manual_seed(123)
+    np.random.seed(123)
+    device = torch.device('cuda') if args.gpu else torch.device('cpu')
+    model = UString(args.dim_feature, 256, 256, n_layers=1, n_obj=args.n_obj, n_frames=args.n_frames,
+                    fps=20.0, with_saa=True, uncertain_ranking=True).to(device)
+    model.train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    batch_xs, batch_ys, graph_edges, edge_weights, batch_toas = make_batch(args, device)
+
+    def train_step():
+        optimizer.zero_grad()
+        losses, _, _ = model(batch_xs, batch_ys, batch_toas, graph_edges, edge_weights=edge_weights, npass=2, nbatch=80,
+                             eval_uncertain=True, checkpoint_every=checkpoint_every, tbptt=tbptt)
+        total_loss = 0.001 * (losses['log_posterior'] - losses['log_prior']) + losses['cross_entropy']
+        total_loss += 10 * losses['auxloss'] + 10 * losses['ranking']
+        total_loss.mean().backward()
+        optimizer.step()
+
+    if args.gpu:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base_mem = torch.cuda.memory_allocated()
+    else:
+        base_mem = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    train_step()  # warmup
+    times = []
+    for _ in range(args.n_steps):
+        t_start = time.perf_counter()
+        train_step()
+        if args.gpu:
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - t_start)
+    if args.gpu:
+        peak_mem = torch.cuda.max_memory_allocated() - base_mem
+    else:
+        peak_mem = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - base_mem
+    queue.put((peak_mem, float(np.mean(times))))
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    # every setting runs in a fresh process so that the peak memory is not shared across settings
+    ctx = mp.get_context('spawn')
+    print('%16s %8s %16s %14s' % ('checkpoint_every', 'tbptt', 'peak_mem (MB)', 'step_time (s)'))
+    for setting in args.settings:
+        checkpoint_every, tbptt = [int(v) for v in setting.split(',')]
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_setting, args=(args, checkpoint_every, tbptt, queue))
+        proc.start()
+        peak_mem, step_time = queue.get()
+        proc.join()
+        print('%16d %8d %16.1f %14.3f' % (checkpoint_every, tbptt, peak_mem / 1024.0**2, step_time))
@@ -0,0 +1,185 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os, sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Frames/s of the per-frame and the pipelined feature extraction of demo.py, with a stand-in detector and backbone')
+    parser.add_argument('--video_file', type=str, default=None,
+                        help='The video to extract. Default: a synthetic video of --n_frames frames')
+    parser.add_argument('--n_frames', type=int, default=100,
+                        help='The number of frames to extract. Default: 100 (DAD)')
+    parser.add_argument('--n_boxes', type=int, default=19,
+                        help='The number of boxes of each frame. Default: 19')
+    parser.add_argument('--height', type=int, default=720,
+                        help='The frame height of the synthetic video. Default: 720')
+    parser.add_argument('--width', type=int, default=1280,
+                        help='The frame width of the synthetic video. Default: 1280')
+    parser.add_argument('--batch_frames', type=int, nargs='+', default=[1, 4, 8],
+                        help='The batch sizes of the pipelined extraction to compare. Default: 1 4 8')
+    parser.add_argument('--feature_modes', type=str, nargs='+', default=['crop', 'roi_align'],
+                        help='The feature modes of the pipelined extraction to compare. Default: crop roi_align')
+    parser.add_argument('--queue_size', type=int, default=16,
+                        help='The maximum number of decoded frames waiting for the detector. Default: 16')
+    parser.add_argument('--gpu', action='store_true',
+                        help='Run the detector and the backbone on the GPU. Default: CPU')
+    return parser.parse_args()
+
+
+class StandInDetector(nn.Module):
+    """ A fixed random convolution on a 1/16 scaled frame, whose strongest responses of each class are the boxes.
+    """
+    def __init__(self, n_classes=3, n_boxes=10, stride=16):
+        super(StandInDetector, self).__init__()
+        self.conv = nn.Conv2d(3, n_classes, 3, padding=1)
+        self.n_boxes = n_boxes
+        self.stride = stride
+
+    def forward(self, x):
+        x = F.avg_pool2d(x, self.stride)
+        return torch.sigmoid(self.conv(x))  # B x C x H/16 x W/16
+
+
+def stand_in_detect(detector, frames):
+    """ :return: the mmdet bbox results of a list of BGR frames, i.e., per class arrays of x1, y1, x2, y2, score
+    """
+    device = next(detector.parameters()).device
+    x = torch.from_numpy(np.stack(frames)).to(device).permute(0, 3, 1, 2).float() / 255.0
+    with torch.no_grad():
+        scores = detector(x).cpu().numpy()
+    width = scores.shape[3]
+    results = []
+    for frame_scores in scores:
+        bbox_result = []
+        for class_scores in frame_scores:
+            top = np.argsort(-class_scores.reshape(-1), kind='stable')[:detector.n_boxes]
+            ys, xs = top // width, top % width
+            # a box of 2 x 3 cells at each selected cell
+            boxes = np.stack([xs, ys, xs + 3, ys + 2], axis=1).astype(np.float32) * detector.stride
+            bbox_result.append(np.hstack([boxes, class_scores.reshape(-1)[top, np.newaxis]]))
+        results.append(bbox_result)
+    return results
+
+
+class StandInBackbone(nn.Module):
+    def __init__(self, dim_feat=256):
+        super(StandInBackbone, self).__init__()
+        self.feature = nn.Sequential(
+            nn.Conv2d(3, 16, 3, stride=2, padding=1), nn.ReLU(inplace=True), nn.MaxPool2d(2),
+            nn.Conv2d(16, 32, 3, padding=1), nn.ReLU(inplace=True), nn.MaxPool2d(2),
+            nn.Conv2d(32, 64, 3, padding=1), nn.ReLU(inplace=True), nn.AdaptiveAvgPool2d(4))
+        self.classifier = nn.Linear(64 * 16, dim_feat)
+        self.dim_feat = dim_feat
+
+    def forward(self, x):
+        output = self.feature(x)
+        output = output.view(output.size(0), -1)
+        return self.classifier(output)
+
+    def roi_align_features(self):
+        from src.roi_features import RoIAlignFeatures
+        return RoIAlignFeatures(self.feature[:-1], nn.Sequential(nn.Flatten(), self.classifier), self.dim_feat,
+                                spatial_scale=1.0 / 8, output_size=4)
+
+
+def make_video(video_file, n_frames, height, width):
+    """ boxes moving over a noisy road """
+    import cv2
+    writer = cv2.VideoWriter(video_file, cv2.VideoWriter_fourcc(*'MJPG'), 20.0, (width, height))
+    rng = np.random.RandomState(123)
+    background = rng.randint(0, 80, (height, width, 3)).astype(np.uint8)
+    colors = rng.randint(80, 255, (8, 3))
+    starts = rng.rand(8, 2) * [width, height]
+    speeds = rng.randn(8, 2) * 8
+    for t in range(n_frames):
+        frame = background.copy()
+        for color, start, speed in zip(colors, starts, speeds):
+            x, y = (start + speed * t).astype(int) % [width, height]
+            frame[y:y + height // 8, x:x + width // 10] = color
+        writer.write(frame)
+    writer.release()
+
+
+def extract_features_loop(detector, feat_extractor, video_file, n_frames=100, n_boxes=19, zero_pad=False, detect=None, device=torch.device('cuda')):
+    """ The per-frame extraction of demo.py before the pipeline, i.e., decoding, detection and embedding of one frame
+    after another, decoding with cv2 instead of mmcv.
+    """
+    import cv2
+    from torchvision import transforms
+    from PIL import Image
+    from demo import bbox_sampling, bbox_to_imroi
+    cap = cv2.VideoCapture(video_file)
+    transform = transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(224),
+        transforms.ToTensor()]
+    )
+    features = np.zeros((n_frames, n_boxes + 1, feat_extractor.dim_feat), dtype=np.float32)
+    detections = np.zeros((n_frames, n_boxes, 6))
+    frame_prev = None
+    for idx in range(n_frames):
+        ret, frame = cap.read()
+        if not ret:
+            frame = frame_prev.copy()
+        bbox_result = detect(detector, [frame])[0]
+        bboxes = bbox_sampling(bbox_result, nbox=n_boxes, imsize=frame.shape[:2], zero_pad=zero_pad)
+        detections[idx, :len(bboxes), :] = bboxes
+        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        with torch.no_grad():
+            ims_roi = bbox_to_imroi(transform, bboxes, frame_rgb).float().to(device=device)
+            feature_roi = feat_extractor(ims_roi)
+            ims_frame = torch.unsqueeze(transform(Image.fromarray(frame_rgb)), dim=0).float().to(device=device)
+            feature_frame = feat_extractor(ims_frame)
+        features[idx, 0, :] = feature_frame.cpu().numpy()[0]
+        features[idx, 1:len(bboxes) + 1, :] = feature_roi.cpu().numpy()
+        frame_prev = frame
+    cap.release()
+    return detections, features
+
+
+def timed(extract, seed=123):
+    # the same random sampling of the boxes in each run
+    np.random.seed(seed)
+    t_start = time.perf_counter()
+    detections, features = extract()
+    return time.perf_counter() - t_start, detections, features
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    from demo import extract_features
+    device = torch.device('cuda') if args.gpu else torch.device('cpu')
+    torch.manual_seed(123)
+    detector = StandInDetector().to(device).eval()
+    feat_extractor = StandInBackbone().to(device).eval()
+
+    video_file = args.video_file
+    if video_file is None:
+        video_file = os.path.join(tempfile.mkdtemp(), 'synthetic.avi')
+        make_video(video_file, args.n_frames, args.height, args.width)
+    kwargs = dict(n_frames=args.n_frames, n_boxes=args.n_boxes, detect=stand_in_detect, device=device)
+    # warmup
+    extract_features(detector, feat_extractor, video_file, **dict(kwargs, n_frames=min(4, args.n_frames)))
+
+    elapsed, ref_detections, ref_features = timed(lambda: extract_features_loop(detector, feat_extractor, video_file, **kwargs))
+    print('%20s %12s %14s %16s' % ('extraction', 'frames/s', 'max |df|', 'same detections'))
+    print('%20s %12.1f %14s %16s' % ('per-frame loop', args.n_frames / elapsed, '-', '-'))
+    for feature_mode in args.feature_modes:
+        for batch_frames in args.batch_frames:
+            elapsed, detections, features = timed(lambda: extract_features(detector, feat_extractor, video_file, batch_frames=batch_frames,
+                                                                           queue_size=args.queue_size, feature_mode=feature_mode, **kwargs))
+            # the features of the roi_align mode differ from those of the crops
+            max_diff = '%.2e' % (np.abs(features - ref_features).max()) if feature_mode == 'crop' else '-'
+            print('%20s %12.1f %14s %16s' % ('%s (batch %d)' % (feature_mode, batch_frames), args.n_frames / elapsed,
+                                             max_diff, np.array_equal(detections, ref_detections)))
@@ -0,0 +1,98 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os, sys
+import time
+import argparse
+import tempfile
+import resource
+import multiprocessing as mp
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the FrameSource options of each reader, 'list' is the former get_video_frames() of demo.py
+READERS = OrderedDict([('list', None),
+                       ('stream', {}),
+                       ('prefetch', {'prefetch': 16}),
+                       ('stride_3', {'stride': 3, 'prefetch': 16}),
+                       ('fps_10', {'fps': 10.0, 'prefetch': 16}),
+                       ('resize_256', {'size': 256, 'prefetch': 16})])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Peak memory vs. frames/s of reading a long video into a list and of streaming it with FrameSource')
+    parser.add_argument('--video_file', type=str, default=None,
+                        help='The video to read. Default: a synthetic video of --n_frames frames at 20 fps')
+    parser.add_argument('--n_frames', type=int, default=3000,
+                        help='The number of frames of the synthetic video. Default: 3000 (2.5 minutes)')
+    parser.add_argument('--height', type=int, default=720,
+                        help='The frame height of the synthetic video. Default: 720')
+    parser.add_argument('--width', type=int, default=1280,
+                        help='The frame width of the synthetic video. Default: 1280')
+    parser.add_argument('--readers', type=str, nargs='+', default=list(READERS.keys()),
+                        help='The readers to compare. Default: %s' % (' '.join(READERS.keys())))
+    return parser.parse_args()
+
+
+def read_list(video_file):
+    # all frames are decoded before any processing
+    import cv2
+    cap = cv2.VideoCapture(video_file)
+    ret, frame = cap.read()
+    video_data = []
+    while (ret):
+        video_data.append(frame)
+        ret, frame = cap.read()
+    return video_data
+
+
+def peak_rss():
+    # the peak RSS of the process since exec (ru_maxrss also counts the parent before the spawn)
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_reader(video_file, options, queue):
+    import cv2
+    from src.video_io import FrameSource
+    cap = cv2.VideoCapture(video_file)
+    video_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    base_mem = peak_rss()
+    t_start = time.perf_counter()
+    frames = read_list(video_file) if options is None else FrameSource(video_file, **options)
+    n_frames = 0
+    for frame in frames:
+        # a light processing of each frame
+        frame.mean()
+        n_frames += 1
+    elapsed = time.perf_counter() - t_start
+    peak_mem = peak_rss() - base_mem
+    queue.put((n_frames, video_frames, peak_mem, elapsed))
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    video_file = args.video_file
+    if video_file is None:
+        from bench_extraction import make_video
+        video_file = os.path.join(tempfile.mkdtemp(), 'long.avi')
+        make_video(video_file, args.n_frames, args.height, args.width)
+    assert os.path.exists(video_file), video_file
+    # every reader runs in a fresh process so that the peak memory is not shared across readers
+    ctx = mp.get_context('spawn')
+    # frames/s of the frames read, and of the frames of the video passed over (decoded or skipped)
+    print('%12s %10s %16s %12s %16s' % ('reader', 'frames', 'peak_mem (MB)', 'frames/s', 'video frames/s'))
+    for name in args.readers:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_reader, args=(video_file, READERS[name], queue))
+        proc.start()
+        n_frames, video_frames, peak_mem, elapsed = queue.get()
+        proc.join()
+        print('%12s %10d %16.1f %12.1f %16.1f' % (name, n_frames, peak_mem / 1024.0**2, n_frames / elapsed, video_frames / elapsed))
@@ -0,0 +1,82 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os, sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.eval_tools import crossing_records
+from src.bootstrap import METRICS, bootstrap_weights, positive_videos, bootstrap_metrics, confidence_interval, paired_p_value
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Bootstrap confidence intervals of AP, mTTA and TTA_R80')
+    parser.add_argument('--result_files', type=str, nargs='+', required=True,
+                        help='One or two pred_res.npz files saved by the test phase. Two files are compared on the same videos.')
+    parser.add_argument('--n_boot', type=int, default=1000,
+                        help='The number of bootstrap replicates. Default: 1000')
+    parser.add_argument('--level', type=float, default=0.95,
+                        help='The confidence level. Default: 0.95')
+    parser.add_argument('--fps', type=float, default=20.0,
+                        help='The fps of the videos (DAD: 20, CCD: 10). Default: 20.0')
+    parser.add_argument('--eval_mode', type=str, default='grid', choices=['exact', 'grid'],
+                        help='The threshold sweep of evaluation, the 0.001-step grid of published results or the exact P-R curve (as main.py). Default: grid')
+    parser.add_argument('--stratified', action='store_true',
+                        help='Resample positive and negative videos separately to keep the class balance.')
+    parser.add_argument('--seed', type=int, default=123,
+                        help='The random seed. Default: 123')
+    args = parser.parse_args()
+    assert len(args.result_files) in [1, 2], "Only one or two result files are supported!"
+    return args
+
+
+def load_records(result_file):
+    data = np.load(result_file, allow_pickle=True)
+    return crossing_records(data['pred'], data['label'], data['toas']), np.reshape(data['label'], (-1,))
+
+
+def print_table(names, point, lower, upper, level):
+    print('%-24s %10s %22s' % ('', 'estimate', '%d%% CI' % (round(level * 100))))
+    for name, p, l, u in zip(names, point, lower, upper):
+        print('%-24s %10.4f %10.4f ~ %-10.4f' % (name, p, l, u))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = [load_records(result_file) for result_file in args.result_files]
+    records_all = [records for records, _ in results]
+    labels = results[0][1]
+    for _, labels_other in results[1:]:
+        assert np.array_equal(labels, labels_other), "The result files should be evaluated on the same videos!"
+    n_videos = records_all[0]['n_videos']
+
+    t_start = time.time()
+    strata = positive_videos(records_all[0]) if args.stratified else None
+    weights = bootstrap_weights(n_videos, n_boot=args.n_boot, seed=args.seed, strata=strata)
+    full = np.ones((1, n_videos))
+    points, samples = [], []
+    for records in records_all:
+        points.append(bootstrap_metrics(records, full, fps=args.fps, mode=args.eval_mode)[0])
+        samples.append(bootstrap_metrics(records, weights, fps=args.fps, mode=args.eval_mode))
+    print("%d videos (%d positive), %d replicates in %.2f s"%(n_videos, records_all[0]['n_pos'], args.n_boot, time.time() - t_start))
+
+    for result_file, point, sample in zip(args.result_files, points, samples):
+        print('\n' + result_file)
+        lower, upper = confidence_interval(sample, level=args.level)
+        print_table(METRICS, point, lower, upper, args.level)
+
+    if len(records_all) == 2:
+        # paired differences use the same resampled videos for both methods
+        diff = samples[0] - samples[1]
+        lower, upper = confidence_interval(diff, level=args.level)
+        p_values = paired_p_value(diff)
+        print('\nDifference (first - second)')
+        print('%-24s %10s %22s %10s' % ('', 'estimate', '%d%% CI' % (round(args.level * 100)), 'p-value'))
+        for name, p, l, u, pv in zip(METRICS, points[0] - points[1], lower, upper, p_values):
+            print('%-24s %10.4f %10.4f ~ %-10.4f %10.4f' % (name, p, l, u, pv))
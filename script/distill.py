@@ -0,0 +1,280 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os, sys
+import time
+import json
+import argparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_PATH)
+from src.Models import UString, StudentGRU
+from src.eval_tools import EvalAccumulator
+from src.eval_worker import load_snapshot, snapshot_state
+from src.checkpoint import atomic_save
+from src.feature_cache import open_feature_cache
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Distill a trained UString model into a lightweight deterministic student')
+    parser.add_argument('--data_path', type=str, default='./data',
+                        help='The relative path of dataset (as in main.py).')
+    parser.add_argument('--dataset', type=str, default='dad', choices=['a3d', 'dad', 'crash'],
+                        help='The name of dataset. Default: dad')
+    parser.add_argument('--feature_name', type=str, default='vgg16',
+                        help='The name of feature embedding methods. Default: vgg16')
+    parser.add_argument('--feature_cache', type=str, default='',
+                        help='The directory of the decoded datasets (see main.py). Default: read the npz files')
+    parser.add_argument('--model_file', type=str, required=True,
+                        help='The checkpoint of the teacher UString model.')
+    parser.add_argument('--hidden_dim', type=int, default=256,
+                        help='The dimension of hidden states of the teacher. Default: 256')
+    parser.add_argument('--latent_dim', type=int, default=256,
+                        help='The dimension of latent space of the teacher. Default: 256')
+    parser.add_argument('--num_rnn', type=int, default=1,
+                        help='The number of RNN cells of the teacher. Default: 1')
+    parser.add_argument('--n_obj', type=int, default=19,
+                        help='The number of objects of each frame of the teacher, the detections are zero padded or truncated to it. Default: 19')
+    parser.add_argument('--top_k', type=int, default=None,
+                        help='The number of nearest neighbours of each object in the graphs of the teacher, 0 for complete graphs. Default: complete graphs up to 32 objects, 8 beyond')
+    parser.add_argument('--readout', type=str, default='flatten', choices=['flatten', 'mean'],
+                        help='The readout of the object latents of the teacher, flatten (n_obj fixed) or the mean of the detected objects. Default: flatten')
+    parser.add_argument('--npass', type=int, default=10,
+                        help='The number of Bayesian samples of the teacher, as in testing. Default: 10')
+    parser.add_argument('--student_dim', type=int, default=64,
+                        help='The dimension of hidden states of the student. Default: 64')
+    parser.add_argument('--epoch', type=int, default=20,
+                        help='The number of training epochs. Default: 20')
+    parser.add_argument('--batch_size', type=int, default=10,
+                        help='The batch size in training process. Default: 10')
+    parser.add_argument('--base_lr', type=float, default=1e-3,
+                        help='The base learning rate. Default: 1e-3')
+    parser.add_argument('--kd_weight', type=float, default=1.0,
+                        help='The weight of the cross entropy to the accident probability of the teacher. Default: 1.0')
+    parser.add_argument('--unc_weight', type=float, default=10.0,
+                        help='The weight of the error of the uncertainties (as standard deviations) of the teacher. Default: 10.0')
+    parser.add_argument('--gt_weight', type=float, default=0.1,
+                        help='The weight of the exponential loss (_exp_loss) to the ground truth. Default: 0.1')
+    parser.add_argument('--latency_runs', type=int, default=10,
+                        help='The number of timed inferences of a single video. Default: 10')
+    parser.add_argument('--latency_threads', type=int, default=1,
+                        help='The number of CPU threads when measuring the latency (0 for the torch default). Default: 1')
+    parser.add_argument('--gpus', type=str, default="0",
+                        help='The device IDs of GPU, -1 to run on the CPU. Default: 0')
+    parser.add_argument('--output_dir', type=str, default='./output/student',
+                        help='The directory of the student checkpoints and the report. Default: ./output/student')
+    parser.add_argument('--seed', type=int, default=123,
+                        help='The random seed. Default: 123')
+    return parser.parse_args()
+
+
+class IndexedDataset(Dataset):
+    """ The samples of a dataset prefixed by their index, to look up the targets of the teacher.
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        return (index,) + tuple(self.dataset[index])
+
+
+def load_datasets(args, device):
+    data_path = os.path.join(ROOT_PATH, args.data_path, args.dataset)
+    if args.dataset == 'dad':
+        from src.DataLoader import DADDataset
+        datasets = [DADDataset(data_path, args.feature_name, phase, toTensor=True, device=device, n_obj=args.n_obj, top_k=args.top_k)
+                    for phase in ['training', 'testing']]
+    elif args.dataset == 'a3d':
+        from src.DataLoader import A3DDataset
+        datasets = [A3DDataset(data_path, args.feature_name, phase, toTensor=True, device=device, n_obj=args.n_obj, top_k=args.top_k)
+                    for phase in ['train', 'test']]
+    else:
+        from src.DataLoader import CrashDataset
+        datasets = [CrashDataset(data_path, args.feature_name, phase, toTensor=True, device=device, n_obj=args.n_obj, top_k=args.top_k)
+                    for phase in ['train', 'test']]
+    if args.feature_cache:
+        datasets = [open_feature_cache(dataset, args.feature_cache) for dataset in datasets]
+    return datasets
+
+
+def load_teacher(args, data, device):
+    model = UString(data.dim_feature, args.hidden_dim, args.latent_dim, n_layers=args.num_rnn, n_obj=data.n_obj,
+                    n_frames=data.n_frames, fps=data.fps, with_saa=True, uncertain_ranking=True, readout=args.readout)
+    checkpoint = torch.load(args.model_file, map_location='cpu')
+    load_snapshot(model, {'model': checkpoint['model'], 'rnn': checkpoint.get('rnn', {})})
+    model = model.to(device=device)
+    model.eval()
+    return model
+
+
+def frame_outputs(all_outputs):
+    """ :return: the logits (B x T x 2) and the aleatoric and epistemic uncertainties (B x T x 2), i.e., the traces
+             of their matrices, of the outputs of UString or the student
+    """
+    pred = torch.stack([output['pred_mean'] for output in all_outputs], dim=1)
+    aleatoric = torch.stack([output['aleatoric'] for output in all_outputs], dim=1)  # B x T x 2 x 2
+    epistemic = torch.stack([output['epistemic'] for output in all_outputs], dim=1)  # B x T x 2 x 2
+    uncertain = torch.stack([aleatoric[..., 0, 0] + aleatoric[..., 1, 1], epistemic[..., 0, 0] + epistemic[..., 1, 1]], dim=-1)
+    return pred, uncertain
+
+
+def teacher_targets(teacher, dataset, batch_size, npass):
+    """ :return: the accident probability (N x T) and the uncertainties (N x T x 2) of each frame by the teacher
+    """
+    loader = DataLoader(dataset=dataset, batch_size=batch_size, shuffle=False)
+    probs, uncertains = [], []
+    with torch.no_grad():
+        for batch_xs, batch_ys, graph_edges, edge_weights, batch_toas in tqdm(loader, desc="Teacher targets"):
+            _, all_outputs, _ = teacher(batch_xs, batch_ys, batch_toas, graph_edges, edge_weights=edge_weights, npass=npass,
+                                        nbatch=len(loader), eval_uncertain=True)
+            pred, uncertain = frame_outputs(all_outputs)
+            probs.append(F.softmax(pred, dim=-1)[..., 1])
+            uncertains.append(uncertain)
+    return torch.cat(probs), torch.cat(uncertains)
+
+
+def distill_loss(losses, all_outputs, probs_t, uncertain_t, args):
+    """ The cross entropy to the probabilities of the teacher, the squared error of the uncertainties as standard
+    deviations (their values are small), and the exponential loss to the ground truth averaged over the frames.
+    """
+    pred, uncertain = frame_outputs(all_outputs)
+    log_p = F.log_softmax(pred, dim=-1)
+    kd_loss = -torch.mean(probs_t * log_p[..., 1] + (1 - probs_t) * log_p[..., 0])
+    unc_loss = torch.mean((torch.sqrt(uncertain + 1e-8) - torch.sqrt(uncertain_t + 1e-8)) ** 2)
+    gt_loss = losses['cross_entropy'] / pred.size(1)
+    total_loss = args.kd_weight * kd_loss + args.unc_weight * unc_loss + args.gt_weight * gt_loss
+    return total_loss, {'kd_loss': kd_loss.item(), 'unc_loss': unc_loss.item(), 'gt_loss': float(gt_loss)}
+
+
+def evaluate(model, dataset, batch_size, npass):
+    """ :return: the metrics (AP, mTTA, TTA_R80) and the uncertainties (N x T x 2) of the test set
+    """
+    loader = DataLoader(dataset=dataset, batch_size=batch_size, shuffle=False)
+    accumulator = EvalAccumulator()
+    uncertains = []
+    model.eval()
+    with torch.no_grad():
+        for batch_xs, batch_ys, graph_edges, edge_weights, batch_toas in loader:
+            _, all_outputs, _ = model(batch_xs, batch_ys, batch_toas, graph_edges, edge_weights=edge_weights, npass=npass,
+                                      nbatch=len(loader), eval_uncertain=True)
+            pred, uncertain = frame_outputs(all_outputs)
+            pred_frames = F.softmax(pred, dim=-1)[..., 1].cpu().numpy()
+            toas = np.reshape(batch_toas.cpu().numpy(), (-1,)).astype(int)
+            accumulator.update(pred_frames, batch_ys.cpu().numpy()[:, 1], toas, uncertainties=uncertain.cpu().numpy())
+            uncertains.append(uncertain.cpu())
+    AP, mTTA, TTA_R80 = accumulator.evaluate(fps=dataset.fps)
+    metrics = {'AP': float(AP), 'mTTA': float(mTTA), 'TTA_R80': float(TTA_R80)}
+    return metrics, torch.cat(uncertains)
+
+
+def latency_per_frame(model, dataset, npass, runs=10, threads=1):
+    """ :return: the median time (ms) per frame of the inference of a single video, as in the demo
+    """
+    batch_xs, batch_ys, graph_edges, edge_weights, batch_toas = [torch.as_tensor(value).unsqueeze(0) for value in dataset[0]]
+    num_threads = torch.get_num_threads()
+    if threads > 0:
+        torch.set_num_threads(threads)
+    times = []
+    with torch.no_grad():
+        for i in range(runs + 2):
+            t_start = time.perf_counter()
+            model(batch_xs, batch_ys, batch_toas, graph_edges, edge_weights=edge_weights, npass=npass, eval_uncertain=True)
+            if batch_xs.is_cuda:
+                torch.cuda.synchronize()
+            # the first 2 runs are warmup
+            if i >= 2:
+                times.append(time.perf_counter() - t_start)
+    torch.set_num_threads(num_threads)
+    return 1000.0 * np.median(times) / batch_xs.size(1)
+
+
+def count_params(state):
+    return int(sum(value.numel() for value in state['model'].values()) +
+               sum(value.numel() for layers in state.get('rnn', {}).values() for layer in layers for value in layer.values()))
+
+
+def save_student(model, epoch, metrics, args, filename):
+    atomic_save({'epoch': epoch, 'model': model.state_dict(), 'student': model.config(), 'metrics': metrics,
+                 'teacher': os.path.abspath(args.model_file)}, filename)
+
+
+def run(args):
+    os.environ['CUDA_VISIBLE_DEVICES'] = args.gpus
+    device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+    model_dir = os.path.join(args.output_dir, args.dataset)
+    if not os.path.exists(model_dir):
+        os.makedirs(model_dir)
+    train_data, test_data = load_datasets(args, device)
+    teacher = load_teacher(args, train_data, device)
+
+    # the targets of the teacher are computed once
+    torch.manual_seed(args.seed)
+    probs_t, uncertain_t = teacher_targets(teacher, train_data, args.batch_size, args.npass)
+
+    student = StudentGRU(train_data.dim_feature, args.student_dim, n_obj=train_data.n_obj, n_frames=train_data.n_frames, fps=train_data.fps).to(device=device)
+    optimizer = torch.optim.Adam(student.parameters(), lr=args.base_lr)
+    traindata_loader = DataLoader(dataset=IndexedDataset(train_data), batch_size=args.batch_size, shuffle=True, drop_last=True)
+    best_metrics, best_file = None, os.path.join(model_dir, 'student_model.pth')
+    for k in range(args.epoch):
+        student.train()
+        for index, batch_xs, batch_ys, graph_edges, edge_weights, batch_toas in traindata_loader:
+            optimizer.zero_grad()
+            losses, all_outputs, _ = student(batch_xs, batch_ys, batch_toas, graph_edges, edge_weights=edge_weights)
+            total_loss, loss_info = distill_loss(losses, all_outputs, probs_t[index], uncertain_t[index], args)
+            total_loss.backward()
+            torch.nn.utils.clip_grad_norm_(student.parameters(), 10)
+            optimizer.step()
+        print('----------------------------------')
+        print('epoch: %d, total loss = %.6f, kd_loss = %.6f, unc_loss = %.6f, gt_loss = %.6f'
+              % (k, total_loss.item(), loss_info['kd_loss'], loss_info['unc_loss'], loss_info['gt_loss']))
+        metrics, _ = evaluate(student, test_data, args.batch_size, npass=1)
+        # the student with the best AP, as the final model of main.py
+        if best_metrics is None or metrics['AP'] > best_metrics['AP']:
+            best_metrics = metrics
+            save_student(student, k, metrics, args, best_file)
+        save_student(student, k, metrics, args, os.path.join(model_dir, 'student_last.pth'))
+    print("Student model saved in: %s"%(best_file))
+
+    # report the latency and the accuracy of the teacher and the best student
+    checkpoint = torch.load(best_file, map_location='cpu')
+    student.load_state_dict(checkpoint['model'])
+    torch.manual_seed(args.seed)
+    teacher_metrics, teacher_unc = evaluate(teacher, test_data, args.batch_size, npass=args.npass)
+    student_metrics, student_unc = evaluate(student, test_data, args.batch_size, npass=1)
+    report = {'device': device.type, 'latency_threads': args.latency_threads, 'n_frames': test_data.n_frames,
+              'n_obj': test_data.n_obj, 'top_k': test_data.top_k, 'models': {}}
+    report['models']['teacher'] = dict(teacher_metrics, params=count_params(snapshot_state(teacher)), file=os.path.abspath(args.model_file), readout=args.readout,
+                                       ms_per_frame=latency_per_frame(teacher, test_data, args.npass, args.latency_runs, args.latency_threads))
+    report['models']['student'] = dict(student_metrics, params=count_params({'model': student.state_dict()}), file=os.path.abspath(best_file),
+                                       ms_per_frame=latency_per_frame(student, test_data, 1, args.latency_runs, args.latency_threads))
+    # the error of the predicted uncertainties on the test set
+    unc_error = torch.mean(torch.abs(student_unc - teacher_unc), dim=(0, 1))
+    report['models']['student'].update({'aleatoric_mae': float(unc_error[0]), 'epistemic_mae': float(unc_error[1])})
+    with open(os.path.join(model_dir, 'report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print('\n%-10s %12s %12s %8s %8s %8s %14s %14s' % ('model', 'params', 'ms/frame', 'AP', 'mTTA', 'TTA_R80', 'aleatoric MAE', 'epistemic MAE'))
+    for name, result in report['models'].items():
+        print('%-10s %12d %12.3f %8.4f %8.4f %8.4f %14s %14s' % (name, result['params'], result['ms_per_frame'], result['AP'], result['mTTA'], result['TTA_R80'],
+                                                               '%.6f' % result['aleatoric_mae'] if 'aleatoric_mae' in result else '-',
+                                                               '%.6f' % result['epistemic_mae'] if 'epistemic_mae' in result else '-'))
+    print("Latency on %s with %d threads, speedup: %.1fx"%(device.type, args.latency_threads, report['models']['teacher']['ms_per_frame'] / report['models']['student']['ms_per_frame']))
+    print("Report saved in: %s"%(os.path.join(model_dir, 'report.json')))
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    run(args)
@@ -6,6 +6,7 @@ import os.path as osp
 import numpy as np
 import os, cv2
 import argparse, sys
+import json
 from tqdm import tqdm
 
 import torch
@@ -14,6 +15,10 @@ from torchvision import models, transforms
 from torch.autograd import Variable
 from PIL import Image
 
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+from src.roi_features import RoIAlignFeatures, ROI_IMAGE_SIZE
+from src.video_io import FrameSource
+
 CLASSES = ('__background__', 'Car', 'Pedestrian', 'Cyclist')
 
 class ResNet(nn.Module):
@@ -39,6 +44,13 @@ class ResNet(nn.Module):
         output = self.net.avgpool(output)
         return output
 
+    def roi_align_features(self):
+        """ :return: the features of the boxes pooled from layer4 to 7 x 7, followed by the average pooling
+        """
+        trunk = nn.Sequential(self.net.conv1, self.net.bn1, self.net.relu, self.net.maxpool,
+                              self.net.layer1, self.net.layer2, self.net.layer3, self.net.layer4)
+        return RoIAlignFeatures(trunk, nn.Sequential(self.net.avgpool, nn.Flatten()), self.dim_feat, spatial_scale=1.0 / 32)
+
 
 def parse_args():
     """
@@ -47,9 +59,11 @@ def parse_args():
     parser = argparse.ArgumentParser(description='Test a Fast R-CNN network')
     parser.add_argument('--dad_dir', dest='dad_dir', help='The directory to the Dashcam Accident Dataset', type=str)
     parser.add_argument('--out_dir', dest='out_dir', help='The directory to the output files.', type=str)
-    parser.add_argument('--n_frames', dest='n_frames', help='The number of frames sampled from each video', default=100)
-    parser.add_argument('--n_boxes', dest='n_boxes', help='The number of bounding boxes for each frame', default=19)
-    parser.add_argument('--dim_feat', dest='dim_feat', help='The dimension of extracted ResNet101 features', default=2048)
+    parser.add_argument('--n_frames', dest='n_frames', help='The number of frames sampled from each video', type=int, default=100)
+    parser.add_argument('--n_boxes', dest='n_boxes', help='The number of bounding boxes for each frame', type=int, default=19)
+    parser.add_argument('--dim_feat', dest='dim_feat', help='The dimension of extracted ResNet101 features', type=int, default=2048)
+    parser.add_argument('--feature_mode', dest='feature_mode', help='ResNet101 on each box crop (crop) or on each frame with RoIAlign pooling of the boxes (roi_align)',
+                        default='crop', choices=['crop', 'roi_align'])
 
     if len(sys.argv) == 1:
         parser.print_help()
@@ -60,17 +74,8 @@ def parse_args():
 
 
 def get_video_frames(video_file, n_frames=100):
-    # get the video data
-    cap = cv2.VideoCapture(video_file)
-    ret, frame = cap.read()
-    video_data = []
-    counter = 0
-    while (ret):
-        video_data.append(frame)
-        ret, frame = cap.read()
-        counter += 1
-    assert counter == n_frames
-    return video_data
+    # the frames are decoded lazily, a few frames ahead of the feature extraction
+    return FrameSource(video_file, n_frames=n_frames, prefetch=8)
 
 
 def bbox_to_imroi(bboxes, image):
@@ -131,10 +136,18 @@ def extract_features(data_path, video_path, dest_path, phase):
             video_frames = get_video_frames(video_file, n_frames=args.n_frames)
             # start to process each frame
             features_res101 = np.zeros((args.n_frames, args.n_boxes + 1, args.dim_feat), dtype=np.float32)  # (100 x 20 x 2048)
-            for j, frame in tqdm(enumerate(video_frames), desc="The %d-th video"%(i+1), total=len(video_frames)):
+            for j, frame in tqdm(enumerate(video_frames), desc="The %d-th video"%(i+1), total=args.n_frames):
                 # find the non-empty boxes
                 bboxes = get_boxes(detections[i, j], frame.shape)  # n x 4
                 frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                if args.feature_mode == 'roi_align':
+                    with torch.no_grad():
+                        # one pass of the whole frame, the frame feature followed by the box features
+                        image = roi_transform(Image.fromarray(frame))
+                        ims_frame = torch.unsqueeze(image, dim=0).float().to(device=device)
+                        feature_all = roi_extractor(ims_frame, [bboxes], frame.shape[:2])
+                        features_res101[j, :len(bboxes)+1, :] = feature_all.cpu().numpy()
+                    continue
                 with torch.no_grad():
                     # extract image feature
                     image = transform(Image.fromarray(frame))
@@ -148,8 +161,9 @@ def extract_features(data_path, video_path, dest_path, phase):
                         ims_roi = ims_roi.float().to(device=device)
                         feature_roi = torch.squeeze(torch.squeeze(feat_extractor(ims_roi), dim=-1), dim=-1)  # (2048,)
                         features_res101[j, 1:len(bboxes)+1,:] = feature_roi.cpu().numpy() if feature_roi.is_cuda else feature_roi.detach().numpy()
+            assert j + 1 == args.n_frames, video_file
             # we only update the features
-            np.savez_compressed(feat_file, data=features_res101, det=detections[i], labels=labels[i], ID=vidname)
+            np.savez_compressed(feat_file, data=features_res101, det=detections[i], labels=labels[i], ID=vidname, feature_mode=args.feature_mode)
             files_list.append(vidname)
         batch_id += 1
     return files_list
@@ -170,6 +184,15 @@ def run(data_path, video_path, dest_path):
     # process testing set
     test_list = extract_features(data_path, video_path, test_path, 'testing')
     print('Testing samples: %d' % (len(test_list)))
+    # the manifest is written last so that an interrupted store is never picked up by the data loaders
+    feature_name = osp.basename(osp.normpath(dest_path))
+    manifest = {'feature_name': feature_name[:-len('_features')] if feature_name.endswith('_features') else feature_name,
+                'dim_feature': int(args.dim_feat),
+                'feature_mode': args.feature_mode}
+    if args.feature_mode == 'roi_align':
+        manifest['roi_align'] = dict(roi_extractor.config(), image_size=ROI_IMAGE_SIZE)
+    with open(os.path.join(dest_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
 
 
 if __name__ == "__main__":
@@ -186,9 +209,12 @@ if __name__ == "__main__":
         transforms.CenterCrop(224),
         transforms.ToTensor()]
     )
+    # the whole frame goes through the backbone in the roi_align mode
+    roi_transform = transforms.Compose([transforms.Resize(ROI_IMAGE_SIZE), transforms.ToTensor()])
+    roi_extractor = feat_extractor.roi_align_features()
 
     data_path = osp.join(args.dad_dir, 'features')  # /data/DAD/features
     video_path = osp.join(args.dad_dir, 'videos')   # /data/DAD/videos
-    run(data_path, video_path, args.out_dir)        # out: /data/DAD/res101_features
+    run(data_path, video_path, args.out_dir)        # out: /data/DAD/res101_features (or res101_roi_features)
 
     print("Done!")
\ No newline at end of file
@@ -0,0 +1,280 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import pickle
+import argparse, sys
+import numpy as np
+from tqdm import tqdm
+
+# the frames, objects and fps hard-coded in the data loaders of each dataset
+N_FRAMES = {'dad': 100, 'a3d': 100, 'crash': 50}
+FPS = {'dad': 20.0, 'a3d': 20.0, 'crash': 10.0}
+N_OBJ = 19
+# the numbers of training and testing videos of the released DAD and CCD splits, scaled by --scale
+REAL_SIZES = {'dad': (1284, 466), 'crash': (3600, 900)}
+SPLITS = {'dad': ['training', 'testing'], 'a3d': ['train', 'test'], 'crash': ['train', 'test']}
+# the time of accident of all positive DAD videos, as assumed by DADDataset
+DAD_TOA = 90
+IMG_W, IMG_H = 1280, 720
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Generate a synthetic dataset in the on-disk format of DAD, A3D or CCD')
+    parser.add_argument('--data_path', type=str, default='./data/synthetic',
+                        help='The root of the dataset, train with main.py --data_path on it. Default: ./data/synthetic')
+    parser.add_argument('--dataset', type=str, default='dad', choices=['a3d', 'dad', 'crash'],
+                        help='The format of the dataset. Default: dad')
+    parser.add_argument('--feature_name', type=str, default='vgg16',
+                        help='The name of the feature store, train with main.py --feature_name on it. Default: vgg16')
+    parser.add_argument('--dim_feature', type=int, default=4096,
+                        help='The feature dimension, recorded in the manifest of the feature store. Default: 4096')
+    parser.add_argument('--n_train', type=int, default=None,
+                        help='The number of training videos. Default: the size of the real split for dad and crash')
+    parser.add_argument('--n_test', type=int, default=None,
+                        help='The number of testing videos. Default: the size of the real split for dad and crash')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='The factor on the numbers of videos, e.g., 10 for 10x the real scale. Default: 1.0')
+    parser.add_argument('--pos_ratio', type=float, default=0.35,
+                        help='The ratio of positive videos. Default: 0.35')
+    parser.add_argument('--boxes', type=int, nargs=2, default=[3, N_OBJ],
+                        help='The minimal and maximal numbers of objects in a video, the others are zero padded. Default: 3 19')
+    parser.add_argument('--toa_range', type=float, nargs=2, default=[0.5, 0.95],
+                        help='The range of the time of accident as a ratio of the video length (a3d and crash, dad uses frame 90). Default: 0.5 0.95')
+    parser.add_argument('--signal', type=float, default=1.0,
+                        help='The strength of the accident pattern added to the features of positive videos before the accident, 0 for pure noise. Default: 1.0')
+    parser.add_argument('--compress', action='store_true',
+                        help='Write compressed npz files as the released features (slower to write and to load).')
+    parser.add_argument('--seed', type=int, default=123,
+                        help='The random seed, each video only depends on the seed, the split and its index. Default: 123')
+
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+    return args
+
+
+def split_sizes(args):
+    if args.n_train is not None and args.n_test is not None:
+        n_train, n_test = args.n_train, args.n_test
+    else:
+        assert args.dataset in REAL_SIZES, "Give --n_train and --n_test for the %s dataset"%(args.dataset)
+        n_train = args.n_train if args.n_train is not None else REAL_SIZES[args.dataset][0]
+        n_test = args.n_test if args.n_test is not None else REAL_SIZES[args.dataset][1]
+    return int(round(n_train * args.scale)), int(round(n_test * args.scale))
+
+
+def split_labels(n_videos, pos_ratio, rng):
+    """ :return: the shuffled labels (n_videos,) with round(n_videos * pos_ratio) positives
+    """
+    labels = np.zeros((n_videos,), dtype=np.int64)
+    labels[:int(round(n_videos * pos_ratio))] = 1
+    return labels[rng.permutation(n_videos)]
+
+
+def video_rng(seed, split, index, stream):
+    # independent streams for the timing (stream 0) and the content (stream 1) of each video
+    return np.random.RandomState([seed, split, index, stream])
+
+
+def video_timing(args, split, index, label):
+    """ :return: the time of accident (None for negative videos) and the number of objects of a video
+    """
+    rng = video_rng(args.seed, split, index, 0)
+    n_frames = N_FRAMES[args.dataset]
+    toa = None
+    if label > 0:
+        toa = DAD_TOA if args.dataset == 'dad' else rng.randint(int(args.toa_range[0] * n_frames), int(args.toa_range[1] * n_frames))
+        toa = min(max(1, toa), n_frames - 1)
+    n_boxes = rng.randint(args.boxes[0], args.boxes[1] + 1)
+    return toa, n_boxes
+
+
+def make_detections(rng, n_frames, n_boxes, label, toa):
+    """ Boxes moving smoothly in the image, two of them collide at the time of accident in positive videos.
+    :return: detections (n_frames x 19 x 6) as (x1, y1, x2, y2, score, class), zero padded after n_boxes
+    """
+    centers = rng.uniform([0.1 * IMG_W, 0.3 * IMG_H], [0.9 * IMG_W, 0.9 * IMG_H], size=(n_boxes, 2))
+    velocity = rng.normal(0, 3.0, size=(n_boxes, 2))
+    sizes = rng.uniform(30, 200, size=(n_boxes, 1)) * np.array([[1.0, 0.75]])
+    tracks = centers[None] + np.arange(n_frames)[:, None, None] * velocity[None] + np.cumsum(rng.normal(0, 2.0, size=(n_frames, n_boxes, 2)), axis=0)
+    if label > 0 and n_boxes > 1:
+        # the first two objects move to the same point at the time of accident
+        meet = 0.5 * (tracks[toa, 0] + tracks[toa, 1])
+        for k in range(2):
+            alpha = np.clip(np.arange(n_frames) / max(toa, 1), 0, 1)[:, None]
+            tracks[:, k] = (1 - alpha) * tracks[:, k] + alpha * meet
+    tracks = np.clip(tracks, 0, [IMG_W, IMG_H])
+    detections = np.zeros((n_frames, N_OBJ, 6), dtype=np.float32)
+    detections[:, :n_boxes, 0:2] = np.clip(tracks - 0.5 * sizes[None], 0, [IMG_W, IMG_H])
+    detections[:, :n_boxes, 2:4] = np.clip(tracks + 0.5 * sizes[None], 0, [IMG_W, IMG_H])
+    detections[:, :n_boxes, 4] = rng.uniform(0.5, 1.0, size=(n_frames, n_boxes))
+    detections[:, :n_boxes, 5] = rng.randint(1, 5, size=(1, n_boxes))
+    return detections
+
+
+def make_features(rng, n_frames, n_boxes, dim, label, toa, fps, signal, pattern):
+    """ Non-negative (ReLU-like) noise, with the pattern growing over the 2 seconds before the accident on the
+    frame feature and the two colliding objects of positive videos.
+    :return: features (n_frames x 20 x dim), the zero rows of the padded objects are kept
+    """
+    features = np.zeros((n_frames, N_OBJ + 1, dim), dtype=np.float32)
+    features[:, :n_boxes + 1] = np.maximum(rng.standard_normal((n_frames, n_boxes + 1, dim)).astype(np.float32), 0)
+    if label > 0 and signal > 0:
+        lead = 2 * fps
+        ramp = np.clip((np.arange(n_frames) - (toa - lead)) / lead, 0, 1).astype(np.float32)
+        features[:, :min(n_boxes, 2) + 1] += signal * ramp[:, None, None] * pattern[None, None]
+    return features
+
+
+def make_video(args, split, index, label):
+    """ :return: features, detections and the time of accident (None for negative videos) of a video
+    """
+    toa, n_boxes = video_timing(args, split, index, label)
+    n_frames = N_FRAMES[args.dataset]
+    rng = video_rng(args.seed, split, index, 1)
+    detections = make_detections(rng, n_frames, n_boxes, label, toa if toa is not None else n_frames - 1)
+    # the accident pattern is shared by all videos
+    pattern = np.maximum(np.random.RandomState(args.seed).standard_normal(args.dim_feature), 0).astype(np.float32)
+    features = make_features(rng, n_frames, n_boxes, args.dim_feature, label, toa, FPS[args.dataset], args.signal, pattern)
+    return features, detections, toa
+
+
+def save_npz(filename, compress, **data):
+    if not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    # write and rename, so that an interrupted run never leaves a truncated file, the temporary file is out of the
+    # split directory which is listed by DADDataset
+    tmp_file = os.path.join(os.path.dirname(os.path.dirname(filename)), '.%s.tmp.npz' % (os.path.basename(filename)[:-len('.npz')]))
+    if compress:
+        np.savez_compressed(tmp_file, **data)
+    else:
+        np.savez(tmp_file, **data)
+    os.replace(tmp_file, filename)
+
+
+def write_dad(args, feature_dir, split, phase, labels):
+    for i, label in enumerate(tqdm(labels, desc="Writing %s set"%(phase))):
+        vid = 'b%03d_%06d' % (i // 10 + 1, i)
+        filename = os.path.join(feature_dir, phase, vid + '.npz')
+        if os.path.exists(filename):
+            continue
+        features, detections, toa = make_video(args, split, i, label)
+        save_npz(filename, args.compress, data=features, labels=np.array([1 - label, label], dtype=np.float32), det=detections, ID=vid)
+
+
+def write_crash(args, feature_dir, split, phase, labels, counts, annotations):
+    """
+    :param: counts, the numbers of written [negative, positive] videos, updated
+    :param: annotations, the frame labels of the positive videos [(vid, labels)], updated
+    """
+    list_lines = []
+    for i, label in enumerate(tqdm(labels, desc="Writing %s set"%(phase))):
+        # the positive and negative videos are numbered separately over all splits, as in CCD
+        attr = 'positive' if label > 0 else 'negative'
+        counts[label] += 1
+        vid = '%06d' % (counts[label])
+        list_lines.append('%s/%s.npz %d' % (attr, vid, label))
+        if label > 0:
+            toa, _ = video_timing(args, split, i, label)
+            frame_labels = np.zeros((N_FRAMES['crash'],), dtype=np.int64)
+            frame_labels[toa:] = 1
+            annotations.append((vid, frame_labels))
+        filename = os.path.join(feature_dir, attr, vid + '.npz')
+        if os.path.exists(filename):
+            continue
+        features, detections, toa = make_video(args, split, i, label)
+        save_npz(filename, args.compress, data=features, labels=np.array([1 - label, label], dtype=np.float32), det=detections, ID=vid)
+    with open(os.path.join(feature_dir, '%s.txt' % (phase)), 'w') as f:
+        f.writelines(line + '\n' for line in list_lines)
+
+
+def write_crash_annotations(args, data_path, annotations):
+    """ Crash-1500.txt: vid,[frame labels],startframe,vid_ytb,lighting,weather,ego_involve of the positive videos
+    """
+    anno_dir = os.path.join(data_path, 'videos')
+    if not os.path.exists(anno_dir):
+        os.makedirs(anno_dir)
+    rng = np.random.RandomState(args.seed)
+    with open(os.path.join(anno_dir, 'Crash-1500.txt'), 'w') as f:
+        for vid, frame_labels in annotations:
+            f.write('%s,[%s],%d,synthetic%s,%s,%s,%s\n' % (vid, ','.join(str(v) for v in frame_labels), rng.randint(0, 1000), vid,
+                                                         rng.choice(['Day', 'Night']), rng.choice(['Normal', 'Rainy', 'Snowy']),
+                                                         rng.choice(['Yes', 'No'])))
+
+
+def write_a3d(args, data_path, feature_dir, split, phase, labels):
+    list_lines = []
+    for i, label in enumerate(tqdm(labels, desc="Writing %s set"%(phase))):
+        # clip ids as in A3D: <video id>_<segment>
+        clip_id = 'syn%08d_%06d' % (split * 10000000 + i, i)
+        attr = 'positive' if label > 0 else 'negative'
+        list_lines.append('%s/%s.npz %d' % (attr, clip_id, label))
+        filename = os.path.join(feature_dir, attr, clip_id + '.npz')
+        if os.path.exists(filename):
+            continue
+        features, detections, toa = make_video(args, split, i, label)
+        dets_file = os.path.join(data_path, 'detections', attr, clip_id + '.pkl')
+        if not os.path.exists(os.path.dirname(dets_file)):
+            os.makedirs(os.path.dirname(dets_file))
+        with open(dets_file, 'wb') as f:
+            pickle.dump(detections, f)
+        if label > 0:
+            label_file = os.path.join(data_path, 'frame_labels', clip_id + '.txt')
+            if not os.path.exists(os.path.dirname(label_file)):
+                os.makedirs(os.path.dirname(label_file))
+            with open(label_file, 'w') as f:
+                f.writelines('%06d %d\n' % (t, int(t >= toa)) for t in range(N_FRAMES['a3d']))
+        # the features are written last, so that a video is complete when its npz file exists
+        save_npz(filename, args.compress, features=features)
+    with open(os.path.join(feature_dir, '%s.txt' % (phase)), 'w') as f:
+        f.writelines(line + '\n' for line in list_lines)
+
+
+def run(args):
+    data_path = os.path.join(args.data_path, args.dataset)
+    feature_dir = os.path.join(data_path, args.feature_name + '_features')
+    if not os.path.exists(feature_dir):
+        os.makedirs(feature_dir)
+    sizes = split_sizes(args)
+    counts, annotations = [0, 0], []
+    for split, (phase, n_videos) in enumerate(zip(SPLITS[args.dataset], sizes)):
+        labels = split_labels(n_videos, args.pos_ratio, np.random.RandomState([args.seed, split]))
+        if args.dataset == 'dad':
+            write_dad(args, feature_dir, split, phase, labels)
+        elif args.dataset == 'a3d':
+            write_a3d(args, data_path, feature_dir, split, phase, labels)
+        else:
+            write_crash(args, feature_dir, split, phase, labels, counts, annotations)
+        print("%s set: %d videos (%d positive)"%(phase, n_videos, int(np.sum(labels))))
+    if args.dataset == 'crash':
+        write_crash_annotations(args, data_path, annotations)
+    # the manifest is written last so that an interrupted store is never picked up by the data loaders
+    manifest = {'feature_name': args.feature_name,
+                'dim_feature': args.dim_feature,
+                'synthetic': {'dataset': args.dataset,
+                              'n_train': sizes[0],
+                              'n_test': sizes[1],
+                              'pos_ratio': args.pos_ratio,
+                              'boxes': args.boxes,
+                              'toa_range': args.toa_range,
+                              'signal': args.signal,
+                              'seed': args.seed}}
+    with open(os.path.join(feature_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print("Synthetic dataset saved in: %s (use --data_path %s --dataset %s --feature_name %s)"%(data_path, args.data_path, args.dataset, args.feature_name))
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    run(args)
+
+    print("Done!")
@@ -0,0 +1,56 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os, sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.pred_cache import PredictionCache
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='List and clean the prediction cache of the test phase and the demo')
+    parser.add_argument('command', type=str, choices=['list', 'gc', 'remove'],
+                        help='list the entries, remove the least recently used ones (gc), or remove the given keys.')
+    parser.add_argument('--cache_dir', type=str, default='./output_debug/bayes_gcrnn/vgg16/pred_cache',
+                        help='The directory of the prediction cache. Default: <output_dir>/pred_cache of main.py')
+    parser.add_argument('--keys', type=str, nargs='+', default=[],
+                        help='The keys (or unique key prefixes) to remove.')
+    parser.add_argument('--max_entries', type=int, default=None,
+                        help='gc: the number of most recently used entries to keep.')
+    parser.add_argument('--max_size_mb', type=float, default=None,
+                        help='gc: the maximum total size (MB) of the kept entries.')
+    parser.add_argument('--max_age_days', type=float, default=None,
+                        help='gc: remove the entries not used for the given days.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    cache = PredictionCache(args.cache_dir)
+    if args.command == 'list':
+        entries = cache.entries()
+        print('%-12s %-19s %-19s %9s %-8s %s' % ('key', 'created', 'last used', 'size (MB)', 'seed', 'checkpoint'))
+        for meta in entries:
+            last_used = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(meta['last_used']))
+            print('%-12s %-19s %-19s %9.2f %-8s %s' % (meta['key'][:12], meta['created'], last_used, meta['size'] / 1024.0**2,
+                                                       meta.get('seed', ''), meta.get('checkpoint', '')))
+        print("%d entries, %.2f MB in total"%(len(entries), sum(meta['size'] for meta in entries) / 1024.0**2))
+    elif args.command == 'gc':
+        max_bytes = None if args.max_size_mb is None else args.max_size_mb * 1024**2
+        removed = cache.gc(max_entries=args.max_entries, max_bytes=max_bytes, max_age_days=args.max_age_days)
+        print("Removed %d entries."%(len(removed)))
+    else:
+        keys = [meta['key'] for meta in cache.entries()]
+        for prefix in args.keys:
+            matched = [key for key in keys if key.startswith(prefix)]
+            if len(matched) != 1:
+                print("Skip %s: %d entries matched."%(prefix, len(matched)))
+                continue
+            cache.remove(matched[0])
+            print("Removed %s"%(matched[0]))
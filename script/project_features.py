@@ -0,0 +1,172 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import shutil
+import argparse, sys
+import numpy as np
+from tqdm import tqdm
+
+# the feature key and the split names used by each dataset
+DATA_KEY = {'dad': 'data', 'a3d': 'features', 'crash': 'data'}
+SPLITS = {'dad': ['training', 'testing'], 'a3d': ['train', 'test'], 'crash': ['train', 'test']}
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Project backbone features into a low-rank feature store')
+    parser.add_argument('--data_path', type=str, default='./data',
+                        help='The relative path of dataset.')
+    parser.add_argument('--dataset', type=str, default='dad', choices=['a3d', 'dad', 'crash'],
+                        help='The name of dataset. Default: dad')
+    parser.add_argument('--feature_name', type=str, default='vgg16', choices=['vgg16', 'res101'],
+                        help='The name of the source feature store. Default: vgg16')
+    parser.add_argument('--method', type=str, default='pca', choices=['pca', 'random'],
+                        help='The projection method fitted on the training split. Default: pca')
+    parser.add_argument('--ranks', type=int, nargs='+', default=[512],
+                        help='The target dimensions. One feature store is written for each rank. Default: 512')
+    parser.add_argument('--fit_videos', type=int, default=0,
+                        help='The number of training videos randomly sampled to fit PCA (0 means all). Default: 0')
+    parser.add_argument('--seed', type=int, default=123,
+                        help='The random seed. Default: 123')
+
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+    return args
+
+
+def get_split_files(feature_dir, dataset, phase):
+    """ Return the npz files (relative to feature_dir) of a data split.
+    """
+    if dataset == 'dad':
+        split_dir = os.path.join(feature_dir, phase)
+        assert os.path.exists(split_dir), "Directory does not exist: %s"%(split_dir)
+        return [os.path.join(phase, filename) for filename in sorted(os.listdir(split_dir))]
+    list_file = os.path.join(feature_dir, '%s.txt' % (phase))
+    assert os.path.exists(list_file), "file not exists: %s"%(list_file)
+    with open(list_file, 'r') as f:
+        files = [line.rstrip().split(' ')[0] for line in f.readlines()]
+    return files
+
+
+def valid_rows(feats):
+    # zero rows are padded boxes and stay zero after projection
+    return np.any(feats != 0, axis=1)
+
+
+def fit_pca(feature_dir, files, data_key, dim):
+    """ Fit PCA with the streaming first and second moments of all non-padded feature rows.
+    :return: mean (D,), eigen vectors (D x D) and eigen values (D,) in descending order
+    """
+    sum_x = np.zeros((dim,), dtype=np.float64)
+    sum_xx = np.zeros((dim, dim), dtype=np.float64)
+    n_rows = 0
+    for filename in tqdm(files, desc="Fitting PCA"):
+        feats = np.load(os.path.join(feature_dir, filename))[data_key].reshape(-1, dim)
+        feats = feats[valid_rows(feats)].astype(np.float64)
+        sum_x += np.sum(feats, axis=0)
+        sum_xx += np.matmul(feats.T, feats)
+        n_rows += feats.shape[0]
+    assert n_rows > 1, "No valid features to fit PCA!"
+    mean = sum_x / n_rows
+    cov = sum_xx / n_rows - np.outer(mean, mean)
+    eig_vals, eig_vecs = np.linalg.eigh(cov)
+    order = np.argsort(eig_vals)[::-1]
+    eig_vals = np.maximum(eig_vals[order], 0)
+    return mean, eig_vecs[:, order], eig_vals, n_rows
+
+
+def project(feats, mean, components):
+    """
+    :param: feats: (T, N, D) features
+    :return: (T, N, rank) projected features
+    """
+    shape = feats.shape
+    feats = feats.reshape(-1, shape[-1])
+    valid = valid_rows(feats)
+    feats_proj = np.zeros((feats.shape[0], components.shape[1]), dtype=np.float32)
+    feats_proj[valid] = np.matmul(feats[valid] - mean, components)
+    return feats_proj.reshape(shape[:-1] + (components.shape[1],))
+
+
+def write_store(src_dir, dest_dir, dataset, data_key, mean, components):
+    for phase in SPLITS[dataset]:
+        files = get_split_files(src_dir, dataset, phase)
+        if dataset != 'dad':
+            # the list files are shared with the source store
+            shutil.copyfile(os.path.join(src_dir, '%s.txt' % (phase)), os.path.join(dest_dir, '%s.txt' % (phase)))
+        for filename in tqdm(files, desc="Projecting %s set"%(phase)):
+            dest_file = os.path.join(dest_dir, filename)
+            if os.path.exists(dest_file):
+                continue
+            if not os.path.exists(os.path.dirname(dest_file)):
+                os.makedirs(os.path.dirname(dest_file))
+            data = np.load(os.path.join(src_dir, filename))
+            results = {key: data[key] for key in data.files}
+            results[data_key] = project(data[data_key], mean, components)
+            np.savez_compressed(dest_file, **results)
+
+
+def run(args):
+    data_path = os.path.join(args.data_path, args.dataset)
+    src_dir = os.path.join(data_path, args.feature_name + '_features')
+    data_key = DATA_KEY[args.dataset]
+    fit_phase = SPLITS[args.dataset][0]
+    fit_files = get_split_files(src_dir, args.dataset, fit_phase)
+    dim = np.load(os.path.join(src_dir, fit_files[0]))[data_key].shape[-1]
+    assert max(args.ranks) <= dim, "The rank should not exceed the feature dim %d"%(dim)
+
+    rng = np.random.RandomState(args.seed)
+    if args.method == 'pca':
+        if args.fit_videos > 0 and args.fit_videos < len(fit_files):
+            fit_files = [fit_files[i] for i in sorted(rng.choice(len(fit_files), args.fit_videos, replace=False))]
+        mean, eig_vecs, eig_vals, n_rows = fit_pca(src_dir, fit_files, data_key, dim)
+    else:
+        # random Gaussian projection does not need to see the data
+        mean, n_rows = np.zeros((dim,), dtype=np.float64), 0
+        random_matrix = rng.normal(size=(dim, max(args.ranks)))
+
+    for rank in args.ranks:
+        if args.method == 'pca':
+            components = eig_vecs[:, :rank]
+            explained = float(np.sum(eig_vals[:rank]) / np.sum(eig_vals))
+            print("PCA rank=%d, explained variance ratio=%.4f"%(rank, explained))
+        else:
+            components = random_matrix[:, :rank] / np.sqrt(rank)
+            explained = None
+        feature_name = '%s_%s%d'%(args.feature_name, args.method, rank)
+        dest_dir = os.path.join(data_path, feature_name + '_features')
+        if not os.path.exists(dest_dir):
+            os.makedirs(dest_dir)
+        np.savez(os.path.join(dest_dir, 'projection.npz'), mean=mean.astype(np.float32), components=components.astype(np.float32))
+        write_store(src_dir, dest_dir, args.dataset, data_key, mean.astype(np.float32), components.astype(np.float32))
+        # the manifest is written last so that an interrupted store is never picked up by the data loaders
+        manifest = {'feature_name': feature_name,
+                    'source_feature': args.feature_name,
+                    'source_dim': int(dim),
+                    'dim_feature': int(rank),
+                    'projection': {'method': args.method,
+                                   'rank': int(rank),
+                                   'file': 'projection.npz',
+                                   'fit_split': fit_phase,
+                                   'fit_rows': int(n_rows),
+                                   'explained_variance_ratio': explained,
+                                   'seed': args.seed}}
+        with open(os.path.join(dest_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        print("Feature store saved in: %s (use --feature_name %s)"%(dest_dir, feature_name))
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    run(args)
+
+    print("Done!")
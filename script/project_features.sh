@@ -0,0 +1,41 @@
+#!/bin/bash
+# Project the backbone features at several ranks, then train and test UString on each projected store.
+# Usage: bash script/project_features.sh GPU_ID DATASET BATCH_SIZE "128 256 512"
+set -x
+set -e
+
+source activate py37
+
+GPU_ID=$1
+DATA=$2
+BATCH_SIZE=$3
+RANKS=${4:-"128 256 512"}
+METHOD=pca
+
+python script/project_features.py \
+    --dataset $DATA \
+    --feature_name vgg16 \
+    --method $METHOD \
+    --ranks $RANKS
+
+for RANK in $RANKS; do
+  FEATURE=vgg16_${METHOD}${RANK}
+  OUT_DIR=output/UString/$FEATURE
+  CUDA_VISIBLE_DEVICES=$GPU_ID python main.py \
+    --dataset $DATA \
+    --feature_name $FEATURE \
+    --phase train \
+    --base_lr 0.0005 \
+    --batch_size $BATCH_SIZE \
+    --gpus $GPU_ID \
+    --output_dir $OUT_DIR
+  # AP and mTTA of each rank are reported here
+  CUDA_VISIBLE_DEVICES=$GPU_ID python main.py \
+    --dataset $DATA \
+    --feature_name $FEATURE \
+    --phase test \
+    --batch_size $BATCH_SIZE \
+    --gpus $GPU_ID \
+    --output_dir $OUT_DIR \
+    --model_file $OUT_DIR/$DATA/snapshot/final_model.pth
+done
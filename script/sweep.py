@@ -0,0 +1,309 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os, sys
+import csv
+import json
+import time
+import signal
+import argparse
+import itertools
+import subprocess
+import numpy as np
+import torch
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_PATH)
+from src.feature_cache import open_feature_cache
+
+METRICS = ['AP', 'mTTA', 'TTA_R80']
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Run concurrent training trials of a hyperparameter sweep')
+    parser.add_argument('--spec', type=str, required=True,
+                        help='The json file of the search, see the README for the format.')
+    parser.add_argument('--data_path', type=str, default='./data',
+                        help='The relative path of dataset (as in main.py).')
+    parser.add_argument('--dataset', type=str, default='dad', choices=['a3d', 'dad', 'crash'],
+                        help='The name of dataset. Default: dad')
+    parser.add_argument('--feature_name', type=str, default='vgg16',
+                        help='The name of feature embedding methods. Default: vgg16')
+    parser.add_argument('--output_dir', type=str, default='./output/sweep',
+                        help='The directory of the trials and the results table. Default: ./output/sweep')
+    parser.add_argument('--feature_cache', type=str, default='',
+                        help='The directory of the decoded datasets shared by the trials, e.g., /dev/shm/ustring. Default: <output_dir>/feature_cache')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='The number of concurrent trials. Default: 2')
+    parser.add_argument('--cores_per_worker', type=int, default=0,
+                        help='The number of CPU cores each trial is pinned to (0 means the cores divided by the workers). Default: 0')
+    parser.add_argument('--devices', type=str, default='cpu',
+                        help='The devices of the workers, e.g., 0,1 to run the trials on 2 GPUs in turn, or cpu. Default: cpu')
+    parser.add_argument('--prune_warmup', type=int, default=2,
+                        help='The number of evaluations of a trial before it can be pruned. Default: 2')
+    parser.add_argument('--prune_min_trials', type=int, default=3,
+                        help='The number of other trials with the same number of evaluations needed to prune a trial. Default: 3')
+    parser.add_argument('--no_prune', action='store_true',
+                        help='Run all the trials to the end.')
+    parser.add_argument('--poll', type=float, default=5.0,
+                        help='The interval (seconds) of checking the trials. Default: 5')
+    parser.add_argument('--seed', type=int, default=123,
+                        help='The random seed of the search and of the trials. Default: 123')
+    return parser.parse_args()
+
+
+def sample_value(rng, space):
+    """ :param: space, a list of values, or a dict {'uniform': [low, high]}, {'log_uniform': [low, high]} or
+                {'int_uniform': [low, high]} (high included)
+    """
+    if isinstance(space, list):
+        return space[rng.randint(len(space))]
+    (kind, (low, high)), = space.items()
+    if kind == 'uniform':
+        return float(rng.uniform(low, high))
+    elif kind == 'log_uniform':
+        return float(np.exp(rng.uniform(np.log(low), np.log(high))))
+    elif kind == 'int_uniform':
+        return int(rng.randint(low, high + 1))
+    raise ValueError('Unknown search space: %s'%(kind))
+
+
+def make_trials(spec, seed):
+    """ :return: the list of the hyperparameters of the trials, the grid of the lists of spec['params'], or
+             spec['n_trials'] random samples
+    """
+    params = spec['params']
+    names = sorted(params.keys())
+    if spec.get('search', 'grid') == 'grid':
+        assert all(isinstance(params[name], list) for name in names), "A grid search needs lists of values"
+        return [dict(zip(names, values)) for values in itertools.product(*[params[name] for name in names])]
+    rng = np.random.RandomState(seed)
+    return [{name: sample_value(rng, params[name]) for name in names} for _ in range(spec['n_trials'])]
+
+
+def graph_settings(spec, trials):
+    """ :return: the distinct (n_obj, top_k) of the trials, fixed or searched, with the defaults of main.py
+    """
+    settings = []
+    for params in trials:
+        options = dict(spec.get('fixed', {}))
+        options.update(params)
+        setting = (options.get('n_obj', 19), options.get('top_k', None))
+        if setting not in settings:
+            settings.append(setting)
+    return settings
+
+
+def build_caches(args, cache_dir, settings):
+    """ Decode the training and testing sets once for each (n_obj, top_k) of settings, the trials find them in
+    cache_dir by their keys.
+    """
+    data_path = os.path.join(ROOT_PATH, args.data_path, args.dataset)
+    device = torch.device('cpu')
+    if args.dataset == 'dad':
+        from src.DataLoader import DADDataset as Dataset
+        phases = ['training', 'testing']
+    elif args.dataset == 'a3d':
+        from src.DataLoader import A3DDataset as Dataset
+        phases = ['train', 'test']
+    else:
+        from src.DataLoader import CrashDataset as Dataset
+        phases = ['train', 'test']
+    for n_obj, top_k in settings:
+        for phase in phases:
+            cached = open_feature_cache(Dataset(data_path, args.feature_name, phase, device=device, n_obj=n_obj, top_k=top_k), cache_dir)
+            print("%s set (n_obj=%d, top_k=%s) cached in: %s"%(phase, n_obj, top_k, cached.entry_dir))
+
+
+def worker_slots(args):
+    """ :return: the (cores, device) of each worker, the cores are disjoint when there are enough of them
+    """
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    n_cores = args.cores_per_worker if args.cores_per_worker > 0 else max(1, len(cores) // args.workers)
+    devices = args.devices.split(',')
+    slots = []
+    for i in range(args.workers):
+        slot_cores = [cores[(i * n_cores + k) % len(cores)] for k in range(n_cores)]
+        slots.append((slot_cores, devices[i % len(devices)]))
+    return slots
+
+
+class Trial(object):
+    def __init__(self, index, params, trial_dir):
+        self.index = index
+        self.params = params
+        self.trial_dir = trial_dir
+        self.status = 'pending'
+        self.process = None
+        self.slot = None
+        self.evals = []  # [(iter, {metric: value})]
+        self.offset = 0
+        self.t_start, self.t_end = None, None
+
+    def best(self, n_evals=None):
+        """ :return: the evaluation with the best AP among the first n_evals ones
+        """
+        evals = self.evals[:n_evals] if n_evals is not None else self.evals
+        return max(evals, key=lambda record: record[1]['AP']) if len(evals) > 0 else None
+
+    def read_evals(self, dataset):
+        """ Read the new evaluations from the metrics.jsonl of the training.
+        """
+        metrics_file = os.path.join(self.trial_dir, dataset, 'logs', 'metrics.jsonl')
+        if not os.path.exists(metrics_file):
+            return
+        with open(metrics_file, 'rb') as f:
+            f.seek(self.offset)
+            for line in f:
+                # a partially written line is read again at the next poll
+                if not line.endswith(b'\n'):
+                    break
+                self.offset += len(line)
+                record = json.loads(line.decode())
+                if record['phase'] == 'test':
+                    self.evals.append((record['iter'], {name: record[name] for name in METRICS}))
+
+
+def trial_command(args, spec, trial, cores, device, cache_dir):
+    command = [sys.executable, os.path.join(ROOT_PATH, 'main.py'), '--phase', 'train', '--data_path', args.data_path,
+               '--dataset', args.dataset, '--feature_name', args.feature_name, '--feature_cache', cache_dir,
+               '--output_dir', trial.trial_dir, '--num_threads', str(len(cores)), '--seed', str(args.seed),
+               # CUDA_VISIBLE_DEVICES=-1 hides the GPUs from the CPU trials
+               '--gpus', '-1' if device == 'cpu' else device]
+    options = dict(spec.get('fixed', {}))
+    options.update(trial.params)
+    for name, value in sorted(options.items()):
+        if isinstance(value, bool):
+            command += ['--%s' % (name)] if value else []
+        else:
+            command += ['--%s' % (name), str(value)]
+    return command
+
+
+def launch(args, spec, trial, slot, cache_dir):
+    cores, device = slot
+    os.makedirs(trial.trial_dir, exist_ok=True)
+    env = dict(os.environ, OMP_NUM_THREADS=str(len(cores)), MKL_NUM_THREADS=str(len(cores)))
+
+    def pin():
+        # the trial and its subprocesses run on their cores only
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cores)
+    with open(os.path.join(trial.trial_dir, 'train.log'), 'w') as log:
+        # in a new session, so that the trial is stopped with its evaluation subprocess (--async_eval)
+        trial.process = subprocess.Popen(trial_command(args, spec, trial, cores, device, cache_dir), stdout=log,
+                                         stderr=subprocess.STDOUT, cwd=ROOT_PATH, env=env, preexec_fn=pin, start_new_session=True)
+    trial.slot, trial.status, trial.t_start = slot, 'running', time.time()
+    print("Trial %d started on cores %s (device %s): %s"%(trial.index, cores, device, trial.params))
+
+
+def stop(trial):
+    try:
+        os.killpg(trial.process.pid, signal.SIGTERM)
+        trial.process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        os.killpg(trial.process.pid, signal.SIGKILL)
+        trial.process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def should_prune(trial, trials, warmup, min_trials):
+    """ Median pruning: a trial is pruned when its best AP of its first n evaluations is below the median of the
+    best AP of the first n evaluations of the other trials which reached n evaluations.
+    """
+    n_evals = len(trial.evals)
+    if n_evals < max(warmup, 1):
+        return False
+    others = [other.best(n_evals)[1]['AP'] for other in trials if other is not trial and len(other.evals) >= n_evals]
+    if len(others) < min_trials:
+        return False
+    return bool(trial.best(n_evals)[1]['AP'] < np.median(others))
+
+
+def write_results(trials, result_file):
+    """ Save the results table (csv) sorted by the best AP, and print it.
+    :return: the rows of the table
+    """
+    names = sorted(set(name for trial in trials for name in trial.params))
+    rows = []
+    for trial in sorted(trials, key=lambda trial: -trial.best()[1]['AP'] if trial.best() is not None else np.inf):
+        best = trial.best()
+        minutes = (trial.t_end - trial.t_start) / 60.0 if trial.t_end is not None else float('nan')
+        row = {'trial': trial.index, 'status': trial.status, 'evals': len(trial.evals),
+               'best_iter': best[0] if best is not None else '', 'minutes': '%.2f' % (minutes)}
+        for name in METRICS:
+            row[name] = '%.4f' % (best[1][name]) if best is not None else ''
+        row.update({name: trial.params.get(name, '') for name in names})
+        rows.append(row)
+    columns = ['trial', 'status', 'evals', 'best_iter'] + METRICS + ['minutes'] + names
+    with open(result_file, 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(' '.join('%12s' % (name) for name in columns))
+    for row in rows:
+        print(' '.join('%12s' % (str(row[name])) for name in columns))
+    return rows
+
+
+def run(args):
+    with open(args.spec, 'r') as f:
+        spec = json.load(f)
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    # the trials run in the root of the repository
+    cache_dir = os.path.abspath(args.feature_cache if args.feature_cache else os.path.join(args.output_dir, 'feature_cache'))
+    trials = [Trial(i, params, os.path.abspath(os.path.join(args.output_dir, 'trial_%03d' % (i)))) for i, params in enumerate(make_trials(spec, args.seed))]
+    build_caches(args, cache_dir, graph_settings(spec, [trial.params for trial in trials]))
+
+    with open(os.path.join(args.output_dir, 'trials.json'), 'w') as f:
+        json.dump({'spec': spec, 'trials': [trial.params for trial in trials]}, f, indent=2)
+    print("%d trials on %d workers"%(len(trials), args.workers))
+
+    t_start = time.time()
+    free_slots = worker_slots(args)
+    pending = list(trials)
+    running = []
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(free_slots) > 0:
+                trial = pending.pop(0)
+                launch(args, spec, trial, free_slots.pop(0), cache_dir)
+                running.append(trial)
+            time.sleep(args.poll)
+            for trial in running:
+                trial.read_evals(args.dataset)
+            for trial in list(running):
+                if trial.process.poll() is not None:
+                    trial.read_evals(args.dataset)
+                    trial.status = 'done' if trial.process.returncode == 0 else 'failed (%d)' % (trial.process.returncode)
+                elif not args.no_prune and should_prune(trial, trials, args.prune_warmup, args.prune_min_trials):
+                    stop(trial)
+                    trial.status = 'pruned'
+                    print("Trial %d pruned after %d evaluations (best AP=%.4f)"%(trial.index, len(trial.evals), trial.best()[1]['AP']))
+                else:
+                    continue
+                trial.t_end = time.time()
+                running.remove(trial)
+                free_slots.append(trial.slot)
+                print("Trial %d %s in %.1f minutes"%(trial.index, trial.status, (trial.t_end - trial.t_start) / 60.0))
+    finally:
+        for trial in running:
+            stop(trial)
+            trial.status, trial.t_end = 'stopped', time.time()
+
+    print("Sweep finished in %.1f minutes"%((time.time() - t_start) / 60.0))
+    result_file = os.path.join(args.output_dir, 'sweep_results.csv')
+    write_results(trials, result_file)
+    print("Results saved in: %s"%(result_file))
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    run(args)
@@ -1,21 +1,13 @@
-import os, cv2
+import os, sys, cv2
 import numpy as np
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.video_io import FrameSource
+
 
 def get_video_frames(video_file, n_frames=50):
-    assert os.path.exists(video_file), video_file
-    # get the video data
-    cap = cv2.VideoCapture(video_file)
-    ret, frame = cap.read()
-    video_data = []
-    counter = 0
-    while (ret):
-        video_data.append(frame)
-        ret, frame = cap.read()
-        counter += 1
-    assert len(video_data) >= n_frames
-    video_data = video_data[:n_frames]
-    return video_data
+    # the frames are decoded lazily
+    return FrameSource(video_file, n_frames=n_frames)
 
 
 def vis_det(feat_path, video_path, out_path, tag='positive'):
@@ -44,6 +36,7 @@ def vis_det(feat_path, video_path, out_path, tag='positive'):
             cv2.putText(frame, tag, (int(frame.shape[1] / 2) - 60, 60), cv2.FONT_HERSHEY_SIMPLEX, 2,
                         text_color, 2, cv2.LINE_AA)
             cv2.imwrite(os.path.join(save_dir, str(counter) + '.jpg'), frame)
+        assert counter + 1 == 50, video_file
 
 if __name__ == '__main__':
     FEAT_PATH = './data/crash/vgg16_features/positive'
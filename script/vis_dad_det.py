@@ -1,7 +1,10 @@
-import os
+import os, sys
 import numpy as np
 import cv2
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.video_io import FrameSource
+
 def vis_det(data_path, video_path, phase='training'):
     files_list = []
     batch_id = 1
@@ -19,11 +22,8 @@ def vis_det(data_path, video_path, phase='training'):
             if not os.path.exists(video_file):
                 raise FileNotFoundError
             bboxes = detections[i]
-            counter = 0
-            cap = cv2.VideoCapture(video_file)
-            ret, frame = cap.read()
             text_color = (0, 0, 255) if labels[i, 1] > 0 else (0, 255, 255)
-            while (ret):
+            for counter, frame in enumerate(FrameSource(video_file, n_frames=bboxes.shape[0], prefetch=8)):
                 new_bboxes = bboxes[counter, :, :]
                 for num_box in range(new_bboxes.shape[0]):
                     cv2.rectangle(frame, (new_bboxes[num_box, 0], new_bboxes[num_box, 1]),
@@ -32,10 +32,8 @@ def vis_det(data_path, video_path, phase='training'):
                             text_color, 2, cv2.LINE_AA)
                 cv2.imshow('result', frame)
                 c = cv2.waitKey(50)
-                ret, frame = cap.read()
-                if c == ord('q') and c == 27 and ret:
-                    break;
-                counter += 1
+                if c == ord('q') or c == 27:
+                    break
             cv2.destroyAllWindows()
 
 if __name__ == '__main__':
@@ -3,16 +3,17 @@ from __future__ import division
 from __future__ import print_function
 
 import os
+import json
 import numpy as np
 import pickle
 import torch
 from torch.utils.data import Dataset
-import networkx
 import itertools
+from src.profiler import profiled
 
 
 class DADDataset(Dataset):
-    def __init__(self, data_path, feature, phase='training', toTensor=False, device=torch.device('cuda'), vis=False):
+    def __init__(self, data_path, feature, phase='training', toTensor=False, device=torch.device('cuda'), vis=False, n_obj=19, top_k=None):
         self.data_path = os.path.join(data_path, feature + '_features')
         self.feature = feature
         self.phase = phase
@@ -20,7 +21,8 @@ class DADDataset(Dataset):
         self.device = device
         self.vis = vis
         self.n_frames = 100
-        self.n_obj = 19
+        self.n_obj = n_obj
+        self.top_k = top_k
         self.fps = 20.0
         self.dim_feature = self.get_feature_dim(feature)
 
@@ -32,12 +34,7 @@ class DADDataset(Dataset):
         return data_len
 
     def get_feature_dim(self, feature_name):
-        if feature_name == 'vgg16':
-            return 4096
-        elif feature_name == 'res101':
-            return 2048
-        else:
-            raise ValueError
+        return get_feature_dim(feature_name, self.data_path)
 
     def get_filelist(self, filepath):
         assert os.path.exists(filepath), "Directory does not exist: %s"%(filepath)
@@ -61,7 +58,8 @@ class DADDataset(Dataset):
         else:
             toa = [self.n_frames + 1]
         
-        graph_edges, edge_weights = generate_st_graph(detections)
+        features, detections = pad_objects(features, detections, self.n_obj)
+        graph_edges, edge_weights = generate_st_graph(detections, top_k=self.top_k)
 
         if self.toTensor:
             features = torch.Tensor(features).to(self.device)         #  100 x 20 x 4096
@@ -78,7 +76,7 @@ class DADDataset(Dataset):
 
 
 class A3DDataset(Dataset):
-    def __init__(self, data_path, feature, phase='train', toTensor=False, device=torch.device('cuda'), vis=False):
+    def __init__(self, data_path, feature, phase='train', toTensor=False, device=torch.device('cuda'), vis=False, n_obj=19, top_k=None):
         self.data_path = data_path
         self.feature = feature
         self.phase = phase
@@ -86,7 +84,8 @@ class A3DDataset(Dataset):
         self.device = device
         self.vis = vis
         self.n_frames = 100
-        self.n_obj = 19
+        self.n_obj = n_obj
+        self.top_k = top_k
         self.fps = 20.0
         self.dim_feature = self.get_feature_dim(feature)
 
@@ -97,12 +96,7 @@ class A3DDataset(Dataset):
         return data_len
 
     def get_feature_dim(self, feature_name):
-        if feature_name == 'vgg16':
-            return 4096
-        elif feature_name == 'res101':
-            return 2048
-        else:
-            raise ValueError
+        return get_feature_dim(feature_name, os.path.join(self.data_path, feature_name + '_features'))
 
     def read_datalist(self, data_path, phase):
         # load training set
@@ -155,8 +149,9 @@ class A3DDataset(Dataset):
         with open(dets_file, 'rb') as f:
             detections = pickle.load(f)
             detections = np.array(detections)  # 100 x 19 x 6
-            graph_edges, edge_weights = generate_st_graph(detections)
         f.close()
+        features, detections = pad_objects(features, detections, self.n_obj)
+        graph_edges, edge_weights = generate_st_graph(detections, top_k=self.top_k)
 
         if self.toTensor:
             features = torch.Tensor(features).to(self.device)          #  100 x 20 x 4096
@@ -175,7 +170,7 @@ class A3DDataset(Dataset):
 
 
 class CrashDataset(Dataset):
-    def __init__(self, data_path, feature, phase='train', toTensor=False, device=torch.device('cuda'), vis=False):
+    def __init__(self, data_path, feature, phase='train', toTensor=False, device=torch.device('cuda'), vis=False, n_obj=19, top_k=None):
         self.data_path = data_path
         self.feature = feature
         self.phase = phase
@@ -183,7 +178,8 @@ class CrashDataset(Dataset):
         self.device = device
         self.vis = vis
         self.n_frames = 50
-        self.n_obj = 19
+        self.n_obj = n_obj
+        self.top_k = top_k
         self.fps = 10.0
         self.dim_feature = self.get_feature_dim(feature)
         self.files_list, self.labels_list = self.read_datalist(data_path, phase)
@@ -194,12 +190,7 @@ class CrashDataset(Dataset):
         return data_len
 
     def get_feature_dim(self, feature_name):
-        if feature_name == 'vgg16':
-            return 4096
-        elif feature_name == 'res101':
-            return 2048
-        else:
-            raise ValueError
+        return get_feature_dim(feature_name, os.path.join(self.data_path, feature_name + '_features'))
 
     def read_datalist(self, data_path, phase):
         # load training set
@@ -257,7 +248,8 @@ class CrashDataset(Dataset):
         else:
             toa = [self.n_frames + 1]
 
-        graph_edges, edge_weights = generate_st_graph(detections)
+        features, detections = pad_objects(features, detections, self.n_obj)
+        graph_edges, edge_weights = generate_st_graph(detections, top_k=self.top_k)
 
         if self.toTensor:
             features = torch.Tensor(features).to(self.device)         #  50 x 20 x 4096
@@ -272,23 +264,113 @@ class CrashDataset(Dataset):
             return features, labels, graph_edges, edge_weights, toa
 
 
-def generate_st_graph(detections):
-    # create graph edges
+def load_feature_manifest(feature_dir):
+    """
+    :param: feature_dir: the directory of a feature store, e.g., data/dad/vgg16_pca512_features
+    :return: the manifest dict of the feature store, or None if the store has no manifest
+    """
+    manifest_file = os.path.join(feature_dir, 'manifest.json')
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, 'r') as f:
+        manifest = json.load(f)
+    return manifest
+
+
+def get_feature_dim(feature_name, feature_dir=None):
+    # feature stores rewritten offline (e.g., projected ones) record their dimension in the manifest
+    manifest = load_feature_manifest(feature_dir) if feature_dir is not None else None
+    if manifest is not None:
+        return int(manifest['dim_feature'])
+    if feature_name == 'vgg16':
+        return 4096
+    elif feature_name == 'res101':
+        return 2048
+    else:
+        raise ValueError('Unknown feature: %s'%(feature_name))
+
+
+# the objects of a frame form a complete graph up to this number of objects, and top-k nearest neighbour graphs beyond
+MAX_COMPLETE_GRAPH = 32
+DEFAULT_TOP_K = 8
+
+
+@profiled('generate_st_graph')
+def generate_st_graph(detections, top_k=None):
+    """
+    :param: detections: (T, N, 6), zero padded after the detected objects
+    :param: top_k: the number of neighbours of each object, 0 for the complete graph, None to select by N
+    :return: graph_edges (T, 2, E) and edge_weights (T, E)
+    """
     num_frames, num_boxes = detections.shape[:2]
-    num_edges = int(num_boxes * (num_boxes - 1) / 2)
-    graph_edges = []
-    edge_weights = np.zeros((num_frames, num_edges), dtype=np.float32)
-    for i in range(num_frames):
-        # generate graph edges (fully-connected)
-        edge = generate_graph_from_list(range(num_boxes))
-        graph_edges.append(np.transpose(np.stack(edge).astype(np.int32)))  # 2 x 171
-        # compute the edge weights by distance
-        edge_weights[i] = compute_graph_edge_weights(detections[i, :, :4], edge)  # 171,
+    if top_k is None:
+        top_k = 0 if num_boxes <= MAX_COMPLETE_GRAPH else DEFAULT_TOP_K
+    if 0 < top_k < num_boxes - 1:
+        return generate_knn_graph(detections, top_k)
+    # the complete graph, with the edges in the order of generate_graph_from_list()
+    edge = np.stack(np.triu_indices(num_boxes, k=1)).astype(np.int32)  # 2 x 171
+    centers = box_centers(detections)  # T x N x 2
+    dists = np.sum((centers[:, edge[0]] - centers[:, edge[1]]) ** 2, axis=-1)  # T x 171
+    graph_edges = np.repeat(edge[np.newaxis], num_frames, axis=0)
+    edge_weights = normalize_edge_weights(np.exp(-dists).astype(np.float32))
+    return graph_edges, edge_weights
+
 
+def generate_knn_graph(detections, top_k):
+    """ The edges from each object to its top_k nearest objects of the frame. The zero padded objects are not
+    neighbours of any object, and the missing neighbours are self loops of zero weight, so that all the frames
+    have N x top_k edges.
+    :param: detections: (T, N, 6)
+    :return: graph_edges (T, 2, N x top_k) and edge_weights (T, N x top_k)
+    """
+    num_frames, num_boxes = detections.shape[:2]
+    centers = box_centers(detections)  # T x N x 2
+    valid = object_mask(detections)  # T x N
+    dists = np.sum((centers[:, :, np.newaxis] - centers[:, np.newaxis]) ** 2, axis=-1)  # T x N x N
+    dists[~(valid[:, :, np.newaxis] & valid[:, np.newaxis])] = np.inf
+    dists[:, np.arange(num_boxes), np.arange(num_boxes)] = np.inf
+    neighbours = np.argpartition(dists, top_k, axis=-1)[:, :, :top_k]  # T x N x k
+    dists = np.take_along_axis(dists, neighbours, axis=-1)
+    nodes = np.broadcast_to(np.arange(num_boxes)[np.newaxis, :, np.newaxis], neighbours.shape)
+    neighbours = np.where(np.isinf(dists), nodes, neighbours)
+    graph_edges = np.stack([nodes.reshape(num_frames, -1), neighbours.reshape(num_frames, -1)], axis=1).astype(np.int32)
+    edge_weights = normalize_edge_weights(np.where(np.isinf(dists), 0, np.exp(-dists)).reshape(num_frames, -1).astype(np.float32))
     return graph_edges, edge_weights
 
-       
+
+def box_centers(detections):
+    return 0.5 * (detections[:, :, 0:2] + detections[:, :, 2:4])
+
+
+def object_mask(detections):
+    """ :return: (T, N), whether the objects are detected, i.e., not zero padded
+    """
+    return (detections[:, :, 2] > detections[:, :, 0]) & (detections[:, :, 3] > detections[:, :, 1])
+
+
+def normalize_edge_weights(weights):
+    """ Normalize the weights of each frame to sum 1, the frames whose weights are all zero get weights of 1
+    """
+    total = np.sum(weights, axis=-1, keepdims=True)
+    return np.where(total > 0, weights / np.where(total > 0, total, 1), 1).astype(np.float32)
+
+
+def pad_objects(features, detections, n_obj):
+    """ Zero pad (or truncate) the objects of a video to n_obj.
+    :param: features: (T, 1 + N, D), the frame feature and the object features
+    :param: detections: (T, N, 6)
+    :return: features (T, 1 + n_obj, D) and detections (T, n_obj, 6)
+    """
+    num_boxes = detections.shape[1]
+    if num_boxes >= n_obj:
+        return features[:, :n_obj + 1], detections[:, :n_obj]
+    features = np.concatenate([features, np.zeros((features.shape[0], n_obj - num_boxes, features.shape[2]), dtype=features.dtype)], axis=1)
+    detections = np.concatenate([detections, np.zeros((detections.shape[0], n_obj - num_boxes, detections.shape[2]), dtype=detections.dtype)], axis=1)
+    return features, detections
+
+
 def generate_graph_from_list(L, create_using=None):
+   import networkx
    G = networkx.empty_graph(len(L),create_using)
    if len(L)>1:
        if G.is_directed():
@@ -338,8 +420,8 @@ if __name__ == '__main__':
                         help='The name of dataset. Default: dad')
     parser.add_argument('--batch_size', type=int, default=10,
                         help='The batch size in training process. Default: 10')
-    parser.add_argument('--feature_name', type=str, default='vgg16', choices=['vgg16', 'res101'],
-                        help='The name of feature embedding methods. Default: vgg16')
+    parser.add_argument('--feature_name', type=str, default='vgg16',
+                        help='The name of feature embedding methods, i.e., vgg16, res101, or a projected feature store such as vgg16_pca512. Default: vgg16')
     p = parser.parse_args()
 
     seed = 123
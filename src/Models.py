@@ -3,16 +3,16 @@ from __future__ import division
 from __future__ import print_function
 
 import inspect
+import functools
 from torch.nn.parameter import Parameter
 import torch
 import torch.nn as nn
+import torch.utils.checkpoint
 from src.utils import glorot, zeros, uniform, reset
-from torch_geometric.utils import remove_self_loops, add_self_loops
-import torch_scatter
-from torch_scatter import scatter_mean, scatter_max, scatter_add
 from torch.autograd import Variable
 import torch.nn.functional as F
 from src.BayesModels import BayesianLinear
+from src.profiler import stage
 
 
 class MessagePassing(torch.nn.Module):
@@ -106,14 +106,15 @@ def scatter_(name, src, index, dim_size=None):
 
     assert name in ['add', 'mean', 'max']
 
+    import torch_scatter
     op = getattr(torch_scatter, 'scatter_{}'.format(name))
-    fill_value = -1e38 if name is 'max' else 0
+    fill_value = -1e38 if name == 'max' else 0
 
     out = op(src, index, 0, None, dim_size, fill_value)
     if isinstance(out, tuple):
         out = out[0]
 
-    if name is 'max':
+    if name == 'max':
         out[out == fill_value] = 0
 
     return out
@@ -122,6 +123,10 @@ def scatter_(name, src, index, dim_size=None):
 # layers
 
 class GCNConv(MessagePassing):
+    # the graphs up to this number of nodes are propagated as dense adjacency matrices, the larger (sparse top-k) ones
+    # as edge lists
+    dense_max_nodes = 100
+
     def __init__(self, in_channels, out_channels, act=F.relu, improved=True, bias=False):
         super(GCNConv, self).__init__()
 
@@ -180,22 +185,29 @@ class GCNConv(MessagePassing):
         # for pytorch 1.4, there are two outputs
         edge_index, edge_weight = self.add_self_loops(edge_index, edge_weight=edge_weight, num_nodes=x.size(1))
 
-        out_batch = []
-        for i in range(edge_index.size(0)):
-            row, col = edge_index[i]
-            deg = scatter_add(edge_weight[i], row, dim=0, dim_size=x.size(1))
-            deg_inv = deg.pow(-0.5)
-            deg_inv[deg_inv == float('inf')] = 0
-
-            norm = deg_inv[row] * edge_weight[i] * deg_inv[col]
-            
-            weight = self.weight.to(x.device)
-            x_w = torch.matmul(x[i], weight)
-            out = self.propagate('add', edge_index[i], x=x_w, norm=norm)
-            out_batch.append(self.act(out))
-        out_batch = torch.stack(out_batch)
+        batch_size, num_nodes = x.size(0), x.size(1)
+        row, col = edge_index[:, 0], edge_index[:, 1]  # 10 x 190
+        deg = torch.zeros(batch_size, num_nodes, dtype=edge_weight.dtype, device=x.device).scatter_add_(1, row, edge_weight)
+        deg_inv = deg.pow(-0.5)
+        deg_inv[deg_inv == float('inf')] = 0
+        norm = deg_inv.gather(1, row) * edge_weight * deg_inv.gather(1, col)  # 10 x 190
+
+        weight = self.weight.to(x.device)
+        x_w = torch.matmul(x, weight)
+        if num_nodes <= self.dense_max_nodes:
+            # dense normalized adjacency matrices, 10 x 20 x 20
+            adj = torch.zeros(batch_size, num_nodes * num_nodes, dtype=norm.dtype, device=x.device)
+            adj = adj.scatter_add_(1, row * num_nodes + col, norm).view(batch_size, num_nodes, num_nodes)
+            out_batch = self.update(torch.bmm(adj, x_w))
+        else:
+            # the sparse block-diagonal adjacency matrix of all the graphs of the batch
+            offset = (torch.arange(batch_size, device=x.device) * num_nodes).view(-1, 1)
+            flat_index = torch.stack([(row + offset).view(-1), (col + offset).view(-1)])
+            adj = torch.sparse_coo_tensor(flat_index, norm.view(-1), (batch_size * num_nodes, batch_size * num_nodes))
+            out_batch = torch.sparse.mm(adj, x_w.reshape(batch_size * num_nodes, -1))
+            out_batch = self.update(out_batch.view(batch_size, num_nodes, -1))
 
-        return out_batch
+        return self.act(out_batch)
 
     def message(self, x_j, norm):
         return norm.view(-1, 1) * x_j
@@ -362,7 +374,12 @@ class BayesianPredictor(nn.Module):
 
 
 class UString(nn.Module):
-    def __init__(self, x_dim, h_dim, z_dim, n_layers=1, n_obj=19, n_frames=100, fps=20.0, with_saa=True, uncertain_ranking=False):
+    def __init__(self, x_dim, h_dim, z_dim, n_layers=1, n_obj=19, n_frames=100, fps=20.0, with_saa=True, uncertain_ranking=False,
+                 readout='flatten'):
+        """
+        :param readout, the object latents fed to the BNN decoder, 'flatten' concatenates the n_obj latents as the
+                        original model, 'mean' averages the latents of the detected (non-zero) objects, for any number of objects
+        """
         super(UString, self).__init__()
 
         self.x_dim = x_dim
@@ -374,6 +391,8 @@ class UString(nn.Module):
         self.fps = fps
         self.with_saa = with_saa
         self.uncertain_ranking = uncertain_ranking
+        assert readout in ['flatten', 'mean'], "Unknown readout: %s"%(readout)
+        self.readout = readout
 
         self.phi_x = nn.Sequential(nn.Linear(x_dim, h_dim), nn.ReLU())
 
@@ -383,7 +402,7 @@ class UString(nn.Module):
         # rnn layer
         self.rnn = Graph_GRU_GCN(h_dim + h_dim + z_dim, h_dim, n_layers, bias=True)
         # BNN decoder
-        self.predictor = BayesianPredictor(n_obj * z_dim, 2)
+        self.predictor = BayesianPredictor(n_obj * z_dim if readout == 'flatten' else z_dim, 2)
         if self.with_saa:
             # auxiliary branch
             self.predictor_aux = AccidentPredictor(h_dim + h_dim, 2, dropout=[0.5, 0.0])
@@ -393,11 +412,14 @@ class UString(nn.Module):
         self.ce_loss = torch.nn.CrossEntropyLoss(reduction='none')
 
 
-    def forward(self, x, y, toa, graph, hidden_in=None, edge_weights=None, npass=2, nbatch=80, testing=False, eval_uncertain=False):
+    def forward(self, x, y, toa, graph, hidden_in=None, edge_weights=None, npass=2, nbatch=80, testing=False, eval_uncertain=False,
+                checkpoint_every=0, tbptt=0):
         """
         :param x, (batchsize, nFrames, nBoxes, Xdim) = (10 x 100 x 20 x 4096)
         :param y, (10 x 2)
         :param toa, (10,)
+        :param checkpoint_every, recompute the activations of every k frames in backward (0 to disable)
+        :param tbptt, detach the hidden states every k frames, i.e., truncated BPTT (0 to disable)
         """
         losses = {'cross_entropy': 0,
                   'log_posterior': 0,
@@ -409,47 +431,53 @@ class UString(nn.Module):
             losses.update({'ranking': 0})
             Ut = torch.zeros(x.size(0)).to(x.device)  # B
         all_outputs, all_hidden = [], []
+        if self.readout == 'flatten' and x.size(2) - 1 != self.n_obj:
+            raise ValueError("%d objects given to UString(n_obj=%d), use readout='mean' for other numbers of objects"%(x.size(2) - 1, self.n_obj))
 
         # import ipdb; ipdb.set_trace()
         if hidden_in is None:
-            h = Variable(torch.zeros(self.n_layers, x.size(0), self.n_obj, self.h_dim))  # 1 x 10 x 19 x 256
+            h = Variable(torch.zeros(self.n_layers, x.size(0), x.size(2) - 1, self.h_dim))  # 1 x 10 x 19 x 256
         else:
             h = Variable(hidden_in)
         h = h.to(x.device)
 
-        for t in range(x.size(1)):
-            # reduce the dim of node feature (FC layer)
-            x_t = self.phi_x(x[:, t])  # 10 x 20 x 256
-            img_embed = x_t[:, 0, :].unsqueeze(1).repeat(1, self.n_obj, 1).contiguous()  # 10 x 1 x 256
-            obj_embed = x_t[:, 1:, :]  # 10 x 19 x 256
-            x_t = torch.cat([obj_embed, img_embed], dim=-1)  # 10 x 19 x 512
-
-            # GCN encoder
-            enc = self.enc_gcn1(x_t, graph[:, t], edge_weight=edge_weights[:, t])  # 10 x 19 x 256 (512-->256)
-            z_t = self.enc_gcn2(torch.cat([enc, h[-1]], -1), graph[:, t], edge_weight=edge_weights[:, t])  # 10 x 19 x 128 (512-->128)
-
-            # BNN decoder
-            embed = z_t.view(z_t.size(0), -1)  # 10 x (19 x 128)
-            output_dict = self.predictor.sample_elbo(embed, npass=npass, testing=testing, eval_uncertain=eval_uncertain)  # B x 2
-            dec_t = output_dict['pred_mean']
-
-            # recurrence
-            h = self.rnn(torch.cat([x_t, z_t], -1), graph[:, t], h, edge_weight=edge_weights[:, t])  # rnn latent (640)-->256
-
-            # computing losses
-            L1 = output_dict['log_posterior'] / nbatch
-            L2 = output_dict['log_prior'] / nbatch
-            L3 = self._exp_loss(dec_t, y, t, toa=toa, fps=self.fps)
-            losses['log_posterior'] += L1
-            losses['log_prior'] += L2
-            losses['cross_entropy'] += L3
-            # uncertainty ranking loss
-            if self.uncertain_ranking:
-                L5, Ut = self._uncertainty_ranking(output_dict, Ut)
-                losses['ranking'] += L5
-
-            all_outputs.append(output_dict)
-            all_hidden.append(h[-1])
+        # checkpointing only makes sense when the graph is recorded for backward
+        use_checkpoint = checkpoint_every > 0 and self.training and torch.is_grad_enabled()
+        seg_len = checkpoint_every if use_checkpoint else x.size(1)
+        for t0 in range(0, x.size(1), seg_len):
+            t1 = min(t0 + seg_len, x.size(1))
+            run_segment = functools.partial(self._forward_segment, t0=t0, t1=t1, npass=npass, testing=testing,
+                                            eval_uncertain=eval_uncertain, tbptt=tbptt)
+            if use_checkpoint:
+                seg_outputs = torch.utils.checkpoint.checkpoint(run_segment, x, graph, edge_weights, h, use_reentrant=False)
+            else:
+                seg_outputs = run_segment(x, graph, edge_weights, h)
+            pred_means, log_priors, log_posteriors, aleatorics, epistemics, hiddens, h = seg_outputs
+
+            for i, t in enumerate(range(t0, t1)):
+                output_dict = {'pred_mean': pred_means[i],
+                               'log_prior': log_priors[i],
+                               'log_posterior': log_posteriors[i],
+                               'aleatoric': aleatorics[i],
+                               'epistemic': epistemics[i]}
+                # computing losses
+                L1 = output_dict['log_posterior'] / nbatch
+                L2 = output_dict['log_prior'] / nbatch
+                with stage('exp_loss'):
+                    L3 = self._exp_loss(output_dict['pred_mean'], y, t, toa=toa, fps=self.fps)
+                losses['log_posterior'] += L1
+                losses['log_prior'] += L2
+                losses['cross_entropy'] += L3
+                # uncertainty ranking loss
+                if self.uncertain_ranking:
+                    if tbptt > 0 and t > 0 and t % tbptt == 0:
+                        Ut = Ut.detach()
+                    with stage('ranking_loss'):
+                        L5, Ut = self._uncertainty_ranking(output_dict, Ut)
+                    losses['ranking'] += L5
+
+                all_outputs.append(output_dict)
+                all_hidden.append(hiddens[i])
 
         if self.with_saa:
             # soft attention to aggregate hidden states of all frames
@@ -461,6 +489,52 @@ class UString(nn.Module):
         return losses, all_outputs, all_hidden
 
 
+    def _forward_segment(self, x, graph, edge_weights, h, t0=0, t1=1, npass=2, testing=False, eval_uncertain=False, tbptt=0):
+        """ Run the recurrence from frame t0 to t1 (exclusive). All outputs are tensors stacked over time
+        so that the segment can be recomputed by gradient checkpointing.
+        """
+        pred_means, log_priors, log_posteriors, aleatorics, epistemics, hiddens = [], [], [], [], [], []
+        for t in range(t0, t1):
+            if tbptt > 0 and t > 0 and t % tbptt == 0:
+                # truncated BPTT: gradients do not flow into earlier frames through the hidden states
+                h = h.detach()
+            # reduce the dim of node feature (FC layer)
+            with stage('phi_x'):
+                x_t = self.phi_x(x[:, t])  # 10 x 20 x 256
+                img_embed = x_t[:, 0, :].unsqueeze(1).repeat(1, x_t.size(1) - 1, 1).contiguous()  # 10 x 1 x 256
+                obj_embed = x_t[:, 1:, :]  # 10 x 19 x 256
+                x_t = torch.cat([obj_embed, img_embed], dim=-1)  # 10 x 19 x 512
+
+            # GCN encoder
+            with stage('gcn_encoder'):
+                enc = self.enc_gcn1(x_t, graph[:, t], edge_weight=edge_weights[:, t])  # 10 x 19 x 256 (512-->256)
+                z_t = self.enc_gcn2(torch.cat([enc, h[-1]], -1), graph[:, t], edge_weight=edge_weights[:, t])  # 10 x 19 x 128 (512-->128)
+
+            # BNN decoder
+            with stage('sample_elbo'):
+                if self.readout == 'mean':
+                    # the zero padded objects have zero features
+                    mask = (x[:, t, 1:].abs().sum(-1, keepdim=True) > 0).to(z_t.dtype)  # 10 x 19 x 1
+                    embed = torch.sum(z_t * mask, 1) / torch.clamp(mask.sum(1), min=1)  # 10 x 128
+                else:
+                    embed = z_t.view(z_t.size(0), -1)  # 10 x (19 x 128)
+                output_dict = self.predictor.sample_elbo(embed, npass=npass, testing=testing, eval_uncertain=eval_uncertain)  # B x 2
+
+            # recurrence
+            with stage('graph_gru'):
+                h = self.rnn(torch.cat([x_t, z_t], -1), graph[:, t], h, edge_weight=edge_weights[:, t])  # rnn latent (640)-->256
+
+            pred_means.append(output_dict['pred_mean'])
+            log_priors.append(output_dict['log_prior'])
+            log_posteriors.append(output_dict['log_posterior'])
+            aleatorics.append(output_dict['aleatoric'])
+            epistemics.append(output_dict['epistemic'])
+            hiddens.append(h[-1])
+
+        return (torch.stack(pred_means), torch.stack(log_priors), torch.stack(log_posteriors),
+                torch.stack(aleatorics), torch.stack(epistemics), torch.stack(hiddens), h)
+
+
     def _exp_loss(self, pred, target, time, toa, fps=20.0):
         '''
         :param pred:
@@ -495,3 +569,59 @@ class UString(nn.Module):
             uncertainty = aleatoric[:, 1, 1] + epistemic[:, 1, 1]  # B
         loss = torch.mean(torch.max(torch.zeros_like(Ut).to(Ut.device), uncertainty - Ut))
         return loss, uncertainty
+
+
+class StudentGRU(nn.Module):
+    """ A deterministic student of UString for real-time inference: a GRU over the frame feature and the masked mean of
+    the object features, which predicts the accident logits and the aleatoric and epistemic uncertainties of the
+    teacher in a single pass. The outputs have the format of UString's (the uncertainties are diagonal matrices whose
+    trace is the predicted value), so the evaluation and the demo run either of them.
+    """
+    def __init__(self, x_dim, h_dim=64, n_obj=19, n_frames=100, fps=20.0):
+        super(StudentGRU, self).__init__()
+        self.x_dim = x_dim
+        self.h_dim = h_dim
+        self.n_obj = n_obj
+        self.n_frames = n_frames
+        self.fps = fps
+
+        self.phi_x = nn.Sequential(nn.Linear(x_dim, h_dim), nn.ReLU())
+        self.gru = nn.GRUCell(h_dim + h_dim, h_dim)
+        self.classifier = nn.Linear(h_dim, 2)
+        self.uncertainty = nn.Linear(h_dim, 2)
+        self.ce_loss = torch.nn.CrossEntropyLoss(reduction='none')
+
+    # the same early-anticipation loss as the teacher
+    _exp_loss = UString._exp_loss
+
+    def config(self):
+        """ :return: the arguments of the constructor, saved in the student checkpoints
+        """
+        return {'x_dim': self.x_dim, 'h_dim': self.h_dim, 'n_obj': self.n_obj, 'n_frames': self.n_frames, 'fps': self.fps}
+
+    def forward(self, x, y, toa, graph=None, hidden_in=None, edge_weights=None, npass=1, nbatch=80, testing=False, eval_uncertain=False, **kwargs):
+        """
+        :param x, (batchsize, nFrames, nBoxes, Xdim) = (10 x 100 x 20 x 4096)
+        :param graph, edge_weights, npass: unused, the arguments of UString
+        """
+        losses = {'cross_entropy': 0, 'total_loss': 0}
+        all_outputs, all_hidden = [], []
+        # the features of the padded boxes are zero
+        mask = (x[:, :, 1:].abs().sum(-1, keepdim=True) > 0).to(x.dtype)  # B x T x 19 x 1
+        x_t = self.phi_x(x)  # B x T x 20 x h
+        obj_embed = torch.sum(x_t[:, :, 1:] * mask, 2) / torch.clamp(mask.sum(2), min=1)  # B x T x h
+        inp = torch.cat([x_t[:, :, 0], obj_embed], dim=-1)  # B x T x 2h
+        h = torch.zeros(x.size(0), self.h_dim).to(x.device) if hidden_in is None else hidden_in
+        for t in range(x.size(1)):
+            h = self.gru(inp[:, t], h)
+            pred = self.classifier(h)  # B x 2
+            # the traces of the uncertainty matrices of the teacher
+            uncertain = F.softplus(self.uncertainty(h))  # B x 2
+            output_dict = {'pred_mean': pred,
+                           'aleatoric': torch.diag_embed(uncertain[:, :1].repeat(1, 2) / 2),
+                           'epistemic': torch.diag_embed(uncertain[:, 1:].repeat(1, 2) / 2)}
+            losses['cross_entropy'] += self._exp_loss(pred, y, t, toa=toa, fps=self.fps)
+            all_outputs.append(output_dict)
+            all_hidden.append(h)
+        losses['total_loss'] = losses['cross_entropy']
+        return losses, all_outputs, all_hidden
@@ -0,0 +1,119 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+GATES = {'aleatoric': [0], 'epistemic': [1], 'total': [0, 1]}
+
+
+def eval_lengths(labels, toas, n_frames):
+    """ Positive videos are evaluated before the accident, negative videos on all frames (as in eval_tools).
+    """
+    return np.where(labels > 0, np.minimum(toas.astype(np.int64), n_frames), n_frames)
+
+
+def kofn_scores(scores, k, n):
+    """ Alert score of k-of-n smoothing: the k-th largest score of the last n frames (causal), so that
+    an alert is raised at a frame iff at least k of the last n frames have score >= threshold.
+    :param: scores (N x T), gated frames should be -inf
+    :output: (N x T)
+    """
+    assert 1 <= k <= n
+    if n == 1:
+        return scores
+    padded = np.concatenate([np.full((scores.shape[0], n - 1), -np.inf), scores], axis=1)
+    windows = sliding_window_view(padded, n, axis=1)  # N x T x n
+    return np.partition(windows, n - k, axis=-1)[..., n - k]
+
+
+def first_alerts(scores, lengths, thresholds):
+    """
+    :param: scores (N x T), lengths (N,), thresholds (K,)
+    :output: (K x N) the first frame with score >= threshold, or -1 if there is no alert within the length
+    """
+    in_window = np.arange(scores.shape[1])[None, :] < lengths[:, None]
+    prefix_max = np.maximum.accumulate(np.where(in_window, scores, -np.inf), axis=1)
+    # the number of frames before the running maximum reaches the threshold
+    first = np.sum(prefix_max[None, :, :] < thresholds[:, None, None], axis=2)
+    return np.where(first < lengths[None, :], first, -1)
+
+
+def count_alerts(scores, lengths, thresholds, refractory):
+    """ Count the alerts of each video when no new alert is raised within the refractory period after an alert.
+    :param: scores (N x T), lengths (N,), thresholds (K,), refractory (R,) in frames
+    :output: (R x K x N) number of alerts
+    """
+    refractory = np.asarray(refractory, dtype=np.int64)
+    n_videos, n_frames = scores.shape
+    counts = np.zeros((len(refractory), len(thresholds), n_videos), dtype=np.int64)
+    next_allowed = np.zeros_like(counts)
+    for t in range(n_frames):
+        candidate = (scores[:, t][None, :] >= thresholds[:, None]) & (t < lengths)[None, :]  # K x N
+        fire = candidate[None, :, :] & (next_allowed <= t)
+        counts += fire
+        next_allowed = np.where(fire, t + 1 + refractory[:, None, None], next_allowed)
+    return counts
+
+
+def sweep_policies(all_pred, all_labels, all_toas, all_uncertains, fps=20.0, thresholds=None, kofn=((1, 1),),
+                   gate_values=(np.inf,), refractory=(0.0,), gate='epistemic'):
+    """ Evaluate every combination of the alert policy parameters.
+    :param: all_pred (N x T), all_labels (N,), all_toas (N,), all_uncertains (N x T x 2)
+    :param: thresholds, alert thresholds of the (smoothed) accident score
+    :param: kofn, (k, n) pairs, an alert needs k of the last n frames above the threshold
+    :param: gate_values, frames whose uncertainty (of type gate) is larger than the value cannot trigger alerts
+    :param: refractory, the periods (seconds) without new alerts after an alert
+    :output: a dict of arrays, one entry for each policy. False alarms are the alerts in negative videos per
+             hour of negative videos, recall is the ratio of positive videos alerted before the accident, and
+             mTTA is the mean time (seconds) from the first alert to the accident of the alerted positive videos.
+    """
+    all_pred = np.asarray(all_pred, dtype=np.float64)
+    labels = np.reshape(np.asarray(all_labels), (-1,))
+    toas = np.reshape(np.asarray(all_toas), (-1,)).astype(np.float64)
+    thresholds = np.asarray(thresholds if thresholds is not None else np.arange(0.05, 1.0, 0.05), dtype=np.float64)
+    n_frames = all_pred.shape[1]
+    lengths = eval_lengths(labels, toas, n_frames)
+    pos, neg = labels > 0, labels <= 0
+    neg_hours = np.sum(lengths[neg]) / fps / 3600.0
+    refractory_frames = np.round(np.asarray(refractory) * fps).astype(np.int64)
+    uncertainty = np.sum(np.asarray(all_uncertains)[..., GATES[gate]], axis=-1) if all_uncertains is not None else None
+
+    table = {name: [] for name in ['threshold', 'k', 'n', 'gate', 'refractory', 'fa_per_hour', 'recall', 'mTTA']}
+    for gate_value in gate_values:
+        gated = all_pred if np.isinf(gate_value) else np.where(uncertainty <= gate_value, all_pred, -np.inf)
+        for k, n in kofn:
+            scores = kofn_scores(gated, k, n)
+            # positive videos: the first alert before the accident
+            first = first_alerts(scores[pos], lengths[pos], thresholds)  # K x N_pos
+            detected = first >= 0
+            tta = np.where(detected, (toas[pos][None, :] - first) / fps, 0)
+            recall = np.sum(detected, axis=1) / max(np.sum(pos), 1)
+            mtta = np.sum(tta, axis=1) / np.maximum(np.sum(detected, axis=1), 1)
+            mtta[~np.any(detected, axis=1)] = np.nan
+            # negative videos: all alerts are false alarms
+            counts = count_alerts(scores[neg], lengths[neg], thresholds, refractory_frames)  # R x K x N_neg
+            fa = np.sum(counts, axis=2) / neg_hours if neg_hours > 0 else np.full(counts.shape[:2], np.nan)
+            for r, period in enumerate(refractory):
+                table['threshold'].append(thresholds)
+                table['fa_per_hour'].append(fa[r])
+                table['recall'].append(recall)
+                table['mTTA'].append(mtta)
+                for name, value in zip(['k', 'n', 'gate', 'refractory'], [k, n, gate_value, period]):
+                    table[name].append(np.full(len(thresholds), value, dtype=np.float64))
+    return {name: np.concatenate(values) for name, values in table.items()}
+
+
+def pareto_front(fa_per_hour, recall, mtta):
+    """ :output: boolean mask of the policies not dominated by any other policy, i.e., no other policy has
+             fewer (or equal) false alarms, higher (or equal) recall and mTTA, and is better in one of them.
+    """
+    objectives = np.stack([-np.asarray(fa_per_hour), recall, np.nan_to_num(mtta, nan=-np.inf)], axis=1)
+    # a dominating policy always comes earlier in this order, and it is dominated by (or is) a front member
+    order = np.lexsort((-objectives[:, 2], -objectives[:, 1], -objectives[:, 0]))
+    mask = np.zeros((len(objectives),), dtype=bool)
+    front = np.empty((0, 3))
+    for idx in order:
+        point = objectives[idx]
+        if np.any(np.all(front >= point, axis=1) & np.any(front > point, axis=1)):
+            continue
+        mask[idx] = True
+        front = np.vstack([front, point])
+    return mask
@@ -0,0 +1,99 @@
+import numpy as np
+from src.eval_tools import sweep_thresholds, unique_recall_curves, grid_recall_curves, curve_metrics
+
+METRICS = ['AP', 'mTTA', 'TTA_R80']
+
+
+def bootstrap_weights(n_videos, n_boot=1000, seed=123, strata=None):
+    """ Resample the videos with replacement. A replicate is represented by how many times each video is drawn.
+    :param: strata (n_videos,), if given, each stratum (e.g., positive and negative videos) is resampled separately
+    :output: weights (n_boot x n_videos)
+    """
+    rng = np.random.RandomState(seed)
+    if strata is None:
+        groups = [np.arange(n_videos)]
+    else:
+        strata = np.asarray(strata)
+        groups = [np.nonzero(strata == s)[0] for s in np.unique(strata)]
+    weights = np.zeros((n_boot, n_videos), dtype=np.float64)
+    offsets = n_videos * np.arange(n_boot)[:, None]
+    for group in groups:
+        draws = group[rng.randint(0, len(group), size=(n_boot, len(group)))]
+        weights += np.bincount((draws + offsets).ravel(), minlength=n_boot * n_videos).reshape(n_boot, n_videos)
+    return weights
+
+
+def positive_videos(records):
+    """ :output: boolean mask (n_videos,) of positive videos, each of them has exactly one record with delta_tp=1
+    """
+    mask = np.zeros((records['n_videos'],), dtype=bool)
+    mask[records['video'][records['delta_tp'] > 0]] = True
+    return mask
+
+
+def weighted_curves(records, thresholds, weights):
+    """ threshold_curves() of a batch of replicates. The records are shared by all replicates and each one
+    is counted as many times as its video is drawn, so no replicate needs to be re-evaluated from the frames.
+    :param: weights (B x n_videos)
+    :output: Tp, Tp_Fp, time (B x K) and the number of positive videos (B,)
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    order = np.argsort(-records['value'], kind='stable')
+    idx = np.searchsorted(-records['value'][order], -thresholds, side='right')
+    record_weights = weights[:, records['video'][order]]
+    zeros = np.zeros((weights.shape[0], 1))
+    cum_tp = np.concatenate([zeros, np.cumsum(record_weights * records['delta_tp'][order], axis=1)], axis=1)
+    cum_time = np.concatenate([zeros, np.cumsum(record_weights * records['delta_time'][order], axis=1)], axis=1)
+    # number of (weighted) videos with any prediction >= Th
+    video_order = np.argsort(-records['max_score'], kind='stable')
+    idx_video = np.searchsorted(-records['max_score'][video_order], -thresholds, side='right')
+    cum_videos = np.concatenate([zeros, np.cumsum(weights[:, video_order], axis=1)], axis=1)
+    return cum_tp[:, idx], cum_videos[:, idx_video], cum_time[:, idx], cum_tp[:, -1]
+
+
+def bootstrap_metrics(records, weights, fps=20.0, chunk_size=100, mode='grid'):
+    """ AP, mTTA and TTA_R80 of each bootstrap replicate, computed as evaluation() with the same mode.
+    In the grid mode, all replicates share the thresholds and the buffer size of the full set, so that the
+    replicate of all videos drawn once equals evaluate_records(records, mode='grid').
+    :param: records, the output of crossing_records() or merge_records() of all videos
+    :param: weights (B x n_videos), the output of bootstrap_weights()
+    :output: (B x 3) array, NaN for replicates without any positive video
+    """
+    assert weights.shape[1] == records['n_videos'], "weights do not match the number of videos!"
+    total_seconds = records['n_frames'] / fps
+    # in the exact mode, the P-R curve only changes at the record values and the video maxima of the full set
+    thresholds = sweep_thresholds(records, mode)
+    negative = ~positive_videos(records)
+    results = np.full((weights.shape[0], len(METRICS)), np.nan)
+    for start in range(0, weights.shape[0], chunk_size):
+        chunk = weights[start:start + chunk_size]
+        Tp, Tp_Fp, time, n_pos = weighted_curves(records, thresholds, chunk)
+        n_neg = np.sum(chunk[:, negative], axis=1)
+        for i in range(Tp.shape[0]):
+            if n_pos[i] == 0:
+                continue
+            if mode == 'exact':
+                new_Precision, new_Recall, new_Time = unique_recall_curves(Tp[i], Tp_Fp[i], time[i], n_pos[i])
+            else:
+                new_Precision, new_Recall, new_Time = grid_recall_curves(Tp[i], Tp_Fp[i], time[i], n_pos[i], n_neg[i],
+                                                                         thresholds, records['n_eval_frames'])
+            results[start + i] = curve_metrics(new_Precision, new_Recall, new_Time, total_seconds)
+    return results
+
+
+def confidence_interval(samples, level=0.95):
+    """ Percentile confidence interval of each column of samples (B x M).
+    :output: lower (M,), upper (M,)
+    """
+    alpha = (1 - level) / 2.0 * 100
+    return np.nanpercentile(samples, alpha, axis=0), np.nanpercentile(samples, 100 - alpha, axis=0)
+
+
+def paired_p_value(diff):
+    """ Two-sided bootstrap p-value of the null hypothesis that the paired difference is zero.
+    :param: diff (B x M), differences of two methods on the same replicates
+    """
+    n_valid = np.maximum(np.sum(~np.isnan(diff), axis=0), 1)
+    p_lower = np.sum(diff <= 0, axis=0) / n_valid
+    p_upper = np.sum(diff >= 0, axis=0) / n_valid
+    return np.minimum(1.0, 2 * np.minimum(p_lower, p_upper))
@@ -0,0 +1,183 @@
+import os
+import json
+import queue
+import random
+import shutil
+import threading
+import numpy as np
+import torch
+
+
+def to_cpu(obj):
+    """ :return: a copy of obj where all tensors are detached cpu tensors, so that it can be serialized while the
+             training continues to update the originals
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().cpu().clone()
+    if isinstance(obj, dict):
+        return {key: to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(value) for value in obj)
+    return obj
+
+
+def rng_state():
+    """ :return: the states of all the random generators used in training, as tensors and python values so that
+             they can be loaded with torch.load(weights_only=True)
+    """
+    np_state = np.random.get_state()
+    return {'torch': torch.get_rng_state(),
+            'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+            'numpy': (np_state[0], torch.from_numpy(np_state[1].astype(np.int64)), np_state[2], np_state[3], np_state[4]),
+            'python': random.getstate()}
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    if torch.cuda.is_available() and len(state['cuda']) > 0:
+        torch.cuda.set_rng_state_all(state['cuda'])
+    name, keys, pos, has_gauss, cached_gaussian = state['numpy']
+    np.random.set_state((name, keys.numpy().astype(np.uint32), pos, has_gauss, cached_gaussian))
+    random.setstate(state['python'])
+
+
+def atomic_save(obj, filename):
+    """ torch.save into a temporary file which is renamed to filename, so filename is either the previous or the
+    complete new file even if the process is killed while writing.
+    """
+    tmp_file = os.path.join(os.path.dirname(filename), '.%s.tmp' % (os.path.basename(filename)))
+    with open(tmp_file, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, filename)
+
+
+def atomic_copy(src_file, dest_file):
+    tmp_file = os.path.join(os.path.dirname(dest_file), '.%s.tmp' % (os.path.basename(dest_file)))
+    shutil.copyfile(src_file, tmp_file)
+    os.replace(tmp_file, dest_file)
+
+
+class CheckpointManager(object):
+    """ Save the checkpoint of each epoch from a background thread.
+    The state is copied to the cpu in the training thread, and it is serialized by the thread into a temporary
+    file which is renamed when complete. The retention keeps the last keep_last checkpoints and the keep_best ones
+    with the highest metric (all of them if keep_last is 0), and final_model.pth is a copy of the best one. The
+    metrics of the checkpoints are kept in checkpoints.json, so that the retention continues after a resume.
+    """
+    def __init__(self, model_dir, keep_last=0, keep_best=1, filename='bayesian_gcrnn_model_%02d.pth', final_name='final_model.pth'):
+        self.model_dir = model_dir
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.filename = filename
+        self.final_name = final_name
+        self.index_file = os.path.join(model_dir, 'checkpoints.json')
+        # epoch -> metric, None until it is known (an epoch without evaluation gets a None metric)
+        self.epochs, self.metrics = [], {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r') as f:
+                index = json.load(f)
+            self.epochs = [epoch for epoch in index['epochs'] if os.path.exists(self.checkpoint_file(epoch))]
+            self.metrics = {int(epoch): metric for epoch, metric in index['metrics'].items()}
+        self.best_epoch = self._best_epochs()[0] if len(self._best_epochs()) > 0 else None
+        self.error = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='checkpoint_manager', daemon=True)
+        self.thread.start()
+
+    def checkpoint_file(self, epoch):
+        return os.path.join(self.model_dir, self.filename % (epoch))
+
+    def truncate(self, epoch):
+        """ Forget the checkpoints after the epoch, e.g., when the training resumes from it.
+        """
+        self.epochs = [k for k in self.epochs if k <= epoch]
+        self.metrics = {k: metric for k, metric in self.metrics.items() if k <= epoch}
+        # the final model may be a forgotten checkpoint, it is copied again at the next update
+        self.best_epoch = None
+
+    def save(self, epoch, state, metric=None, pending=False):
+        """
+        :param: state, the dict to save, copied to the cpu before this function returns
+        :param: metric, the metric (larger is better) of the epoch, None if it is not evaluated
+        :param: pending, if the metric is set later with set_metric(), the checkpoint is not removed until then
+        """
+        self._check()
+        self.queue.put(('save', (epoch, to_cpu(state))))
+        if not pending:
+            self.set_metric(epoch, metric)
+
+    def set_metric(self, epoch, metric):
+        """ Set the metric of a saved epoch (None if it is not evaluated), the final model and the retention are
+        updated by the thread once its checkpoint is written.
+        """
+        self._check()
+        self.queue.put(('metric', (epoch, metric)))
+
+    def wait(self):
+        """ Wait until all the checkpoints are written.
+        """
+        self.queue.join()
+        self._check()
+
+    def close(self):
+        self.wait()
+        self.queue.put(None)
+        self.thread.join()
+
+    def _check(self):
+        # errors of the thread are raised in the training thread
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _best_epochs(self):
+        evaluated = [epoch for epoch in self.epochs if self.metrics.get(epoch) is not None]
+        # the earlier epoch wins a tie, as the final model is only replaced by a better one
+        return sorted(evaluated, key=lambda epoch: (-self.metrics[epoch], epoch))
+
+    def _write_index(self):
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'epochs': self.epochs, 'metrics': {str(k): v for k, v in self.metrics.items()},
+                       'best_epoch': self.best_epoch}, f, indent=2)
+        os.replace(tmp_file, self.index_file)
+
+    def _update(self):
+        best = self._best_epochs()
+        if len(best) > 0 and best[0] != self.best_epoch:
+            self.best_epoch = best[0]
+            atomic_copy(self.checkpoint_file(self.best_epoch), os.path.join(self.model_dir, self.final_name))
+        if self.keep_last > 0:
+            keep = set(self.epochs[-self.keep_last:]) | set(best[:self.keep_best])
+            for epoch in list(self.epochs):
+                # the checkpoints waiting for their metric are kept
+                if epoch not in keep and epoch in self.metrics:
+                    os.remove(self.checkpoint_file(epoch))
+                    self.epochs.remove(epoch)
+        self._write_index()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                kind, data = item
+                if kind == 'save':
+                    epoch, state = data
+                    atomic_save(state, self.checkpoint_file(epoch))
+                    self.epochs = sorted(set(self.epochs) | {epoch})
+                    # a new checkpoint of the epoch needs a new metric
+                    self.metrics.pop(epoch, None)
+                    if self.best_epoch == epoch:
+                        self.best_epoch = None
+                elif kind == 'metric':
+                    epoch, metric = data
+                    self.metrics[epoch] = metric
+                self._update()
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
@@ -1,66 +1,240 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import os
-from scipy.interpolate import make_interp_spline
+import time
 
-def evaluation(all_pred, all_labels, time_of_accidents, fps=20.0):
+def evaluation(all_pred, all_labels, time_of_accidents, fps=20.0, mode='grid'):
     """
     :param: all_pred (N x T), where N is number of videos, T is the number of frames for each video
     :param: all_labels (N,)
     :param: time_of_accidents (N,) int element
+    :param: mode, 'grid' sweeps thresholds with step 0.001 as in the published results, 'exact' sweeps every
+            distinct score as a threshold
     :output: AP (average precision, AUC), mTTA (mean Time-to-Accident), TTA@R80 (TTA at Recall=80%)
     """
+    records = crossing_records(all_pred, all_labels, time_of_accidents)
+    return evaluate_records(records, fps=fps, mode=mode)
 
-    preds_eval = []
-    min_pred = np.inf
-    n_frames = 0
-    for idx, toa in enumerate(time_of_accidents):
-        if all_labels[idx] > 0:
-            pred = all_pred[idx, :int(toa)]  # positive video
-        else:
-            pred = all_pred[idx, :]  # negative video
-        # find the minimum prediction
-        min_pred = np.min(pred) if min_pred > np.min(pred) else min_pred
-        preds_eval.append(pred)
-        n_frames += len(pred)
-    total_seconds = all_pred.shape[1] / fps
-
-    # iterate a set of thresholds from the minimum predictions
-    # temp_shape = int((1.0 - max(min_pred, 0)) / 0.001 + 0.5) 
-    Precision = np.zeros((n_frames))
-    Recall = np.zeros((n_frames))
-    Time = np.zeros((n_frames))
-    cnt = 0
-    for Th in np.arange(max(min_pred, 0), 1.0, 0.001):
-        Tp = 0.0
-        Tp_Fp = 0.0
-        Tp_Tn = 0.0
-        time = 0.0
-        counter = 0.0  # number of TP videos
-        # iterate each video sample
-        for i in range(len(preds_eval)):
-            # true positive frames: (pred->1) * (gt->1)
-            tp =  np.where(preds_eval[i]*all_labels[i]>=Th)
-            Tp += float(len(tp[0])>0)
-            if float(len(tp[0])>0) > 0:
-                # if at least one TP, compute the relative (1 - rTTA)
-                time += tp[0][0] / float(time_of_accidents[i])
-                counter = counter+1
-            # all positive frames
-            Tp_Fp += float(len(np.where(preds_eval[i]>=Th)[0])>0)
-        if Tp_Fp == 0:  # predictions of all videos are negative
-            continue
-        else:
-            Precision[cnt] = Tp/Tp_Fp
-        if np.sum(all_labels) ==0: # gt of all videos are negative
-            continue
-        else:
-            Recall[cnt] = Tp/np.sum(all_labels)
-        if counter == 0:
-            continue
-        else:
-            Time[cnt] = (1-time/counter)
-        cnt += 1
+
+def crossing_records(all_pred, all_labels, time_of_accidents):
+    """ Summarize each video by the records of its prefix maxima, i.e., the frames where the running maximum
+    of the predictions increases. For a threshold Th, the first frame with prediction >= Th is the first record
+    whose value >= Th, so all threshold-dependent quantities are sums over records.
+    :param: all_pred (N x T), all_labels (N,), time_of_accidents (N,)
+    :output: a dict of arrays, each record carries the change of the (relative) first-crossing time
+             and of the number of detected positive videos when the threshold drops below its value
+    """
+    all_pred = np.asarray(all_pred)
+    n_videos, n_frames = all_pred.shape
+    labels = np.reshape(np.asarray(all_labels), (-1,))
+    toas = np.reshape(np.asarray(time_of_accidents), (-1,)).astype(np.float64)
+    # positive videos are evaluated before the accident, negative videos on all frames
+    lengths = np.where(labels > 0, np.minimum(toas.astype(np.int64), n_frames), n_frames)
+    in_window = np.arange(n_frames)[None, :] < lengths[:, None]
+    scores = np.where(in_window, all_pred, -np.inf)
+
+    pos = labels > 0
+    prefix_max = np.maximum.accumulate(scores[pos], axis=1)
+    is_record = np.ones(prefix_max.shape, dtype=bool)
+    is_record[:, 1:] = prefix_max[:, 1:] > prefix_max[:, :-1]
+    is_record &= in_window[pos]
+    vid_idx, time_idx = np.nonzero(is_record)  # sorted by video, then by time
+    # the last record of each video is its maximum
+    is_last = np.ones(len(vid_idx), dtype=bool)
+    is_last[:-1] = vid_idx[1:] != vid_idx[:-1]
+    time_next = np.zeros_like(time_idx)
+    time_next[:-1] = time_idx[1:]
+    delta_time = np.where(is_last, time_idx, time_idx - time_next) / toas[pos][vid_idx]
+
+    return {'value': prefix_max[vid_idx, time_idx],
+            'delta_time': delta_time,
+            'delta_tp': is_last.astype(np.int64),
+            'video': np.nonzero(pos)[0][vid_idx],
+            'max_score': np.max(scores, axis=1),
+            'n_videos': n_videos,
+            'n_pos': int(np.sum(labels)),
+            'min_pred': np.min(all_pred[in_window]),  # keeps the dtype of predictions, which sets the dtype of the grid
+            'n_eval_frames': int(np.sum(lengths)),
+            'n_frames': n_frames}
+
+
+def merge_records(records_list):
+    """ Merge the crossing records of disjoint sets of videos, the result equals the records of their union.
+    """
+    assert len(records_list) > 0
+    assert len(set(records['n_frames'] for records in records_list)) == 1, "videos should have the same number of frames!"
+    merged = {}
+    for key in ['value', 'delta_time', 'delta_tp', 'max_score']:
+        merged[key] = np.concatenate([records[key] for records in records_list])
+    # video indices are offset by the number of videos before each part
+    offsets = np.cumsum([0] + [records['n_videos'] for records in records_list[:-1]])
+    merged['video'] = np.concatenate([records['video'] + offset for records, offset in zip(records_list, offsets)])
+    for key in ['n_pos', 'n_eval_frames', 'n_videos']:
+        merged[key] = sum(records[key] for records in records_list)
+    merged['min_pred'] = min(records['min_pred'] for records in records_list)
+    merged['n_frames'] = records_list[0]['n_frames']
+    return merged
+
+
+class EvalAccumulator(object):
+    """ Accumulate the predictions batch by batch into compact per-video summaries (crossing records,
+    video-level scores and uncertainty sums) instead of keeping all frame-level predictions.
+    Accumulators of different processes or data shards can be merged exactly.
+    """
+    def __init__(self):
+        self.records = []
+        self.video_scores = []
+        self.labels = []
+        self.uncertain_sum = np.zeros((2,), dtype=np.float64)
+        self.uncertain_count = 0
+
+    def __len__(self):
+        return int(sum(len(labels) for labels in self.labels))
+
+    def update(self, pred, labels, toas, uncertainties=None):
+        """
+        :param: pred (B x T), labels (B,), toas (B,), uncertainties (B x T x 2), i.e., aleatoric and epistemic
+        """
+        pred = np.asarray(pred)
+        labels = np.reshape(np.asarray(labels), (-1,))
+        toas = np.reshape(np.asarray(toas), (-1,))
+        self.records.append(crossing_records(pred, labels, toas))
+        # video-level score is the maximum prediction before the accident
+        before_toa = np.arange(pred.shape[1])[None, :] < toas.astype(np.int64)[:, None]
+        self.video_scores.append(np.max(np.where(before_toa, pred, -np.inf), axis=1))
+        self.labels.append(labels)
+        if uncertainties is not None:
+            self.uncertain_sum += np.sum(uncertainties, axis=(0, 1))
+            self.uncertain_count += uncertainties.shape[0] * uncertainties.shape[1]
+        return self
+
+    def merge(self, other):
+        self.records.extend(other.records)
+        self.video_scores.extend(other.video_scores)
+        self.labels.extend(other.labels)
+        self.uncertain_sum += other.uncertain_sum
+        self.uncertain_count += other.uncertain_count
+        return self
+
+    def evaluate(self, fps=20.0, mode='grid'):
+        """ :output: AP, mTTA, TTA_R80 as evaluation()
+        """
+        return evaluate_records(merge_records(self.records), fps=fps, mode=mode)
+
+    def video_ap(self):
+        from sklearn.metrics import average_precision_score
+        return average_precision_score(np.concatenate(self.labels), np.concatenate(self.video_scores))
+
+    def mean_uncertainty(self):
+        """ :output: mean aleatoric and epistemic uncertainties over all frames
+        """
+        return self.uncertain_sum / max(self.uncertain_count, 1)
+
+
+def threshold_curves(records, thresholds):
+    """
+    :param: records, the output of crossing_records()
+    :param: thresholds (K,)
+    :output: Tp, Tp_Fp and the sum of relative first-crossing times over TP videos at each threshold
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    order = np.argsort(-records['value'], kind='stable')
+    neg_values = -records['value'][order]  # ascending
+    cum_time = np.concatenate([[0.0], np.cumsum(records['delta_time'][order])])
+    cum_tp = np.concatenate([[0], np.cumsum(records['delta_tp'][order])])
+    # number of records with value >= Th
+    idx = np.searchsorted(neg_values, -thresholds, side='right')
+    Tp = cum_tp[idx].astype(np.float64)
+    time = cum_time[idx]
+    # number of videos with any prediction >= Th
+    Tp_Fp = np.searchsorted(np.sort(-records['max_score']), -thresholds, side='right').astype(np.float64)
+    return Tp, Tp_Fp, time
+
+
+def sweep_thresholds(records, mode='grid'):
+    """ :return: the thresholds of the sweep of evaluate_records()
+    """
+    assert mode in ['exact', 'grid']
+    if mode == 'exact':
+        # every distinct record value or video maximum is a point of the P-R curve
+        return np.unique(np.concatenate([records['value'], records['max_score']]))
+    return np.arange(max(records['min_pred'], 0), 1.0, 0.001)
+
+
+def evaluate_records(records, fps=20.0, mode='grid'):
+    assert mode in ['exact', 'grid']
+    total_seconds = records['n_frames'] / fps
+    n_pos = records['n_pos']
+    thresholds = sweep_thresholds(records, mode)
+    Tp, Tp_Fp, time = threshold_curves(records, thresholds)
+    if mode == 'exact':
+        new_Precision, new_Recall, new_Time = unique_recall_curves(Tp, Tp_Fp, time, n_pos)
+    else:
+        new_Precision, new_Recall, new_Time = grid_recall_curves(Tp, Tp_Fp, time, n_pos, records['n_videos'] - n_pos,
+                                                                 thresholds, records['n_eval_frames'])
+
+    AP, mTTA, TTA_R80 = curve_metrics(new_Precision, new_Recall, new_Time, total_seconds)
+    print("Average Precision= %.4f, mean Time to accident= %.4f"%(AP, mTTA))
+    print("Recall@80%, Time to accident= " +"{:.4}".format(TTA_R80))
+
+    return AP, mTTA, TTA_R80
+
+
+def unique_recall_curves(Tp, Tp_Fp, time, n_pos):
+    """ Precision, recall and relative TTA of the valid thresholds, with a single point for each distinct recall
+    which takes the maximum precision and TTA.
+    """
+    valid = (Tp_Fp > 0) & (Tp > 0) if n_pos > 0 else np.zeros_like(Tp, dtype=bool)
+    Precision = Tp[valid] / Tp_Fp[valid]
+    Recall = Tp[valid] / n_pos
+    Time = 1 - time[valid] / Tp[valid]
+    # unique the recall, and fetch the maximum precision and TTA of each recall
+    new_index = np.argsort(Recall, kind='stable')
+    Precision, Recall, Time = Precision[new_index], Recall[new_index], Time[new_index]
+    new_Recall, rep_index = np.unique(Recall, return_index=True)
+    new_Precision = np.maximum.reduceat(Precision, rep_index)
+    new_Time = np.maximum.reduceat(Time, rep_index)
+    return new_Precision, new_Recall, new_Time
+
+
+def grid_recall_curves(Tp, Tp_Fp, time, n_pos, n_neg, thresholds, n_eval_frames):
+    """ unique_recall_curves() of the grid mode, which reproduces the published threshold loop.
+    :param: n_neg, the number of negative videos
+    :param: n_eval_frames, the number of evaluated frames, i.e., the size of the buffers of the published loop
+    """
+    # the published loop tests pred * label >= Th, which holds for the first frame of every negative video at Th <= 0
+    Tp = Tp + (np.asarray(thresholds) <= 0) * n_neg
+    valid = (Tp_Fp > 0) & (Tp > 0) if n_pos > 0 else np.zeros_like(Tp, dtype=bool)
+    Precision = Tp[valid] / Tp_Fp[valid]
+    Recall = Tp[valid] / n_pos
+    Time = 1 - time[valid] / Tp[valid]
+    return _unique_recall_grid(Precision, Recall, Time, n_eval_frames)
+
+
+def curve_metrics(new_Precision, new_Recall, new_Time, total_seconds):
+    """ :output: AP, mTTA and TTA_R80 of the P-R and TTA-R curves (sorted by ascending recall)
+    """
+    # compute AP (area under P-R curve)
+    AP = 0.0
+    if new_Recall[0] != 0:
+        AP += new_Precision[0]*(new_Recall[0]-0)
+    for i in range(1,len(new_Precision)):
+        AP += (new_Precision[i-1]+new_Precision[i])*(new_Recall[i]-new_Recall[i-1])/2
+
+    # transform the relative mTTA to seconds
+    mTTA = np.mean(new_Time) * total_seconds
+    sort_time = new_Time[np.argsort(new_Recall)]
+    sort_recall = np.sort(new_Recall)
+    TTA_R80 = sort_time[np.argmin(np.abs(sort_recall-0.8))] * total_seconds
+    return AP, mTTA, TTA_R80
+
+
+def _unique_recall_grid(valid_precision, valid_recall, valid_time, n_frames):
+    # the grid mode keeps the original post-processing (zero-padded buffers of n_frames entries) to reproduce the published numbers
+    n_valid = len(valid_recall)
+    Precision = np.zeros((max(n_frames, n_valid)))
+    Recall = np.zeros((max(n_frames, n_valid)))
+    Time = np.zeros((max(n_frames, n_valid)))
+    Precision[:n_valid], Recall[:n_valid], Time[:n_valid] = valid_precision, valid_recall, valid_time
     # sort the metrics with recall (ascending)
     new_index = np.argsort(Recall)
     Precision = Precision[new_index]
@@ -78,22 +252,7 @@ def evaluation(all_pred, all_labels, time_of_accidents, fps=20.0):
     new_Time[-1] = Time[rep_index[-1]]
     new_Precision[-1] = Precision[rep_index[-1]]
     new_Recall = Recall[rep_index]
-    # compute AP (area under P-R curve)
-    AP = 0.0
-    if new_Recall[0] != 0:
-        AP += new_Precision[0]*(new_Recall[0]-0)
-    for i in range(1,len(new_Precision)):
-        AP += (new_Precision[i-1]+new_Precision[i])*(new_Recall[i]-new_Recall[i-1])/2
-
-    # transform the relative mTTA to seconds
-    mTTA = np.mean(new_Time) * total_seconds
-    print("Average Precision= %.4f, mean Time to accident= %.4f"%(AP, mTTA))
-    sort_time = new_Time[np.argsort(new_Recall)]
-    sort_recall = np.sort(new_Recall)
-    TTA_R80 = sort_time[np.argmin(np.abs(sort_recall-0.8))] * total_seconds
-    print("Recall@80%, Time to accident= " +"{:.4}".format(TTA_R80))
-
-    return AP, mTTA, TTA_R80
+    return new_Precision, new_Recall, new_Time
 
 
 def print_results(Epochs, APvid_all, AP_all, mTTA_all, TTA_R80_all, Unc_all, result_dir):
@@ -104,63 +263,148 @@ def print_results(Epochs, APvid_all, AP_all, mTTA_all, TTA_R80_all, Unc_all, res
     f.close()
 
 
-def vis_results(vis_data, batch_size, vis_dir, smooth=False, vis_batchnum=2):
-    assert vis_batchnum <= len(vis_data)
-    for b in range(vis_batchnum):
-        results = vis_data[b]
-        pred_frames = results['pred_frames']
-        labels = results['label']
-        toa = results['toa']
-        video_ids = results['video_ids']
-        detections = results['detections']
-        uncertainties = results['pred_uncertain']
-        for n in range(batch_size):
-            pred_mean = pred_frames[n, :]  # (90,)
-            pred_std_alea = 1.0 * np.sqrt(uncertainties[n, :, 0])
-            pred_std_epis = 1.0 * np.sqrt(uncertainties[n, :, 1])
-            xvals = range(len(pred_mean))
-            if smooth:
-                # sampling
-                xvals = np.linspace(0,len(pred_mean)-1,20)
-                pred_mean_reduce = pred_mean[xvals.astype(np.int)]
-                pred_std_alea_reduce = pred_std_alea[xvals.astype(np.int)]
-                pred_std_epis_reduce = pred_std_epis[xvals.astype(np.int)]
-                # smoothing
-                xvals_new = np.linspace(1,len(pred_mean)+1,80)
-                pred_mean = make_interp_spline(xvals, pred_mean_reduce)(xvals_new)
-                pred_std_alea = make_interp_spline(xvals, pred_std_alea_reduce)(xvals_new)
-                pred_std_epis = make_interp_spline(xvals, pred_std_epis_reduce)(xvals_new)
-                pred_mean[pred_mean >= 1.0] = 1.0-1e-3
-                xvals = xvals_new
-                # fix invalid values
-                indices = np.where(xvals <= toa[n])[0]
-                xvals = xvals[indices]
-                pred_mean = pred_mean[indices]
-                pred_std_alea = pred_std_alea[indices]
-                pred_std_epis = pred_std_epis[indices]
-            # plot the probability predictions
-            fig, ax = plt.subplots(1, figsize=(24, 3.5))
-            ax.fill_between(xvals, pred_mean - pred_std_alea, pred_mean + pred_std_alea, facecolor='wheat', alpha=0.5)
-            ax.fill_between(xvals, pred_mean - pred_std_epis, pred_mean + pred_std_epis, facecolor='yellow', alpha=0.5)
-            plt.plot(xvals, pred_mean, linewidth=3.0)
-            if toa[n] <= pred_frames.shape[1]:
-                plt.axvline(x=toa[n], ymax=1.0, linewidth=3.0, color='r', linestyle='--')
-            # plt.axhline(y=0.7, xmin=0, xmax=0.9, linewidth=3.0, color='g', linestyle='--')
-            # draw accident region
-            x = [toa[n], pred_frames.shape[1]]
-            y1 = [0, 0]
-            y2 = [1, 1]
-            ax.fill_between(x, y1, y2, color='C1', alpha=0.3, interpolate=True)
-            fontsize = 25
-            plt.ylim(0, 1.1)
-            plt.xlim(1, pred_frames.shape[1])
-            plt.ylabel('Probability', fontsize=fontsize)
-            plt.xlabel('Frame (FPS=20)', fontsize=fontsize)
-            plt.xticks(range(0, pred_frames.shape[1], 10), fontsize=fontsize)
-            plt.yticks(fontsize=fontsize)
-            plt.grid(True)
-            plt.tight_layout()
-            tag = 'pos' if labels[n] > 0 else 'neg'
-            plt.savefig(os.path.join(vis_dir, video_ids[n] + '_' + tag + '.png'))
-            plt.close()
-            # plt.show()
\ No newline at end of file
+def video_curves(pred_mean, uncertainties, toa, smooth=False):
+    """
+    :param: pred_mean (T,), uncertainties (T x 2), toa, the time of accident of the video
+    :output: xvals, pred_mean, pred_std_alea, pred_std_epis of the curves to plot
+    """
+    pred_std_alea = 1.0 * np.sqrt(uncertainties[:, 0])
+    pred_std_epis = 1.0 * np.sqrt(uncertainties[:, 1])
+    xvals = range(len(pred_mean))
+    if smooth:
+        from scipy.interpolate import make_interp_spline
+        # sampling
+        xvals = np.linspace(0,len(pred_mean)-1,20)
+        pred_mean_reduce = pred_mean[xvals.astype(int)]
+        pred_std_alea_reduce = pred_std_alea[xvals.astype(int)]
+        pred_std_epis_reduce = pred_std_epis[xvals.astype(int)]
+        # smoothing
+        xvals_new = np.linspace(1,len(pred_mean)+1,80)
+        pred_mean = make_interp_spline(xvals, pred_mean_reduce)(xvals_new)
+        pred_std_alea = make_interp_spline(xvals, pred_std_alea_reduce)(xvals_new)
+        pred_std_epis = make_interp_spline(xvals, pred_std_epis_reduce)(xvals_new)
+        pred_mean[pred_mean >= 1.0] = 1.0-1e-3
+        xvals = xvals_new
+        # fix invalid values
+        indices = np.where(xvals <= toa)[0]
+        xvals = xvals[indices]
+        pred_mean = pred_mean[indices]
+        pred_std_alea = pred_std_alea[indices]
+        pred_std_epis = pred_std_epis[indices]
+    return xvals, pred_mean, pred_std_alea, pred_std_epis
+
+
+class CurveRenderer(object):
+    """ A figure template of the accident curve of a video. The axes, ticks, labels and layout are created
+    once, and each video only updates the data of the line, fill and marker artists before saving.
+    The figure is drawn by the Agg canvas without pyplot, so it runs headless.
+    """
+    # aleatoric, epistemic uncertainties and the accident region
+    fill_styles = [dict(facecolor='wheat', alpha=0.5), dict(facecolor='yellow', alpha=0.5), dict(color='C1', alpha=0.3, interpolate=True)]
+
+    def __init__(self, n_frames):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.n_frames = n_frames
+        self.fig = Figure(figsize=(24, 3.5))
+        FigureCanvasAgg(self.fig)
+        ax = self.fig.subplots(1)
+        self.ax = ax
+        # the artists are created in the same order (and so with the same colors) as the per-video figures
+        x, y = np.arange(n_frames), np.zeros((n_frames,))
+        self.fills = [ax.fill_between(x, y, y, **self.fill_styles[0]), ax.fill_between(x, y, y, **self.fill_styles[1])]
+        self.line, = ax.plot(x, y, linewidth=3.0)
+        self.toa_line = ax.axvline(x=n_frames, ymax=1.0, linewidth=3.0, color='r', linestyle='--')
+        # draw accident region
+        self.fills.append(ax.fill_between([n_frames, n_frames], [0, 0], [1, 1], **self.fill_styles[2]))
+        fontsize = 25
+        ax.set_ylim(0, 1.1)
+        ax.set_xlim(1, n_frames)
+        ax.set_ylabel('Probability', fontsize=fontsize)
+        ax.set_xlabel('Frame (FPS=20)', fontsize=fontsize)
+        ax.set_xticks(range(0, n_frames, 10))
+        for label in ax.get_xticklabels() + ax.get_yticklabels():
+            label.set_fontsize(fontsize)
+        ax.grid(True)
+        self.fig.tight_layout()
+
+    def set_fills(self, fills):
+        """ :param: fills, the (x, y1, y2) of each fill in self.fill_styles
+        """
+        if hasattr(self.fills[0], 'set_data'):
+            for collection, (x, y1, y2) in zip(self.fills, fills):
+                collection.set_data(x, y1, y2)
+        else:
+            # matplotlib<3.10 cannot update a fill, so the fills are re-created in the same drawing order
+            for collection in self.fills:
+                collection.remove()
+            self.fills = [self.ax.fill_between(x, y1, y2, **style) for (x, y1, y2), style in zip(fills, self.fill_styles)]
+
+    def render(self, pred_mean, uncertainties, toa, label, video_id, vis_dir, smooth=False):
+        xvals, pred_mean, pred_std_alea, pred_std_epis = video_curves(pred_mean, uncertainties, toa, smooth=smooth)
+        xvals = np.asarray(xvals)
+        self.set_fills([(xvals, pred_mean - pred_std_alea, pred_mean + pred_std_alea),
+                        (xvals, pred_mean - pred_std_epis, pred_mean + pred_std_epis),
+                        ([toa, self.n_frames], [0, 0], [1, 1])])
+        self.line.set_data(xvals, pred_mean)
+        self.toa_line.set_xdata([toa, toa])
+        self.toa_line.set_visible(toa <= self.n_frames)
+        tag = 'pos' if label > 0 else 'neg'
+        self.fig.savefig(os.path.join(vis_dir, video_id + '_' + tag + '.png'))
+
+
+_renderer = None
+
+
+def _render_video(task):
+    # each worker process keeps its own figure template
+    global _renderer
+    if _renderer is None or _renderer.n_frames != task['n_frames']:
+        _renderer = CurveRenderer(task.pop('n_frames'))
+    else:
+        task.pop('n_frames')
+    _renderer.render(**task)
+    return 1
+
+
+def vis_results(vis_data, batch_size, vis_dir, smooth=False, vis_batchnum=2, max_videos=0, num_workers=0, seed=123):
+    """
+    :param: vis_data, a list of the batch results of test_all_vis(), or a PredictionReader
+    :param: max_videos, 0 to plot the videos of the first vis_batchnum batches, N > 0 to plot N videos randomly
+            sampled from all batches, -1 to plot all videos
+    :param: num_workers, the number of rendering processes, 0 to render in the current process
+    """
+    assert vis_dir is not None, "vis_dir is required to save the visualizations!"
+    if max_videos == 0:
+        assert vis_batchnum <= len(vis_data)
+        selected = None
+        n_batches = vis_batchnum
+    else:
+        # only the last batch may be partial
+        n_videos = (len(vis_data) - 1) * batch_size + len(vis_data[len(vis_data) - 1]['label']) if len(vis_data) > 0 else 0
+        selected = set(range(n_videos)) if max_videos < 0 or max_videos >= n_videos else \
+            set(np.random.RandomState(seed).choice(n_videos, max_videos, replace=False).tolist())
+        n_batches = len(vis_data)
+
+    def video_tasks():
+        for b in range(n_batches):
+            results = vis_data[b]
+            pred_frames = results['pred_frames']
+            for n in range(len(pred_frames)):
+                if selected is not None and b * batch_size + n not in selected:
+                    continue
+                yield {'pred_mean': pred_frames[n, :], 'uncertainties': results['pred_uncertain'][n],
+                       'toa': results['toa'][n], 'label': results['label'][n], 'video_id': str(results['video_ids'][n]),
+                       'vis_dir': vis_dir, 'smooth': smooth, 'n_frames': pred_frames.shape[1]}
+
+    t_start = time.time()
+    if num_workers > 0:
+        import multiprocessing as mp
+        # forked workers do not import the (heavy) main module again, the workers only use numpy and matplotlib
+        ctx = mp.get_context('fork' if 'fork' in mp.get_all_start_methods() else 'spawn')
+        with ctx.Pool(num_workers) as pool:
+            n_rendered = sum(pool.imap_unordered(_render_video, video_tasks(), chunksize=4))
+    else:
+        n_rendered = sum(_render_video(task) for task in video_tasks())
+    t_total = time.time() - t_start
+    print("Rendered %d videos in %.2f s (%.1f videos/s)"%(n_rendered, t_total, n_rendered / max(t_total, 1e-6)))
@@ -0,0 +1,103 @@
+import queue
+import torch.multiprocessing as mp
+
+# the GRU-GCN layers of UString are kept in python lists, so they are not in its state_dict
+RNN_WEIGHTS = ['weight_xz', 'weight_hz', 'weight_xr', 'weight_hr', 'weight_xh', 'weight_hh']
+
+
+def model_state(net):
+    """ :return: all the weights of UString, as references to the tensors of the model (see snapshot_state() for a copy)
+    """
+    state = {'model': net.state_dict(), 'rnn': {}}
+    for name in RNN_WEIGHTS:
+        state['rnn'][name] = [layer.state_dict() for layer in getattr(net.rnn, name)]
+    return state
+
+
+def snapshot_state(net):
+    """ :return: a cpu copy of all the weights of UString, which is not changed by the following training steps
+    """
+    state = model_state(net)
+    state['model'] = {name: value.detach().cpu().clone() for name, value in state['model'].items()}
+    for name, layers in state['rnn'].items():
+        state['rnn'][name] = [{k: v.detach().cpu().clone() for k, v in layer.items()} for layer in layers]
+    return state
+
+
+def load_snapshot(net, state):
+    net.load_state_dict(state['model'])
+    for name, layers in state['rnn'].items():
+        for layer, layer_state in zip(getattr(net.rnn, name), layers):
+            layer.load_state_dict(layer_state)
+    return net
+
+
+class EvalWorker(object):
+    """ Evaluate model snapshots in a separate process while the training continues.
+    The snapshots are sent through a torch.multiprocessing queue, i.e., their tensors are moved to shared memory
+    instead of being written to files. The target function runs in the spawned process as
+    target(jobs, results, *args): it gets (epoch, iter, state) jobs until None, and puts (epoch, iter, results).
+    """
+    def __init__(self, target, args=(), max_pending=2):
+        """
+        :param: max_pending, the maximal number of snapshots waiting for evaluation, newer snapshots are skipped
+                when the evaluation falls behind the training
+        """
+        ctx = mp.get_context('spawn')
+        self.jobs = ctx.Queue()
+        self.results = ctx.Queue()
+        self.max_pending = max_pending
+        self.submitted = {}  # epoch -> the number of evaluated snapshots of the epoch
+        self.reported = {}  # epoch -> [(iter, results)]
+        self.process = ctx.Process(target=target, args=(self.jobs, self.results) + tuple(args), name='eval_worker', daemon=True)
+        self.process.start()
+
+    def pending(self):
+        return sum(self.submitted.values()) - sum(len(values) for values in self.reported.values())
+
+    def submit(self, epoch, cur_iter, state):
+        """ :return: False if the snapshot is skipped
+        """
+        if not self.process.is_alive():
+            raise RuntimeError("The evaluation worker exited with code %s" % (self.process.exitcode))
+        if self.pending() >= self.max_pending:
+            return False
+        self.jobs.put((epoch, cur_iter, state))
+        self.submitted[epoch] = self.submitted.get(epoch, 0) + 1
+        return True
+
+    def poll(self, block=False):
+        """ :return: the newly reported [(epoch, iter, results)], waiting for all pending snapshots if block
+        """
+        reported = []
+        while self.pending() > 0:
+            try:
+                epoch, cur_iter, results = self.results.get(timeout=1.0) if block else self.results.get_nowait()
+            except queue.Empty:
+                if block and self.process.is_alive():
+                    continue
+                if not self.process.is_alive():
+                    raise RuntimeError("The evaluation worker exited with code %s" % (self.process.exitcode))
+                break
+            self.reported.setdefault(epoch, []).append((cur_iter, results))
+            reported.append((epoch, cur_iter, results))
+        return reported
+
+    def latest_results(self, epoch):
+        """ :return: the results of the latest snapshot up to the epoch once all of them are evaluated (as a
+                 synchronous evaluation would give at the end of the epoch), None if some of them are not evaluated
+                 yet, and {} if there is no snapshot
+        """
+        if any(len(self.reported.get(k, [])) < n for k, n in self.submitted.items() if k <= epoch):
+            return None
+        reports = [report for k, values in self.reported.items() if k <= epoch for report in values]
+        return max(reports, key=lambda report: report[0])[1] if len(reports) > 0 else {}
+
+    def close(self):
+        """ Wait for the pending snapshots and stop the process.
+        :return: the newly reported [(epoch, iter, results)]
+        """
+        reported = self.poll(block=True)
+        self.jobs.put(None)
+        self.process.join()
+        return reported
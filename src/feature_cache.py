@@ -0,0 +1,113 @@
+import os
+import copy
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+# the arrays of a sample as returned by the datasets (features, labels, graph_edges, edge_weights, toa)
+ARRAYS = [('features', np.float32), ('labels', np.float32), ('graph_edges', np.int32), ('edge_weights', np.float32), ('toa', np.float32)]
+
+
+def source_files(dataset):
+    """ :return: the npz files of DADDataset, A3DDataset or CrashDataset
+    """
+    if hasattr(dataset, 'labels_list'):
+        root = os.path.join(dataset.data_path, dataset.feature + '_features')
+    else:
+        root = os.path.join(dataset.data_path, dataset.phase)
+    return [os.path.join(root, filename) for filename in dataset.files_list]
+
+
+def cache_key(dataset):
+    """ :return: the key of the decoded dataset, which changes with the files (names, sizes and modification times),
+             the labels of the split and the graph settings
+    """
+    files = [[os.path.abspath(filename), os.path.getsize(filename), int(os.path.getmtime(filename))] for filename in source_files(dataset)]
+    config = {'dataset': type(dataset).__name__, 'feature': dataset.feature, 'phase': dataset.phase, 'files': files,
+              'labels': getattr(dataset, 'labels_list', None), 'n_obj': dataset.n_obj, 'top_k': dataset.top_k}
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def build_feature_cache(dataset, entry_dir):
+    """ Decode all the samples of the dataset (npz loading and graph construction) into one .npy file per array,
+    written into a temporary directory which is renamed to entry_dir when complete.
+    """
+    from tqdm import tqdm
+    source = copy.copy(dataset)
+    source.toTensor, source.vis = False, False
+    tmp_dir = os.path.join(os.path.dirname(entry_dir), '.tmp-%s-%d' % (os.path.basename(entry_dir), os.getpid()))
+    os.makedirs(tmp_dir, exist_ok=True)
+    arrays = None
+    for i in tqdm(range(len(source)), desc="Caching %s set"%(dataset.phase)):
+        # the graph edges are a list of (2 x E) arrays and the toa a list
+        sample = [np.asarray(value, dtype=dtype) for value, (name, dtype) in zip(source[i], ARRAYS)]
+        if arrays is None:
+            arrays = [np.lib.format.open_memmap(os.path.join(tmp_dir, name + '.npy'), mode='w+', dtype=dtype, shape=(len(source),) + value.shape)
+                      for value, (name, dtype) in zip(sample, ARRAYS)]
+        for array, value in zip(arrays, sample):
+            array[i] = value
+    for array in arrays:
+        array.flush()
+    del arrays
+    meta = {'dataset': type(dataset).__name__, 'feature': dataset.feature, 'phase': dataset.phase, 'n_samples': len(source),
+            'files_list': list(dataset.files_list), 'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # the same dataset was cached by another process
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def open_feature_cache(dataset, cache_dir):
+    """ :return: a CachedDataset of the dataset in cache_dir, decoded first if it is not cached yet
+    """
+    entry_dir = os.path.join(cache_dir, '%s_%s_%s_%s' % (type(dataset).__name__, dataset.feature, dataset.phase, cache_key(dataset)))
+    if not os.path.exists(os.path.join(entry_dir, 'meta.json')):
+        os.makedirs(cache_dir, exist_ok=True)
+        build_feature_cache(dataset, entry_dir)
+    return CachedDataset(dataset, entry_dir)
+
+
+class CachedDataset(Dataset):
+    """ A dataset decoded by build_feature_cache(), read through read-only memory maps. The concurrent runs reading
+    the same cache share its pages in the page cache (or in memory if the cache is in /dev/shm), and skip the npz
+    decoding and the graph construction. The samples are the same as the ones of the source dataset.
+    """
+    def __init__(self, dataset, entry_dir):
+        self.entry_dir = entry_dir
+        # the attributes used by the training and evaluation code
+        for name in ['data_path', 'feature', 'phase', 'n_frames', 'n_obj', 'top_k', 'fps', 'dim_feature', 'files_list']:
+            setattr(self, name, getattr(dataset, name))
+        self.toTensor = dataset.toTensor
+        self.device = dataset.device
+        self.arrays = None
+
+    def __len__(self):
+        return len(self.files_list)
+
+    def _open(self):
+        # opened lazily, so that the memory maps are not pickled into DataLoader workers
+        if self.arrays is None:
+            self.arrays = [np.load(os.path.join(self.entry_dir, name + '.npy'), mmap_mode='r') for name, _ in ARRAYS]
+        return self.arrays
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['arrays'] = None
+        return state
+
+    def __getitem__(self, index):
+        features, labels, graph_edges, edge_weights, toa = [np.array(array[index]) for array in self._open()]
+        if self.toTensor:
+            features = torch.from_numpy(features).to(self.device)
+            labels = torch.from_numpy(labels).to(self.device)
+            graph_edges = torch.from_numpy(graph_edges).long().to(self.device)
+            edge_weights = torch.from_numpy(edge_weights).to(self.device)
+            toa = torch.from_numpy(toa).to(self.device)
+        return features, labels, graph_edges, edge_weights, toa
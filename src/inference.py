@@ -0,0 +1,83 @@
+""" Inference of UString (or a student distilled by script/distill.py) on pre-extracted features. This module only
+depends on torch and numpy, so that it can be imported by serving workers without the training, visualization and
+detection packages.
+"""
+import numpy as np
+import torch
+from src.Models import UString, StudentGRU
+from src.DataLoader import generate_st_graph, pad_objects
+from src.eval_worker import load_snapshot
+
+
+def load_model(model_file, dim_feature=4096, hidden_dim=256, latent_dim=256, n_obj=19, n_frames=50, fps=10.0, readout='flatten',
+               device=torch.device('cpu')):
+    """ :return: the model of the checkpoint in evaluation mode, a StudentGRU for the checkpoints of script/distill.py
+    """
+    checkpoint = torch.load(model_file, map_location='cpu')
+    if 'student' in checkpoint:
+        model = StudentGRU(**checkpoint['student'])
+        model.load_state_dict(checkpoint['model'])
+    else:
+        model = UString(dim_feature, hidden_dim, latent_dim, n_layers=1, n_obj=n_obj, n_frames=n_frames, fps=fps,
+                        with_saa=False, uncertain_ranking=True, readout=readout)
+        # filter out modules only used in training
+        pretrained_dict = {k: v for k, v in checkpoint['model'].items() if not any(filtered in k for filtered in ['self_aggregation', 'predictor_aux'])}
+        load_snapshot(model, {'model': pretrained_dict, 'rnn': checkpoint.get('rnn', {})})
+    model = model.to(device=device)
+    model.eval()
+    return model
+
+
+def prepare_inputs(features, detections, n_obj=None, top_k=None, device=torch.device('cpu')):
+    """
+    :param: features: (T, 1 + N, D) of a video or (B, T, 1 + N, D) of a batch, the frame and the object features
+    :param: detections: (T, N, 6) or (B, T, N, 6), zero padded after the detected objects
+    :param: n_obj: the number of objects the videos are padded or truncated to, None to keep N
+    :return: features (B, T, 1 + n_obj, D), graph_edges (B, T, 2, E) and edge_weights (B, T, E) tensors
+    """
+    features, detections = np.asarray(features, dtype=np.float32), np.asarray(detections)
+    if features.ndim == 3:
+        features, detections = features[np.newaxis], detections[np.newaxis]
+    batch_xs, graph_edges, edge_weights = [], [], []
+    for video_features, video_detections in zip(features, detections):
+        if n_obj is not None:
+            video_features, video_detections = pad_objects(video_features, video_detections, n_obj)
+        edges, weights = generate_st_graph(video_detections, top_k=top_k)
+        batch_xs.append(video_features)
+        graph_edges.append(edges)
+        edge_weights.append(weights)
+    batch_xs = torch.from_numpy(np.stack(batch_xs)).to(device)
+    graph_edges = torch.from_numpy(np.stack(graph_edges)).long().to(device)
+    edge_weights = torch.from_numpy(np.stack(edge_weights)).to(device)
+    return batch_xs, graph_edges, edge_weights
+
+
+def predict(model, features, detections, npass=10, threshold=0.5, n_obj=None, top_k=None):
+    """ Run the model on the features of a video (or a batch of videos).
+    :param: threshold: the accident score of an alert
+    :return: a dict of numpy arrays, the accident scores (T,), the aleatoric and epistemic uncertainties (T,), i.e., the
+             traces of their matrices, the alerts (T,), i.e., the frames whose score reaches the threshold, and the
+             first alert frame (-1 if none), with a leading batch dimension for a batch of videos
+    """
+    device = next(model.parameters()).device
+    batch_xs, graph_edges, edge_weights = prepare_inputs(features, detections, n_obj=n_obj, top_k=top_k, device=device)
+    batch_size, n_frames = batch_xs.shape[:2]
+    # the labels and the time of accident only enter the losses
+    labels = torch.zeros(batch_size, 2, device=device)
+    labels[:, 1] = 1
+    toa = torch.full((batch_size, 1), float(n_frames + 1), device=device)
+    with torch.no_grad():
+        _, all_outputs, _ = model(batch_xs, labels, toa, graph_edges, hidden_in=None, edge_weights=edge_weights, npass=npass, eval_uncertain=True)
+    pred = torch.stack([output['pred_mean'] for output in all_outputs], dim=1)  # B x T x 2
+    aleatoric = torch.stack([output['aleatoric'] for output in all_outputs], dim=1)  # B x T x 2 x 2
+    epistemic = torch.stack([output['epistemic'] for output in all_outputs], dim=1)  # B x T x 2 x 2
+    scores = torch.softmax(pred, dim=-1)[..., 1].cpu().numpy()
+    alerts = scores >= threshold
+    results = {'score': scores,
+               'aleatoric': (aleatoric[..., 0, 0] + aleatoric[..., 1, 1]).cpu().numpy(),
+               'epistemic': (epistemic[..., 0, 0] + epistemic[..., 1, 1]).cpu().numpy(),
+               'alerts': alerts,
+               'first_alert': np.where(alerts.any(axis=1), alerts.argmax(axis=1), -1)}
+    if np.ndim(features) == 3:
+        results = {name: value[0] for name, value in results.items()}
+    return results
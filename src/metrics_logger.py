@@ -0,0 +1,156 @@
+import json
+import queue
+import threading
+import torch
+
+TRAIN_LOSSES = ['total_loss', 'cross_entropy', 'log_posterior', 'log_prior', 'auxloss', 'ranking']
+TEST_LOSSES = ['total_loss', 'cross_entropy', 'auxloss']
+
+
+class MetricsLogger(object):
+    """ Batched and asynchronous logging of the training curves.
+    The loss tensors of each iteration are only detached and reduced on their device, and they are copied to
+    the host together every sync_every iterations, so the training loop is not synchronized with the device
+    at every iteration. The console, tensorboard and JSONL outputs are written by a background thread.
+    """
+    def __init__(self, writer=None, jsonl_file=None, sync_every=10, verbose=True):
+        """
+        :param: writer, a tensorboardX SummaryWriter (or None)
+        :param: jsonl_file, the file where each record is appended as a json line (or None)
+        :param: sync_every, the number of training iterations whose losses are copied to the host at once
+        """
+        self.writer = writer
+        self.jsonl = open(jsonl_file, 'a') if jsonl_file else None
+        self.sync_every = max(1, sync_every)
+        self.verbose = verbose
+        self.pending = []
+        self.error = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='metrics_logger', daemon=True)
+        self.thread.start()
+
+    def log_train(self, cur_epoch, cur_iter, losses, lr):
+        """ Record the losses of a training iteration (without synchronizing the device).
+        """
+        device = losses['total_loss'].device
+        values = torch.stack([torch.as_tensor(losses[name], device=device).detach().mean().float() for name in TRAIN_LOSSES])
+        self.pending.append((cur_epoch, cur_iter, lr, values))
+        if len(self.pending) >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        """ Copy the pending training losses to the host in a single transfer and hand them to the writer thread.
+        """
+        if len(self.pending) == 0:
+            return
+        values = torch.stack([record[3] for record in self.pending]).cpu().numpy()
+        records = [(epoch, it, lr, values[i]) for i, (epoch, it, lr, _) in enumerate(self.pending)]
+        self.pending = []
+        self._put(('train', records))
+
+    def log_test(self, cur_epoch, cur_iter, losses, metrics):
+        """ Record the averaged test losses and the metrics (AP, mTTA, TTA_R80) of an evaluation.
+        """
+        values = {name: float(torch.as_tensor(losses[name]).detach().mean()) for name in TEST_LOSSES}
+        metrics = {name: float(value) for name, value in metrics.items()}
+        self._put(('test', (cur_epoch, cur_iter, values, metrics)))
+
+    def log_histograms(self, tensors, epoch):
+        """ :param: tensors, a dict of named tensors, copied to the host before they are written
+        """
+        tensors = {name: tensor.detach().cpu().numpy() for name, tensor in tensors.items()}
+        self._put(('histogram', (epoch, tensors)))
+
+    def flush(self):
+        """ Wait until all the recorded values are written.
+        """
+        self.sync()
+        self.queue.join()
+        self._check()
+        if self.writer is not None:
+            self.writer.flush()
+        if self.jsonl is not None:
+            self.jsonl.flush()
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        if self.writer is not None:
+            self.writer.close()
+        if self.jsonl is not None:
+            self.jsonl.close()
+
+    def _put(self, item):
+        self._check()
+        self.queue.put(item)
+
+    def _check(self):
+        # errors of the writer thread are raised in the training thread
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                kind, data = item
+                if kind == 'train':
+                    for cur_epoch, cur_iter, lr, values in data:
+                        self._write_train(cur_epoch, cur_iter, lr, dict(zip(TRAIN_LOSSES, values.tolist())))
+                elif kind == 'test':
+                    self._write_test(*data)
+                elif kind == 'histogram':
+                    epoch, tensors = data
+                    if self.writer is not None:
+                        for name, values in tensors.items():
+                            self.writer.add_histogram(name, values, epoch)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _write_json(self, record):
+        if self.jsonl is not None:
+            self.jsonl.write(json.dumps(record) + '\n')
+
+    def _write_train(self, cur_epoch, cur_iter, lr, losses):
+        if self.verbose:
+            print('----------------------------------')
+            print('epoch: %d, iter: %d' % (cur_epoch, cur_iter))
+            print('total loss = %.6f' % (losses['total_loss']))
+            print('cross_entropy = %.6f' % (losses['cross_entropy']))
+            print('log_posterior = %.6f' % (losses['log_posterior']))
+            print('log_prior = %.6f' % (losses['log_prior']))
+            print('aux_loss = %.6f' % (losses['auxloss']))
+            print('rank_loss = %.6f' % (losses['ranking']))
+        if self.writer is not None:
+            self.writer.add_scalars("train/losses/total_loss", {'total_loss': losses['total_loss']}, cur_iter)
+            self.writer.add_scalars("train/losses/cross_entropy", {'cross_entropy': losses['cross_entropy']}, cur_iter)
+            self.writer.add_scalars("train/losses/log_posterior", {'log_posterior': losses['log_posterior']}, cur_iter)
+            self.writer.add_scalars("train/losses/log_prior", {'log_prior': losses['log_prior']}, cur_iter)
+            self.writer.add_scalars("train/losses/complexity_cost", {'complexity_cost': losses['log_posterior'] - losses['log_prior']}, cur_iter)
+            self.writer.add_scalars("train/losses/aux_loss", {'aux_loss': losses['auxloss']}, cur_iter)
+            self.writer.add_scalars("train/losses/rank_loss", {'rank_loss': losses['ranking']}, cur_iter)
+            self.writer.add_scalars("train/learning_rate/lr", {'lr': lr}, cur_iter)
+        record = {'phase': 'train', 'epoch': cur_epoch, 'iter': cur_iter, 'lr': lr}
+        record.update(losses)
+        self._write_json(record)
+
+    def _write_test(self, cur_epoch, cur_iter, losses, metrics):
+        if self.writer is not None:
+            loss_info = {'total_loss': losses['total_loss'], 'cross_entropy': losses['cross_entropy'], 'aux_loss': losses['auxloss']}
+            self.writer.add_scalars("test/losses/total_loss", loss_info, cur_iter)
+            self.writer.add_scalars("test/accuracy/AP", {'AP': metrics['AP']}, cur_iter)
+            self.writer.add_scalars("test/accuracy/time-to-accident", {'mTTA': metrics['mTTA'],
+                                                                       'TTA_R80': metrics['TTA_R80']}, cur_iter)
+        record = {'phase': 'test', 'epoch': cur_epoch, 'iter': cur_iter}
+        record.update(losses)
+        record.update(metrics)
+        self._write_json(record)
+        # the evaluations are read while the training runs, e.g., to prune the trials of a sweep
+        if self.jsonl is not None:
+            self.jsonl.flush()
@@ -0,0 +1,72 @@
+import numpy as np
+import cv2
+
+
+class CurveOverlay(object):
+    """ Draw the accident curve with its uncertainties at the bottom of video frames, one frame at a time.
+    The axes, ticks and labels are rendered once into a cached background, and each frame only restores the
+    background and draws the curve artists (blitting) before blending the result into the frame, so the cost
+    and memory of a frame do not grow with the video and it can run in a live loop.
+    """
+    def __init__(self, frame_width, n_frames, fps=10.0, fps_display=2.0, alpha=0.7, figsize=(24, 3.5)):
+        """
+        :param: frame_width, the width of video frames, the curve is rendered at this width without resizing
+        :param: n_frames, the number of frames of the x-axis
+        :param: alpha, the weight of the curve when blending with the frame
+        """
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.n_frames = n_frames
+        self.alpha = alpha
+        self.fig = Figure(figsize=figsize, dpi=frame_width / float(figsize[0]))
+        self.canvas = FigureCanvasAgg(self.fig)
+        ax = self.fig.subplots(1)
+        self.ax = ax
+        fontsize = 25
+        ax.set_ylim(0, 1.1)
+        ax.set_xlim(0, n_frames + 2)
+        ax.set_ylabel('Probability', fontsize=fontsize)
+        ax.set_xlabel('Frame (FPS=%d)'%(fps), fontsize=fontsize)
+        ax.set_xticks(range(0, n_frames + 2, int(n_frames / fps_display)))
+        for label in ax.get_xticklabels() + ax.get_yticklabels():
+            label.set_fontsize(fontsize)
+        self.fig.tight_layout()
+        # the curve artists are excluded from the cached background
+        x, y = np.zeros((1,)), np.zeros((1,))
+        self.fill_alea = ax.fill_between(x, y, y, facecolor='wheat', alpha=0.5, animated=True)
+        self.fill_epis = ax.fill_between(x, y, y, facecolor='yellow', alpha=0.5, animated=True)
+        self.line, = ax.plot(x, y, linewidth=3.0, animated=True)
+        self.threshold = ax.axhline(y=0.5, xmin=0, xmax=0, linewidth=3.0, color='g', linestyle='--', animated=True)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.height = int(self.canvas.get_width_height()[1])
+
+    def render(self, xvals, pred_score, std_alea, std_epis):
+        """ :output: the BGR image (height x frame_width x 3) of the curve of the given points
+        """
+        xvals, pred_score = np.asarray(xvals), np.asarray(pred_score)
+        self.canvas.restore_region(self.background)
+        self.fill_alea.set_data(xvals, pred_score - std_alea, pred_score + std_alea)
+        self.fill_epis.set_data(xvals, pred_score - std_epis, pred_score + std_epis)
+        self.line.set_data(xvals, pred_score)
+        # the threshold line grows with the curve
+        self.threshold.set_xdata([0, np.max(xvals) / (self.n_frames + 2)])
+        for artist in [self.fill_alea, self.fill_epis, self.line, self.threshold]:
+            self.ax.draw_artist(artist)
+        return cv2.cvtColor(np.asarray(self.canvas.buffer_rgba()), cv2.COLOR_RGBA2BGR)
+
+    def compose(self, frame, xvals, pred_score, std_alea, std_epis, detections=None):
+        """ Draw the detections and blend the curve into the bottom of the frame (in place).
+        :param: frame (H x W x 3) BGR image
+        :param: detections (N x 6), the boxes (x1, y1, x2, y2, score, label) of the frame
+        """
+        if detections is not None:
+            for box in detections:
+                cv2.rectangle(frame, (int(box[0]), int(box[1])), (int(box[2]), int(box[3])), (0, 255, 0), 3)
+        img = self.render(xvals, pred_score, std_alea, std_epis)
+        if img.shape[1] != frame.shape[1]:
+            # the figure width may be rounded to one pixel off
+            img = cv2.resize(img, (frame.shape[1], img.shape[0]), interpolation=cv2.INTER_AREA)
+        height = min(img.shape[0], frame.shape[0])
+        frame[frame.shape[0]-height:] = cv2.addWeighted(frame[frame.shape[0]-height:], 1 - self.alpha, img[img.shape[0]-height:], self.alpha, 0)
+        return frame
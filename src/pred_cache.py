@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+
+CACHE_VERSION = 1
+_digests = {}
+
+
+def file_digest(filename, chunk_size=1 << 20):
+    """ sha256 of the file bytes, memorized by (path, size, mtime) so that a checkpoint is read only once.
+    """
+    stat = os.stat(filename)
+    stamp = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    if stamp not in _digests:
+        sha = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha.update(chunk)
+        _digests[stamp] = sha.hexdigest()
+    return _digests[stamp]
+
+
+def prediction_key(input_files, config):
+    """
+    :param: input_files, the files whose bytes determine the predictions, e.g., the checkpoint file
+    :param: config, a json-serializable dict of everything else, e.g., hyperparameters, test split and seed
+    :return: the hex key of the cache entry
+    """
+    sha = hashlib.sha256()
+    sha.update(('v%d' % (CACHE_VERSION)).encode())
+    for filename in input_files:
+        sha.update(file_digest(filename).encode())
+    sha.update(json.dumps(config, sort_keys=True).encode())
+    return sha.hexdigest()
+
+
+class PredictionCache(object):
+    """ Content-addressed store of model predictions. Each entry is a directory named by its key, holding
+    the arrays (predictions.npz) or a sharded prediction store, and the metadata (meta.json). Entries are
+    written into a temporary directory and renamed, so that an interrupted run never leaves a partial entry.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """ :return: the dict of arrays of the entry, or None if it does not exist
+        """
+        entry_dir = self.entry_dir(key)
+        if not os.path.exists(os.path.join(entry_dir, 'meta.json')) or not os.path.exists(os.path.join(entry_dir, 'predictions.npz')):
+            return None
+        with np.load(os.path.join(entry_dir, 'predictions.npz'), allow_pickle=True) as data:
+            arrays = {name: data[name] for name in data.files}
+        # the access time drives the garbage collection
+        os.utime(os.path.join(entry_dir, 'meta.json'), None)
+        return arrays
+
+    def put(self, key, arrays, meta=None):
+        """
+        :param: arrays, a dict of arrays saved with np.savez
+        :param: meta, a json-serializable dict describing how the predictions are produced
+        """
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        entry_dir = self.entry_dir(key)
+        if os.path.exists(entry_dir):
+            return entry_dir
+        tmp_dir = os.path.join(self.cache_dir, '.tmp-%s-%d' % (key, os.getpid()))
+        os.makedirs(tmp_dir, exist_ok=True)
+        np.savez(os.path.join(tmp_dir, 'predictions.npz'), **arrays)
+        meta = dict(meta or {})
+        meta.update({'key': key, 'created': time.strftime('%Y-%m-%d %H:%M:%S')})
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # the same entry was written by another process
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return entry_dir
+
+    def get_store(self, key):
+        """ :return: the directory of a complete prediction store (see src/pred_store.py) entry, or None
+        """
+        entry_dir = self.entry_dir(key)
+        if not os.path.exists(os.path.join(entry_dir, 'meta.json')) or not os.path.exists(os.path.join(entry_dir, 'index.json')):
+            return None
+        os.utime(os.path.join(entry_dir, 'meta.json'), None)
+        return entry_dir
+
+    def partial_dir(self, key):
+        """ The directory where a prediction store is written before it is complete. It is named by the key,
+        so a rerun of an interrupted evaluation continues from the written shards.
+        """
+        return os.path.join(self.cache_dir, '.partial-%s' % (key))
+
+    def commit(self, key, src_dir, meta=None):
+        """ Turn a complete prediction store into the entry of key.
+        """
+        meta = dict(meta or {})
+        meta.update({'key': key, 'created': time.strftime('%Y-%m-%d %H:%M:%S')})
+        with open(os.path.join(src_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        try:
+            os.rename(src_dir, self.entry_dir(key))
+        except OSError:
+            shutil.rmtree(src_dir, ignore_errors=True)
+        return self.entry_dir(key)
+
+    def remove(self, key):
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+
+    def entries(self):
+        """ :return: the metadata of all entries, with their size (bytes) and last access time, most recent first
+        """
+        if not os.path.exists(self.cache_dir):
+            return []
+        results = []
+        for key in os.listdir(self.cache_dir):
+            meta_file = os.path.join(self.entry_dir(key), 'meta.json')
+            if key.startswith('.') or not os.path.exists(meta_file):
+                continue
+            with open(meta_file, 'r') as f:
+                meta = json.load(f)
+            meta['size'] = sum(os.path.getsize(os.path.join(self.entry_dir(key), filename)) for filename in os.listdir(self.entry_dir(key)))
+            meta['last_used'] = os.path.getmtime(meta_file)
+            results.append(meta)
+        return sorted(results, key=lambda meta: -meta['last_used'])
+
+    def gc(self, max_entries=None, max_bytes=None, max_age_days=None):
+        """ Remove the least recently used entries beyond the limits, and the leftovers of interrupted writes
+        (partial prediction stores are kept unless older than max_age_days, as they can be resumed).
+        :return: the keys of removed entries
+        """
+        removed, total_bytes, now = [], 0, time.time()
+        for i, meta in enumerate(self.entries()):
+            total_bytes += meta['size']
+            if (max_entries is not None and i >= max_entries) or \
+               (max_bytes is not None and total_bytes > max_bytes) or \
+               (max_age_days is not None and now - meta['last_used'] > max_age_days * 86400):
+                self.remove(meta['key'])
+                removed.append(meta['key'])
+        if os.path.exists(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                tmp_dir = os.path.join(self.cache_dir, name)
+                if name.startswith('.tmp-') and now - os.path.getmtime(tmp_dir) > 3600:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                elif name.startswith('.partial-') and max_age_days is not None and now - os.path.getmtime(tmp_dir) > max_age_days * 86400:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+        return removed
@@ -0,0 +1,116 @@
+import os
+import json
+import numpy as np
+import torch
+from src.eval_tools import EvalAccumulator
+
+FIELDS = ['pred_frames', 'label', 'pred_uncertain', 'toa', 'detections', 'video_ids']
+
+
+def shard_file(store_dir, index):
+    return os.path.join(store_dir, 'shard_%06d.npz' % (index))
+
+
+def completed_shards(store_dir):
+    """ :return: the number of consecutive shards written from the first batch
+    """
+    n_shards = 0
+    while os.path.exists(shard_file(store_dir, n_shards)):
+        n_shards += 1
+    return n_shards
+
+
+class PredictionWriter(object):
+    """ Write the per-video predictions of each test batch into its own npz shard as evaluation proceeds.
+    A shard is written to a temporary file and renamed, so the shards on disk are always complete, and a
+    crashed run can be resumed after the last shard. Each shard also keeps the random states after its batch,
+    so that a resumed run draws the same Bayesian samples as an uninterrupted one.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        if not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+        self.n_shards = completed_shards(store_dir)
+        self.n_videos = 0
+        for index in range(self.n_shards):
+            with np.load(shard_file(store_dir, index)) as data:
+                self.n_videos += len(data['label'])
+
+    def append(self, batch, rng_states=None):
+        """
+        :param: batch, a dict of the per-video results of a batch as in vis_data of test_all_vis()
+        :param: rng_states, the (cpu, cuda) random states after the batch
+        """
+        arrays = {}
+        for name in FIELDS:
+            value = batch[name]
+            arrays[name] = value.cpu().numpy() if isinstance(value, torch.Tensor) else np.asarray(value)
+        if rng_states is not None:
+            arrays['rng_cpu'] = rng_states[0].numpy()
+            if rng_states[1] is not None:
+                arrays['rng_cuda'] = np.stack([state.numpy() for state in rng_states[1]])
+        tmp_file = shard_file(self.store_dir, self.n_shards) + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_file, shard_file(self.store_dir, self.n_shards))
+        self.n_shards += 1
+        self.n_videos += len(arrays['label'])
+
+    def rng_states(self):
+        """ :return: the random states after the last written batch, or None
+        """
+        if self.n_shards == 0:
+            return None
+        with np.load(shard_file(self.store_dir, self.n_shards - 1)) as data:
+            if 'rng_cpu' not in data.files:
+                return None
+            cuda_states = [torch.from_numpy(state) for state in data['rng_cuda']] if 'rng_cuda' in data.files else None
+            return torch.from_numpy(data['rng_cpu']), cuda_states
+
+    def close(self):
+        """ Mark the store as complete.
+        """
+        tmp_file = os.path.join(self.store_dir, 'index.json.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump({'n_shards': self.n_shards, 'n_videos': self.n_videos, 'fields': FIELDS}, f, indent=2)
+        os.replace(tmp_file, os.path.join(self.store_dir, 'index.json'))
+
+
+class PredictionReader(object):
+    """ Lazy reader of the shards written by PredictionWriter. Indexing it gives the dict of a batch as in
+    vis_data of test_all_vis(), so it can be passed to vis_results() in place of vis_data. Only one shard
+    is loaded at a time.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.n_shards = completed_shards(store_dir)
+
+    def __len__(self):
+        return self.n_shards
+
+    def __getitem__(self, index):
+        if index < 0 or index >= self.n_shards:
+            raise IndexError(index)
+        with np.load(shard_file(self.store_dir, index)) as data:
+            return {name: data[name] for name in FIELDS}
+
+    def __iter__(self):
+        for index in range(self.n_shards):
+            yield self[index]
+
+    def arrays(self):
+        """ :return: the concatenated pred (N x T), label (N,), toas (N,) and uncertainties (N x T x 2)
+        """
+        outputs = {'pred': [], 'label': [], 'toas': [], 'uncertainties': []}
+        for batch in self:
+            for name, field in zip(['pred', 'label', 'toas', 'uncertainties'], ['pred_frames', 'label', 'toa', 'pred_uncertain']):
+                outputs[name].append(batch[field])
+        return {name: np.concatenate(values) for name, values in outputs.items()}
+
+    def accumulator(self):
+        """ :return: the EvalAccumulator of all batches
+        """
+        accumulator = EvalAccumulator()
+        for batch in self:
+            accumulator.update(batch['pred_frames'], batch['label'], batch['toa'], uncertainties=batch['pred_uncertain'])
+        return accumulator
@@ -0,0 +1,152 @@
+import os
+import time
+import functools
+import contextlib
+import numpy as np
+import torch
+
+_active = None  # the running StageProfiler, None when profiling is disabled
+_disabled = contextlib.nullcontext()
+
+
+def stage(name):
+    """ A named stage of the pipeline: a record_function range in the trace and a wall-clock timer in the summary
+    while a StageProfiler is running, otherwise a shared no-op context (a global lookup per call).
+    """
+    if _active is None:
+        return _disabled
+    return _active.stage(name)
+
+
+def profiled(name):
+    """ Decorator running the function as a stage.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_iter(iterable, name='data'):
+    """ Iterate over iterable (e.g., a DataLoader), timing the wait for each item as a stage.
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class StageProfiler(object):
+    """ Profile the stages of n_iters iterations after warmup iterations, then trace trace_iters iterations.
+    The stage timers of the n_iters iterations give a per-stage summary table. The torch profiler then records the
+    stages as named ranges together with all the operators, and exports them as a Chrome trace (chrome://tracing or
+    https://ui.perfetto.dev). The trace takes hundreds of MB per iteration of UString, so it only covers a few
+    iterations, which are not in the summary as the tracing overhead would inflate the timers.
+    On cuda, the device is synchronized around each stage so that the timers measure the device work.
+    """
+    def __init__(self, warmup=3, n_iters=10, trace_iters=1, profile_dir='profile', device=torch.device('cpu')):
+        self.warmup = warmup
+        self.n_iters = n_iters
+        self.trace_iters = trace_iters
+        self.profile_dir = profile_dir
+        self.sync = device.type == 'cuda'
+        self.n_steps = 0
+        self.current = {}  # stage -> [calls, seconds] of the current step
+        self.records = []  # the stages of each profiled step
+        self.step_times = []
+        self.torch_profiler = None
+        if trace_iters > 0:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.sync:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.torch_profiler = torch.profiler.profile(activities=activities,
+                                                         schedule=torch.profiler.schedule(wait=warmup + n_iters, warmup=1, active=trace_iters, repeat=1),
+                                                         on_trace_ready=self._export_trace)
+
+    @property
+    def done(self):
+        return self.n_steps >= self.warmup + self.n_iters + (1 + self.trace_iters if self.torch_profiler is not None else 0)
+
+    @property
+    def trace_file(self):
+        return os.path.join(self.profile_dir, 'trace.json')
+
+    def start(self):
+        global _active
+        if not os.path.exists(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        if self.torch_profiler is not None:
+            self.torch_profiler.start()
+        _active = self
+        self.t_step = time.perf_counter()
+        return self
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.sync:
+            torch.cuda.synchronize()
+        t_start = time.perf_counter()
+        with torch.profiler.record_function(name):
+            yield
+            if self.sync:
+                torch.cuda.synchronize()
+        record = self.current.setdefault(name, [0, 0.0])
+        record[0] += 1
+        record[1] += time.perf_counter() - t_start
+
+    def step(self):
+        """ Mark the end of an iteration.
+        :return: True while there are iterations to profile
+        """
+        if self.sync:
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        if self.warmup <= self.n_steps < self.warmup + self.n_iters:
+            self.records.append(self.current)
+            self.step_times.append(now - self.t_step)
+        self.current = {}
+        self.n_steps += 1
+        if self.torch_profiler is not None:
+            self.torch_profiler.step()
+        self.t_step = time.perf_counter()
+        return not self.done
+
+    def stop(self):
+        global _active
+        _active = None
+        if self.torch_profiler is not None:
+            self.torch_profiler.stop()
+            print("Chrome trace saved in: %s" % (self.trace_file))
+
+    def _export_trace(self, prof):
+        prof.export_chrome_trace(self.trace_file)
+
+    def summary(self):
+        """ Print the table of the stages (sorted by their time) and save it as summary.txt.
+        :return: the rows (stage, calls per step, mean ms, p95 ms, share of step %)
+        """
+        if len(self.step_times) == 0:
+            return []
+        step_times = np.array(self.step_times) * 1000
+        names = sorted(set(name for record in self.records for name in record))
+        rows = [('step', 1.0, np.mean(step_times), np.percentile(step_times, 95), 100.0)]
+        for name in names:
+            times = np.array([record.get(name, [0, 0.0])[1] for record in self.records]) * 1000
+            calls = np.mean([record.get(name, [0, 0.0])[0] for record in self.records])
+            rows.append((name, calls, np.mean(times), np.percentile(times, 95), 100.0 * np.mean(times) / np.mean(step_times)))
+        rows = rows[:1] + sorted(rows[1:], key=lambda row: -row[2])
+        lines = ['%-20s %12s %12s %12s %10s' % ('stage', 'calls/step', 'mean (ms)', 'p95 (ms)', 'share (%)')]
+        for row in rows:
+            lines.append('%-20s %12.1f %12.3f %12.3f %10.1f' % row)
+        lines.append('%d steps profiled after %d warmup steps, nested stages are included in their parents.' % (len(step_times), self.warmup))
+        print('\n'.join(lines))
+        with open(os.path.join(self.profile_dir, 'summary.txt'), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return rows
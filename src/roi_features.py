@@ -0,0 +1,52 @@
+""" Object features pooled by RoIAlign from the feature map of a single backbone pass per frame, an alternative to the
+backbone pass on the crop of each box (the 'crop' feature mode). Both modes give the same layout of features, i.e.,
+the feature of the frame followed by the features of its boxes.
+"""
+import numpy as np
+import torch
+import torch.nn as nn
+from torchvision.ops import roi_align
+
+FEATURE_MODES = ['crop', 'roi_align']
+# the shorter side of the frames of the backbone pass, as the Resize(256) of the crops
+ROI_IMAGE_SIZE = 256
+
+
+class RoIAlignFeatures(nn.Module):
+    def __init__(self, trunk, head, dim_feat, spatial_scale, output_size=7, sampling_ratio=2):
+        """
+        :param: trunk: the convolutional layers of the backbone, the images to the feature map
+        :param: head: the layers of the backbone after pooling, (n x C x output_size x output_size) to (n x dim_feat)
+        :param: spatial_scale: the size of the feature map over the size of the images, e.g., 1/16
+        """
+        super(RoIAlignFeatures, self).__init__()
+        self.trunk = trunk
+        self.head = head
+        self.dim_feat = dim_feat
+        self.spatial_scale = spatial_scale
+        self.output_size = output_size
+        self.sampling_ratio = sampling_ratio
+
+    def config(self):
+        return {'spatial_scale': self.spatial_scale, 'output_size': self.output_size, 'sampling_ratio': self.sampling_ratio}
+
+    def forward(self, images, boxes, im_size):
+        """
+        :param: images: (B, 3, H, W), the resized frames
+        :param: boxes: B arrays (n_i, >=4) of x1, y1, x2, y2 in the coordinates of the original frames
+        :param: im_size: (height, width) of the original frames
+        :return: (B + sum(n_i), dim_feat), the feature of each frame (pooled from the whole frame) followed by the
+                 features of its boxes
+        """
+        height, width = images.shape[2:]
+        scale = np.array([width / im_size[1], height / im_size[0]] * 2, dtype=np.float32)
+        rois = []
+        for i, frame_boxes in enumerate(boxes):
+            frame_boxes = np.asarray(frame_boxes, dtype=np.float32)[:, :4] if len(frame_boxes) > 0 else np.zeros((0, 4), dtype=np.float32)
+            frame_rois = np.vstack([[0, 0, width, height], frame_boxes * scale])
+            rois.append(np.hstack([np.full((len(frame_rois), 1), i, dtype=np.float32), frame_rois]))
+        rois = torch.from_numpy(np.vstack(rois).astype(np.float32)).to(images.device)
+        feature_map = self.trunk(images)
+        pooled = roi_align(feature_map, rois, self.output_size, spatial_scale=self.spatial_scale,
+                           sampling_ratio=self.sampling_ratio, aligned=True)
+        return self.head(pooled)
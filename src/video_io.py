@@ -0,0 +1,124 @@
+""" Frames of a video decoded lazily, so that the memory does not grow with the length of the video.
+"""
+import os
+import queue
+import threading
+
+
+class FrameSource(object):
+    def __init__(self, video_file, n_frames=None, stride=1, fps=None, size=None, prefetch=0, pad=False, transform=None):
+        """
+        :param: n_frames: the maximum number of frames, None for all frames of the video
+        :param: stride: keep one of every stride frames
+        :param: fps: the fps the video is resampled to (instead of stride), dropping or repeating frames
+        :param: size: the frames are resized at decoding, to this shorter side (int) or to (width, height)
+        :param: prefetch: the number of frames decoded ahead by a thread, 0 to decode in the iterating thread
+        :param: pad: repeat the last frame of a video shorter than n_frames
+        :param: transform: applied to each BGR frame at decoding (in the prefetching thread)
+        """
+        assert os.path.exists(video_file), video_file
+        if stride != 1 and fps is not None:
+            raise ValueError('Set either the stride or the fps of the frames.')
+        if stride < 1:
+            raise ValueError('Invalid stride: %d' % (stride))
+        import cv2
+        cap = cv2.VideoCapture(video_file)
+        self.src_fps = cap.get(cv2.CAP_PROP_FPS)
+        # estimated from the container
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        self.video_file = video_file
+        self.n_frames = n_frames
+        # the index of the k-th frame in the video is round(k * step)
+        self.step = self.src_fps / fps if fps is not None and self.src_fps > 0 else float(stride)
+        self.fps = self.src_fps / self.step
+        self.size = size
+        self.prefetch = prefetch
+        self.pad = pad
+        self.transform = transform
+
+    def __iter__(self):
+        if self.prefetch > 0:
+            return self._prefetched()
+        return self._frames()
+
+    def resize(self, frame):
+        import cv2
+        height, width = frame.shape[:2]
+        if isinstance(self.size, int):
+            scale = self.size / min(height, width)
+            dsize = (int(round(width * scale)), int(round(height * scale)))
+        else:
+            dsize = tuple(self.size)
+        if dsize == (width, height):
+            return frame
+        interpolation = cv2.INTER_AREA if dsize[0] < width else cv2.INTER_LINEAR
+        return cv2.resize(frame, dsize, interpolation=interpolation)
+
+    def _frames(self):
+        import cv2
+        cap = cv2.VideoCapture(self.video_file)
+        try:
+            frame, frame_index, pos, count = None, -1, -1, 0
+            while self.n_frames is None or count < self.n_frames:
+                index = int(round(count * self.step))
+                # the skipped frames are only grabbed, without the conversion of retrieve()
+                while pos < index and cap.grab():
+                    pos += 1
+                if pos == index and index != frame_index:
+                    ret, decoded = cap.retrieve()
+                    if not ret:
+                        break
+                    frame, frame_index = decoded if self.size is None else self.resize(decoded), index
+                    # the frame is kept intact for the repeats, even if the consumer draws on it
+                    output = frame.copy() if self.pad or self.step < 1 else frame
+                elif frame is not None and (pos == index or (self.pad and self.n_frames is not None)):
+                    # a frame repeated by upsampling or padding
+                    output = frame.copy()
+                else:
+                    break
+                yield output if self.transform is None else self.transform(output)
+                count += 1
+            if count == 0 and self.n_frames != 0:
+                raise IOError('Failed to decode the video: %s' % (self.video_file))
+        finally:
+            cap.release()
+
+    def _decode(self, frame_queue, stop):
+        def put(item):
+            # give up if the consumer stopped, instead of blocking on a full queue
+            while not stop.is_set():
+                try:
+                    frame_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        frames = self._frames()
+        try:
+            for frame in frames:
+                if not put(('frame', frame)):
+                    return
+            put(('end', None))
+        except Exception as e:
+            put(('error', e))
+        finally:
+            frames.close()
+
+    def _prefetched(self):
+        frame_queue = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        decoder = threading.Thread(target=self._decode, args=(frame_queue, stop), daemon=True)
+        decoder.start()
+        try:
+            while True:
+                kind, item = frame_queue.get()
+                if kind == 'end':
+                    break
+                if kind == 'error':
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            decoder.join()
@@ -0,0 +1,33 @@
+""" The replicate of a bootstrap where every video is drawn once is the evaluation of the full test set.
+"""
+import os, sys
+import io
+import contextlib
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.eval_tools import crossing_records, evaluate_records
+from src.bootstrap import bootstrap_metrics
+
+
+def make_records(seed, n_videos=40, n_frames=50, decimals=None):
+    rng = np.random.RandomState(seed)
+    all_pred = rng.rand(n_videos, n_frames).astype(np.float32)
+    if decimals is not None:
+        # ties and zero scores
+        all_pred = np.round(all_pred, decimals)
+    labels = (rng.rand(n_videos) < 0.5).astype(np.float64)
+    labels[:2] = [0, 1]
+    toas = np.where(labels > 0, rng.randint(n_frames // 2, n_frames, size=n_videos), n_frames + 1)
+    return crossing_records(all_pred, labels, toas)
+
+
+@pytest.mark.parametrize('mode', ['grid', 'exact'])
+@pytest.mark.parametrize('decimals', [None, 1])
+def test_full_replicate_equals_evaluation(mode, decimals):
+    records = make_records(0, decimals=decimals)
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = evaluate_records(records, fps=10.0, mode=mode)
+    full = np.ones((1, records['n_videos']))
+    np.testing.assert_allclose(bootstrap_metrics(records, full, fps=10.0, mode=mode)[0], expected, rtol=1e-12, atol=0)
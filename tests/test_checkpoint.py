@@ -0,0 +1,35 @@
+""" The retention of CheckpointManager with --keep_last.
+"""
+import os, sys
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.checkpoint import CheckpointManager
+
+
+def saved_epochs(model_dir):
+    return sorted(int(name[-6:-4]) for name in os.listdir(model_dir) if name.startswith('bayesian_gcrnn_model_'))
+
+
+def test_keep_last_removes_epochs_without_metric(tmp_path):
+    # e.g., the epochs of a synchronous training without any test iteration
+    checkpoints = CheckpointManager(str(tmp_path), keep_last=2, keep_best=1)
+    for epoch, metric in enumerate([None, 0.5, None, None, None]):
+        checkpoints.save(epoch, {'epoch': torch.tensor(epoch)}, metric=metric)
+    checkpoints.close()
+    assert saved_epochs(str(tmp_path)) == [1, 3, 4]
+    assert checkpoints.best_epoch == 1
+
+
+def test_keep_last_keeps_pending_epochs(tmp_path):
+    # the checkpoints of --async_eval wait for their metric
+    checkpoints = CheckpointManager(str(tmp_path), keep_last=1, keep_best=1)
+    for epoch in range(3):
+        checkpoints.save(epoch, {'epoch': torch.tensor(epoch)}, pending=True)
+    checkpoints.wait()
+    assert saved_epochs(str(tmp_path)) == [0, 1, 2]
+    for epoch, metric in enumerate([0.3, None, 0.2]):
+        checkpoints.set_metric(epoch, metric)
+    checkpoints.close()
+    assert saved_epochs(str(tmp_path)) == [0, 2]
+    assert checkpoints.best_epoch == 0
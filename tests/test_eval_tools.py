@@ -0,0 +1,145 @@
+""" The grid mode of evaluation() reproduces the threshold loop of the published results.
+"""
+import os, sys
+import io
+import contextlib
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.eval_tools import evaluation, EvalAccumulator
+
+
+def legacy_evaluation(all_pred, all_labels, time_of_accidents, fps=20.0):
+    """ evaluation() of src/eval_tools.py before the sort-based sweep, verbatim """
+    preds_eval = []
+    min_pred = np.inf
+    n_frames = 0
+    for idx, toa in enumerate(time_of_accidents):
+        if all_labels[idx] > 0:
+            pred = all_pred[idx, :int(toa)]  # positive video
+        else:
+            pred = all_pred[idx, :]  # negative video
+        # find the minimum prediction
+        min_pred = np.min(pred) if min_pred > np.min(pred) else min_pred
+        preds_eval.append(pred)
+        n_frames += len(pred)
+    total_seconds = all_pred.shape[1] / fps
+
+    # iterate a set of thresholds from the minimum predictions
+    # temp_shape = int((1.0 - max(min_pred, 0)) / 0.001 + 0.5) 
+    Precision = np.zeros((n_frames))
+    Recall = np.zeros((n_frames))
+    Time = np.zeros((n_frames))
+    cnt = 0
+    for Th in np.arange(max(min_pred, 0), 1.0, 0.001):
+        Tp = 0.0
+        Tp_Fp = 0.0
+        Tp_Tn = 0.0
+        time = 0.0
+        counter = 0.0  # number of TP videos
+        # iterate each video sample
+        for i in range(len(preds_eval)):
+            # true positive frames: (pred->1) * (gt->1)
+            tp =  np.where(preds_eval[i]*all_labels[i]>=Th)
+            Tp += float(len(tp[0])>0)
+            if float(len(tp[0])>0) > 0:
+                # if at least one TP, compute the relative (1 - rTTA)
+                time += tp[0][0] / float(time_of_accidents[i])
+                counter = counter+1
+            # all positive frames
+            Tp_Fp += float(len(np.where(preds_eval[i]>=Th)[0])>0)
+        if Tp_Fp == 0:  # predictions of all videos are negative
+            continue
+        else:
+            Precision[cnt] = Tp/Tp_Fp
+        if np.sum(all_labels) ==0: # gt of all videos are negative
+            continue
+        else:
+            Recall[cnt] = Tp/np.sum(all_labels)
+        if counter == 0:
+            continue
+        else:
+            Time[cnt] = (1-time/counter)
+        cnt += 1
+    # sort the metrics with recall (ascending)
+    new_index = np.argsort(Recall)
+    Precision = Precision[new_index]
+    Recall = Recall[new_index]
+    Time = Time[new_index]
+    # unique the recall, and fetch corresponding precisions and TTAs
+    _,rep_index = np.unique(Recall,return_index=1)
+    rep_index = rep_index[1:]
+    new_Time = np.zeros(len(rep_index))
+    new_Precision = np.zeros(len(rep_index))
+    for i in range(len(rep_index)-1):
+         new_Time[i] = np.max(Time[rep_index[i]:rep_index[i+1]])
+         new_Precision[i] = np.max(Precision[rep_index[i]:rep_index[i+1]])
+    # sort by descending order
+    new_Time[-1] = Time[rep_index[-1]]
+    new_Precision[-1] = Precision[rep_index[-1]]
+    new_Recall = Recall[rep_index]
+    # compute AP (area under P-R curve)
+    AP = 0.0
+    if new_Recall[0] != 0:
+        AP += new_Precision[0]*(new_Recall[0]-0)
+    for i in range(1,len(new_Precision)):
+        AP += (new_Precision[i-1]+new_Precision[i])*(new_Recall[i]-new_Recall[i-1])/2
+
+    # transform the relative mTTA to seconds
+    mTTA = np.mean(new_Time) * total_seconds
+    print("Average Precision= %.4f, mean Time to accident= %.4f"%(AP, mTTA))
+    sort_time = new_Time[np.argsort(new_Recall)]
+    sort_recall = np.sort(new_Recall)
+    TTA_R80 = sort_time[np.argmin(np.abs(sort_recall-0.8))] * total_seconds
+    print("Recall@80%, Time to accident= " +"{:.4}".format(TTA_R80))
+
+    return AP, mTTA, TTA_R80
+
+
+def make_inputs(seed, n_videos=24, n_frames=50, decimals=None, all_negative=False):
+    """ :return: float32 predictions as the model outputs, the labels and the toas (n_frames + 1 for negative videos).
+    The labels are float64, as with float32 labels NumPy >= 2 computes the legacy recall in float32.
+    """
+    rng = np.random.RandomState(seed)
+    labels = np.zeros(n_videos) if all_negative else (np.arange(n_videos) % 2).astype(np.float64)
+    toas = np.where(labels > 0, rng.randint(n_frames // 2, n_frames, n_videos), n_frames + 1)
+    all_pred = rng.rand(n_videos, n_frames) * 0.6 + labels[:, None] * np.linspace(0, 0.4, n_frames)
+    if decimals is not None:
+        # many tied scores within and across videos
+        all_pred = np.round(all_pred, decimals)
+    return np.clip(all_pred, 0, 1).astype(np.float32), labels, toas
+
+
+def quiet(func, *args, **kwargs):
+    # the metrics are printed by evaluation()
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('decimals', [None, 1, 2])
+def test_grid_mode_reproduces_legacy(seed, decimals):
+    all_pred, labels, toas = make_inputs(seed, decimals=decimals)
+    expected = quiet(legacy_evaluation, all_pred, labels, toas, fps=20.0)
+    result = quiet(evaluation, all_pred, labels, toas, fps=20.0, mode='grid')
+    # equal up to the order of the floating point sums of the TTAs
+    np.testing.assert_allclose(result, expected, rtol=1e-12, atol=0)
+
+
+def test_grid_mode_of_accumulated_batches():
+    all_pred, labels, toas = make_inputs(3, n_videos=30)
+    accumulator = EvalAccumulator()
+    for start in range(0, 30, 4):
+        accumulator.update(all_pred[start:start + 4], labels[start:start + 4], toas[start:start + 4])
+    expected = quiet(legacy_evaluation, all_pred, labels, toas, fps=10.0)
+    np.testing.assert_allclose(quiet(accumulator.evaluate, fps=10.0, mode='grid'), expected, rtol=1e-12, atol=0)
+
+
+def test_grid_mode_all_negative():
+    # the legacy loop finds no valid threshold, and fails on the empty curve
+    all_pred, labels, toas = make_inputs(4, all_negative=True)
+    with pytest.raises(IndexError):
+        quiet(legacy_evaluation, all_pred, labels, toas)
+    with pytest.raises(IndexError):
+        quiet(evaluation, all_pred, labels, toas, mode='grid')
@@ -0,0 +1,16 @@
+""" src.inference only depends on torch and numpy, so that serving workers do not load the training, visualization
+and detection packages.
+"""
+import os, sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['matplotlib', 'sklearn', 'tensorboardX', 'networkx']
+
+
+def test_inference_does_not_import_heavy_modules():
+    # a fresh interpreter, since the other tests (or pytest plugins) may have imported them already
+    code = 'import sys, src.inference; print(" ".join(m for m in %r if m in sys.modules))' % (HEAVY_MODULES,)
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT, universal_newlines=True)
+    loaded = output.split()
+    assert loaded == [], 'src.inference imports %s' % (', '.join(loaded))